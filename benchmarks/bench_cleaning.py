@@ -0,0 +1,110 @@
+# ==========================================
+# 文本清理微基准
+# 对比旧的逐函数清理（每个缓冲块clean_asterisks + 全文再清理 + 六次re.sub）
+# 与预编译流水线的流式/整体清理耗时
+#
+# 用法:
+#   python benchmarks/bench_cleaning.py [--paragraphs 40] [--repeat 20]
+# ==========================================
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_cleaning import DOCX_LINE_PIPELINE, MODEL_OUTPUT_PIPELINE
+
+BUFFER_SIZE = 200
+
+
+# 旧实现（保留原样用于对比）
+def legacy_clean_asterisks(text):
+    if not text: return ""
+    return text.replace("*", "")
+
+
+def legacy_filter_ai_greeting(text):
+    greeting_patterns = [
+        r'^好的，作为.*?顾问.*?\n+',
+        r'^作为.*?顾问.*?\n+',
+        r'^我将.*?分析.*?\n+',
+        r'^下面我将.*?\n+',
+        r'^我会.*?帮助您.*?\n+',
+        r'^让我.*?为您.*?\n+'
+    ]
+    for pattern in greeting_patterns:
+        text = re.sub(pattern, '', text, flags=re.DOTALL)
+    return text
+
+
+# 生成模拟的模型输出
+def build_response(paragraphs):
+    parts = ["好的，作为一名资深的留学申请顾问，我将为您逐段分析。\n\n"]
+    for i in range(paragraphs):
+        parts.append(
+            "===SECTION===\n[[LOGIC]]\n**第%d段** 的核心论点是*学术动机*，需要补充课程细节。\n"
+            "[[DRAFT]]\n我在本科阶段系统学习了**数据结构**与算法，并在项目中应用了*机器学习*方法，"
+            "这段经历让我意识到跨学科研究的重要性。\n" % (i + 1)
+        )
+    return "".join(parts)
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def run_legacy(chunks):
+    full_response = ""
+    for chunk in chunks:
+        full_response += legacy_clean_asterisks(chunk)
+    full_response = legacy_clean_asterisks(full_response)
+    full_response = legacy_filter_ai_greeting(full_response)
+    lines = [line.replace('[[LOGIC]]', '').replace('[[DRAFT]]', '') for line in full_response.split("\n")]
+    return full_response, lines
+
+
+def run_pipeline(chunks):
+    cleaner = MODEL_OUTPUT_PIPELINE.stream()
+    parts = [cleaner.feed(chunk) for chunk in chunks]
+    parts.append(cleaner.flush())
+    full_response = "".join(parts)
+    lines = DOCX_LINE_PIPELINE.strip(full_response).split("\n")
+    return full_response, lines
+
+
+def timeit(fn, chunks, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(chunks)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="文本清理流水线微基准")
+    parser.add_argument("--paragraphs", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    text = build_response(args.paragraphs)
+    buffers = chunked(text, BUFFER_SIZE)
+
+    if run_legacy(buffers) != run_pipeline(buffers):
+        print("结果不一致！", file=sys.stderr)
+        return 1
+
+    legacy = timeit(run_legacy, buffers, args.repeat)
+    pipeline = timeit(run_pipeline, buffers, args.repeat)
+    print(f"文本长度: {len(text)} 字符, 缓冲块: {len(buffers)}")
+    print(f"旧实现:   {legacy * 1000:.3f} ms")
+    print(f"流水线:   {pipeline * 1000:.3f} ms")
+    print(f"加速比:   {legacy / pipeline:.2f}x" if pipeline else "")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+# ==========================================
+# 流式渲染微基准
+# 用模拟占位符（渲染耗时与文本长度成正比）对比旧的整篇重绘策略
+# 与自适应分段渲染的重发字符数和渲染耗时
+#
+# 用法:
+#   python benchmarks/bench_stream_render.py [--sections 60] [--chunk 40]
+# ==========================================
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stream_render import AdaptiveStreamRenderer
+
+BUFFER_SIZE = 200
+UPDATE_INTERVAL = 0.05
+CURSOR = '<span class="streaming-cursor"></span>'
+
+# 每个字符的模拟渲染耗时（秒）
+COST_PER_CHAR = 2e-6
+# 模拟的模型出字间隔（秒/块）
+CHUNK_INTERVAL = 0.01
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakePlaceholder:
+    """记录重发字符数，并按文本长度推进模拟时钟"""
+
+    def __init__(self, clock, totals):
+        self.clock = clock
+        self.totals = totals
+        self.text = ""
+
+    def markdown(self, text, unsafe_allow_html=False):
+        self.clock.now += len(text) * COST_PER_CHAR
+        self.totals["chars"] += len(text)
+        self.totals["flushes"] += 1
+        self.text = text
+
+
+def build_response(sections):
+    section = "===SECTION===\n[[LOGIC]]\n" + "逻辑说明。" * 120 + "\n[[DRAFT]]\n" + "正文内容。" * 300 + "\n"
+    return section * sections
+
+
+def run_legacy(text, chunk):
+    clock, totals = FakeClock(), {"chars": 0, "flushes": 0}
+    placeholder = FakePlaceholder(clock, totals)
+    full_response, buffer, last_update = "", "", clock()
+    for i in range(0, len(text), chunk):
+        buffer += text[i:i + chunk]
+        clock.now += CHUNK_INTERVAL
+        if len(buffer) >= BUFFER_SIZE or (clock() - last_update) >= UPDATE_INTERVAL:
+            full_response += buffer
+            placeholder.markdown(full_response + CURSOR)
+            buffer, last_update = "", clock()
+    placeholder.markdown(full_response + buffer)
+    return totals, clock.now
+
+
+def run_adaptive(text, chunk):
+    clock, totals = FakeClock(), {"chars": 0, "flushes": 0}
+    renderer = AdaptiveStreamRenderer(lambda: FakePlaceholder(clock, totals), buffer_size=BUFFER_SIZE,
+                                      min_interval=UPDATE_INTERVAL, clock=clock)
+    for i in range(0, len(text), chunk):
+        clock.now += CHUNK_INTERVAL
+        renderer.feed(text[i:i + chunk])
+    renderer.close()
+    return totals, clock.now
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="流式渲染微基准")
+    parser.add_argument("--sections", type=int, default=60)
+    parser.add_argument("--chunk", type=int, default=40)
+    args = parser.parse_args(argv)
+
+    text = build_response(args.sections)
+    print(f"输出长度: {len(text)} 字符")
+    for name, fn in (("整篇重绘", run_legacy), ("自适应分段", run_adaptive)):
+        totals, elapsed = fn(text, args.chunk)
+        print(f"{name}: 刷新 {totals['flushes']} 次, 重发 {totals['chars']} 字符, 模拟总耗时 {elapsed:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# ==========================================
+# 基准测试语料
+# 合成语料按 长度(short/long) × 语言(cjk/english/mixed) 组合，固定随机种子保证可复现；
+# 真实个人陈述放在 --corpus-dir 指定的目录下的 .txt 文件中，加载时先做匿名化处理；
+# 仓库中的 benchmarks/samples/ 只包含人工撰写的示例，不含真实申请人的文本
+# ==========================================
+import os
+import random
+import re
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples")
+
+CORPUS_SEED = 20240601
+
+# 各长度档位的目标字符数
+LENGTH_TARGETS = {"short": 1500, "long": 12000}
+
+CJK_SENTENCES = (
+    "我在本科阶段系统学习了数据结构、算法设计与分析等核心课程，",
+    "这段经历让我意识到跨学科研究对于解决实际问题的重要性。",
+    "在导师的指导下，我独立完成了基于深度学习的图像分割项目，",
+    "实习期间我负责搭建数据清洗流程，将报表生成时间缩短了一半。",
+    "贵校课程设置中的统计学习与优化方法模块与我的研究方向高度契合，",
+    "未来我希望在人工智能与公共政策的交叉领域继续深造。",
+)
+
+ENGLISH_SENTENCES = (
+    "During my undergraduate studies I built a solid foundation in linear algebra and probability. ",
+    "My internship at a consulting firm taught me how to translate messy data into clear recommendations. ",
+    "I led a team of four students to design a low-cost sensor network for campus air quality monitoring. ",
+    "The programme's emphasis on applied research aligns closely with my long-term career goals. ",
+    "This experience sparked my motivation to study how machine learning can support public health. ",
+    "I am particularly drawn to the course on causal inference and its use in policy evaluation. ",
+)
+
+LOGIC_TEMPLATES = (
+    "本段功能识别：[{topic}]\n修改思路：补充具体课程细节，强化与目标项目的关联。",
+    "功能：{topic}\n保留原有经历，压缩背景描述。",
+    "该段主要讲述研究经历与学术兴趣的形成，需要补充量化成果。",
+    "This paragraph explains career motivation; tighten the opening sentence.",
+)
+
+TOPICS = ("动机", "学术背景", "研究经历", "工作经历", "职业规划", "择校理由")
+
+GREETING_PREFIX = "好的，作为一名资深的留学申请顾问，我将为您逐段分析这篇个人陈述。\n\n"
+
+# 匿名化规则：邮箱、电话、学号/证件号、人名、学校名
+ANONYMIZE_PATTERNS = (
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+"), "<EMAIL>"),
+    (re.compile(r"\+?\d[\d\s-]{7,}\d"), "<PHONE>"),
+    (re.compile(r"\b[A-Z]{1,2}\d{6,}\b"), "<ID>"),
+    (re.compile(r"\b(?:Mr|Ms|Mrs|Dr|Prof)\.?\s+[A-Z][a-z]+(?:\s+[A-Z][a-z]+)?"), "<NAME>"),
+    (re.compile(r"(?<=我叫|我是)[一-鿿]{2,3}(?=[，。,\s])"), "<姓名>"),
+    (re.compile(r"(?:(?<=[于在从，。、\s])|^)[一-鿿]{2,6}?(?:大学|学院)"), "<学校>"),
+    (re.compile(r"\b(?:University|College|Institute) of [A-Z][\w ]+?(?=[,.;]|\s[a-z])"), "<UNIVERSITY>"),
+)
+
+
+# 匿名化真实文本
+def anonymize(text):
+    """去除邮箱、电话、证件号、人名和学校名"""
+    for pattern, replacement in ANONYMIZE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+# 生成一段合成文本
+def synthesize_text(language, target_chars, rng):
+    """按语言拼接句子直到达到目标长度，每4~6句分一段"""
+    if language == "cjk":
+        pools = (CJK_SENTENCES,)
+    elif language == "english":
+        pools = (ENGLISH_SENTENCES,)
+    else:
+        pools = (CJK_SENTENCES, ENGLISH_SENTENCES)
+
+    paragraphs = []
+    length = 0
+    while length < target_chars:
+        sentences = [rng.choice(rng.choice(pools)) for _ in range(rng.randint(4, 6))]
+        paragraph = "".join(sentences).strip()
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+# 对文本做少量随机修改，模拟模型的修改结果
+def perturb_text(text, rng, ratio=0.05):
+    """随机替换约ratio比例的句子片段，并用**标记修改处"""
+    tokens = re.findall(r"\w+|[^\w\s]|\s+", text)
+    for pos in range(len(tokens)):
+        if not tokens[pos].isspace() and rng.random() < ratio:
+            tokens[pos] = f"**{rng.choice(('显著', 'significantly', '进一步', 'rigorous'))}**"
+    return "".join(tokens)
+
+
+class CorpusItem:
+    """一份语料：全文、段落列表以及对应的逻辑说明"""
+
+    def __init__(self, name, text, source):
+        self.name = name
+        self.text = text
+        self.source = source
+        self.paragraphs = [p for p in text.split("\n\n") if p.strip()]
+        self.logic_texts = [LOGIC_TEMPLATES[i % len(LOGIC_TEMPLATES)].format(topic=TOPICS[i % len(TOPICS)])
+                            for i in range(len(self.paragraphs))]
+
+    def __len__(self):
+        return len(self.text)
+
+
+# 构建合成语料
+def synthetic_corpus(seed=CORPUS_SEED):
+    """返回 length × language 的六份合成语料"""
+    rng = random.Random(seed)
+    items = []
+    for length_name, target_chars in LENGTH_TARGETS.items():
+        for language in ("cjk", "english", "mixed"):
+            text = synthesize_text(language, target_chars, rng)
+            items.append(CorpusItem(f"{length_name}_{language}", text, "synthetic"))
+    return items
+
+
+# 加载真实语料
+def sample_corpus(directory=SAMPLES_DIR):
+    """加载目录下的 .txt 个人陈述，加载时匿名化"""
+    items = []
+    if not directory or not os.path.isdir(directory):
+        return items
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".txt"):
+            continue
+        with open(os.path.join(directory, file_name), "r", encoding="utf-8") as f:
+            text = anonymize(f.read())
+        items.append(CorpusItem(f"sample_{os.path.splitext(file_name)[0]}", text, "sample"))
+    return items
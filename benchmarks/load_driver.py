@@ -0,0 +1,178 @@
+# ==========================================
+# 多会话压测驱动
+# 用 streamlit.testing.v1.AppTest 在同一进程内无界面运行多个 psr.py 会话，
+# 模型调用走本地模拟后端 (PSR_BACKEND=mock)，不消耗API配额；
+# 按并发用户数逐级加压，统计每个步骤的延迟、吞吐量和错误数
+#
+# 用法:
+#   python benchmarks/load_driver.py --users 1,2,4,8 --iterations 2
+#   python benchmarks/load_driver.py --users 4 --tokens-per-second 200 --error-rate 0.05 --output load.json
+# ==========================================
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+APP_PATH = os.path.join(REPO_DIR, "psr.py")
+sys.path.insert(0, REPO_DIR)
+
+from corpus import synthetic_corpus
+
+# 每个会话依次执行的步骤
+SESSION_STEPS = ("initial_load", "analysis", "start_editing", "translate_paragraph", "confirm_paragraph")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _find_by_label(widgets, label):
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"未找到控件: {label}")
+
+
+def _timed_run(at, timings, step):
+    started = time.perf_counter()
+    at.run()
+    timings[step] = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(f"{step}: {at.exception[0].message}")
+
+
+def _wait_for_job(at, timings, step, timeout, poll_seconds=0.2):
+    """全文分析在后台任务中运行，重跑脚本直到任务结束（相当于界面的定时轮询）"""
+    started = time.perf_counter() - timings.get(step, 0.0)
+    deadline = time.perf_counter() + timeout
+    while at.session_state["analysis_job_id"]:
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"{step}: 后台任务超时")
+        time.sleep(poll_seconds)
+        at.run()
+        if at.exception:
+            raise RuntimeError(f"{step}: {at.exception[0].message}")
+    timings[step] = time.perf_counter() - started
+
+
+# 运行一个完整的用户会话
+def run_session(session_id, ps_text, timeout):
+    """上传文书 → 生成分析 → 开始编辑 → 翻译第一段 → 确认第一段，返回各步骤耗时"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.secrets["GOOGLE_API_KEY"] = ""
+    timings = {}
+
+    _timed_run(at, timings, "initial_load")
+
+    at.text_area(key="ps_content").input(ps_text)
+    # 每个会话使用不同的学校，避免命中响应缓存
+    _find_by_label(at.text_input, "目标学校").input(f"Mock University {session_id}")
+    _find_by_label(at.text_input, "目标专业").input("MS in Data Science")
+    _find_by_label(at.button, "1. 开始生成").click()
+    _timed_run(at, timings, "analysis")
+    _wait_for_job(at, timings, "analysis", timeout)
+    if not at.session_state["sections_data"]:
+        raise RuntimeError("analysis: 未解析出段落")
+
+    at.button(key="start_editing_btn").click()
+    _timed_run(at, timings, "start_editing")
+
+    at.button(key="btn_us_0").click()
+    _timed_run(at, timings, "translate_paragraph")
+
+    at.button(key="confirm_p_0").click()
+    _timed_run(at, timings, "confirm_paragraph")
+    return timings
+
+
+# 以指定并发数运行一级压测
+def run_level(users, iterations, ps_texts, timeout):
+    started = time.perf_counter()
+    results, errors = [], []
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        futures = []
+        for iteration in range(iterations):
+            for user in range(users):
+                session_id = f"{users}-{iteration}-{user}"
+                futures.append(executor.submit(run_session, session_id, ps_texts[user % len(ps_texts)], timeout))
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(str(e))
+    wall = time.perf_counter() - started
+
+    steps = {}
+    for step in SESSION_STEPS:
+        values = sorted(r[step] for r in results if step in r)
+        steps[step] = {"p50_s": percentile(values, 50), "p95_s": percentile(values, 95)}
+    return {
+        "users": users,
+        "sessions": len(results),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "wall_seconds": wall,
+        "sessions_per_minute": len(results) / wall * 60 if wall else 0.0,
+        "steps": steps,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="psr.py 多会话压测（模拟模型后端）")
+    parser.add_argument("--users", default="1,2,4,8", help="逐级加压的并发用户数，逗号分隔")
+    parser.add_argument("--iterations", type=int, default=1, help="每个用户在每一级重复的会话数")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="模拟出字速率")
+    parser.add_argument("--first-token-seconds", type=float, default=0.5, help="模拟首字延迟")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟调用出错概率")
+    parser.add_argument("--recordings", help="回放的录制文件或目录")
+    parser.add_argument("--rpm", type=float, default=6000, help="调用治理层每分钟请求上限")
+    parser.add_argument("--concurrency", type=int, default=64, help="调用治理层并发上限")
+    parser.add_argument("--timeout", type=float, default=300, help="单次脚本运行的超时秒数")
+    parser.add_argument("--output", help="将结果写入JSON文件")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # 必须在应用首次创建模型注册表和调用治理器之前设置
+    os.environ["PSR_BACKEND"] = "mock"
+    os.environ["PSR_MOCK_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+    os.environ["PSR_MOCK_FIRST_TOKEN_SECONDS"] = str(args.first_token_seconds)
+    os.environ["PSR_MOCK_ERROR_RATE"] = str(args.error_rate)
+    os.environ["PSR_REQUESTS_PER_MINUTE"] = str(args.rpm)
+    os.environ["PSR_BURST"] = str(max(1, int(args.rpm / 60)))
+    os.environ["PSR_MAX_CONCURRENCY"] = str(args.concurrency)
+    if args.recordings:
+        os.environ["PSR_MOCK_RECORDINGS"] = args.recordings
+
+    ps_texts = [item.text for item in synthetic_corpus() if item.name.startswith("short_")]
+    levels = []
+    for users in (int(u) for u in args.users.split(",") if u.strip()):
+        level = run_level(users, args.iterations, ps_texts, args.timeout)
+        levels.append(level)
+        steps = ", ".join(f"{step} p50 {s['p50_s']:.2f}s/p95 {s['p95_s']:.2f}s" for step, s in level["steps"].items())
+        print(f"[{users} 用户] 会话 {level['sessions']} 个, 错误 {level['errors']} 个, "
+              f"{level['sessions_per_minute']:.1f} 会话/分钟, RSS {level['max_rss_mb']:.0f} MB")
+        print(f"    {steps}")
+        for sample in level["error_samples"]:
+            print(f"    错误: {sample}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "levels": levels}, f, ensure_ascii=False, indent=2)
+    return 1 if any(level["errors"] for level in levels) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
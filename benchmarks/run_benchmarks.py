@@ -0,0 +1,306 @@
+# ==========================================
+# 文本处理与导出热点函数基准测试
+# 对每个函数 × 每份语料测量延迟分布(p50/p99)、吞吐量和峰值内存，
+# 并与保存的基线比较，p50或峰值内存超出容差即视为性能回退（退出码1）；
+# 带有延迟预算的用例（如 diff_budget）p50超出预算同样返回退出码1
+#
+# 用法:
+#   python benchmarks/run_benchmarks.py                     # 运行并与 baseline.json 比较
+#   python benchmarks/run_benchmarks.py --update-baseline   # 运行并覆盖基线
+#   python benchmarks/run_benchmarks.py --filter highlight --corpus-dir /path/to/anonymized_ps
+# ==========================================
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from corpus import CORPUS_SEED, GREETING_PREFIX, SAMPLES_DIR, perturb_text, sample_corpus, synthetic_corpus
+from stubs import StubUploadedFile, make_editing_state
+
+from doc_ingest import clear_ingest_cache
+from paragraph_store import rebuild_store_from_state
+from vocab_lint import lint_text
+from psr_core import (
+    HAS_DOCX, contains_chinese, create_docx_smart, extract_paragraph_topic, extract_text_from_file,
+    filter_ai_greeting, highlight_differences,
+)
+from text_diff import DIFF_LATENCY_BUDGET_MS
+
+DEFAULT_BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+# 每个用例的最少迭代次数和时间预算
+MIN_ITERATIONS = 10
+MAX_SECONDS_PER_CASE = 1.0
+WARMUP_ITERATIONS = 2
+ROUNDS = 3
+
+# 超出基线的容差比例；计时在共享机器上波动较大，内存峰值基本确定
+DEFAULT_TOLERANCE = 0.5
+DEFAULT_MEMORY_TOLERANCE = 0.1
+
+# 低于该量级的指标受计时和分配噪声影响大，不参与回退判断
+COMPARE_FLOORS = {"p50_ms": 0.2, "peak_kb": 16.0}
+
+# 差异比较延迟预算用例的文本长度（字符）
+DIFF_BUDGET_CHARS = 10000
+
+
+class BenchCase:
+    """一个基准用例：setup() 在每次计时前调用且不计入耗时；budget_ms 为p50的绝对上限（可选）"""
+
+    def __init__(self, function, corpus, fn, size, setup=None, budget_ms=None):
+        self.function = function
+        self.corpus = corpus
+        self.fn = fn
+        self.size = size
+        self.setup = setup
+        self.budget_ms = budget_ms
+
+    @property
+    def key(self):
+        return f"{self.function}/{self.corpus}"
+
+
+# 为每份语料构建所有用例
+def build_cases(corpus_items):
+    cases = []
+    for item in corpus_items:
+        text = item.text
+        size = len(text.encode("utf-8"))
+        rng = random.Random(f"{CORPUS_SEED}:{item.name}")
+
+        upload = StubUploadedFile(text.encode("utf-8"), f"{item.name}.txt")
+        cases.append(BenchCase("extract_text_from_file[txt]", item.name,
+                               lambda upload=upload: extract_text_from_file(upload), size, clear_ingest_cache))
+        if HAS_DOCX:
+            docx_bytes = create_docx_smart(text).getvalue()
+            docx_upload = StubUploadedFile(docx_bytes, f"{item.name}.docx")
+            cases.append(BenchCase("extract_text_from_file[docx]", item.name,
+                                   lambda upload=docx_upload: extract_text_from_file(upload), len(docx_bytes),
+                                   clear_ingest_cache))
+
+        refined = perturb_text(text, rng)
+        cases.append(BenchCase("highlight_differences", item.name,
+                               lambda text=text, refined=refined: highlight_differences(text, refined), size))
+
+        greeted = GREETING_PREFIX + text
+        cases.append(BenchCase("filter_ai_greeting", item.name,
+                               lambda greeted=greeted: filter_ai_greeting(greeted), size))
+
+        cases.append(BenchCase("contains_chinese", item.name, lambda text=text: contains_chinese(text), size))
+
+        cases.append(BenchCase("lint_text", item.name, lambda refined=refined: lint_text(refined), size))
+
+        logic_texts = item.logic_texts
+        cases.append(BenchCase("extract_paragraph_topic", item.name,
+                               lambda logic_texts=logic_texts: [extract_paragraph_topic(t) for t in logic_texts],
+                               sum(len(t.encode("utf-8")) for t in logic_texts)))
+
+        # rebuild_final_preview 的核心逻辑，使用会话状态替身运行
+        state = make_editing_state(item.paragraphs, item.logic_texts)
+        cases.append(BenchCase("rebuild_final_preview", item.name,
+                               lambda state=state: rebuild_store_from_state(state), size))
+
+        if HAS_DOCX:
+            cases.append(BenchCase("create_docx_smart", item.name,
+                                   lambda refined=refined: create_docx_smart(refined, "Computer Science"), size))
+
+    cases.extend(build_diff_budget_cases(corpus_items))
+    return cases
+
+
+# 差异比较的延迟预算：10,000字符的段落约5%改动和整段重写（改写为另一份语料）
+def build_diff_budget_cases(corpus_items):
+    long_items = [item for item in corpus_items if len(item.text) >= DIFF_BUDGET_CHARS]
+    cases = []
+    for index, item in enumerate(long_items):
+        text = item.text[:DIFF_BUDGET_CHARS]
+        size = len(text.encode("utf-8"))
+        rng = random.Random(f"{CORPUS_SEED}:{item.name}:budget")
+        rewritten = long_items[(index + 1) % len(long_items)].text[:DIFF_BUDGET_CHARS]
+        variants = [("5%", perturb_text(text, rng))]
+        if len(long_items) > 1:
+            variants.append(("rewrite", rewritten))
+        for label, refined in variants:
+            cases.append(BenchCase(f"diff_budget[{label}]", item.name,
+                                   lambda text=text, refined=refined: highlight_differences(text, refined), size,
+                                   budget_ms=DIFF_LATENCY_BUDGET_MS))
+    return cases
+
+
+# 检查延迟预算
+def check_budgets(cases, results):
+    """返回超出预算的用例列表 [(用例, 预算, 当前p50)]"""
+    return [(case.key, case.budget_ms, results[case.key]["p50_ms"]) for case in cases
+            if case.budget_ms is not None and results[case.key]["p50_ms"] > case.budget_ms]
+
+
+# 按最近秩法计算分位数
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+# 运行单个用例
+def measure(case, min_iterations=MIN_ITERATIONS, max_seconds=MAX_SECONDS_PER_CASE):
+    """返回延迟分位数、吞吐量和峰值内存"""
+    for _ in range(WARMUP_ITERATIONS):
+        if case.setup:
+            case.setup()
+        case.fn()
+
+    # 分多轮计时，取各轮p50的最小值，降低机器负载波动的影响
+    latencies = []
+    round_p50s = []
+    # 与timeit一样在计时期间关闭垃圾回收
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(ROUNDS):
+            round_latencies = []
+            budget_end = time.perf_counter() + max_seconds / ROUNDS
+            while len(round_latencies) < min_iterations or time.perf_counter() < budget_end:
+                if case.setup:
+                    case.setup()
+                started = time.perf_counter()
+                case.fn()
+                round_latencies.append(time.perf_counter() - started)
+                if len(round_latencies) >= min_iterations * 50:
+                    break
+            round_latencies.sort()
+            round_p50s.append(percentile(round_latencies, 50))
+            latencies.extend(round_latencies)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    # 峰值内存单独测量一次，避免tracemalloc的开销影响计时
+    if case.setup:
+        case.setup()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    case.fn()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "iterations": len(latencies),
+        "p50_ms": min(round_p50s) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "ops_per_sec": len(latencies) / total if total else 0.0,
+        "mb_per_sec": case.size * len(latencies) / total / 1e6 if total else 0.0,
+        "peak_kb": peak_bytes / 1024,
+        "input_bytes": case.size,
+    }
+
+
+# 与基线比较
+def compare(results, baseline, tolerance, memory_tolerance=DEFAULT_MEMORY_TOLERANCE):
+    """返回回退列表 [(用例, 指标, 基线值, 当前值)]"""
+    tolerances = {"p50_ms": tolerance, "peak_kb": memory_tolerance}
+    regressions = []
+    for key, current in results.items():
+        reference = baseline.get(key)
+        if not reference:
+            continue
+        for metric, floor in COMPARE_FLOORS.items():
+            limit = max(reference.get(metric) or 0.0, floor) * (1 + tolerances[metric])
+            if current[metric] > limit:
+                regressions.append((key, metric, reference[metric], current[metric]))
+    return regressions
+
+
+def print_table(results, baseline):
+    header = f"{'用例':<48} {'次数':>6} {'p50 ms':>9} {'p99 ms':>9} {'ops/s':>10} {'MB/s':>8} {'峰值KB':>9} {'p50对比':>8}"
+    print(header)
+    print("-" * len(header))
+    for key, r in results.items():
+        reference = baseline.get(key, {}).get("p50_ms")
+        delta = f"{(r['p50_ms'] / reference - 1) * 100:+.0f}%" if reference else "-"
+        print(f"{key:<48} {r['iterations']:>6} {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f} "
+              f"{r['ops_per_sec']:>10.1f} {r['mb_per_sec']:>8.2f} {r['peak_kb']:>9.1f} {delta:>8}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="文本处理与导出热点函数基准测试")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--corpus-dir", default=SAMPLES_DIR, help="匿名化真实个人陈述(.txt)所在目录")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="基线JSON路径")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果覆盖基线")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="p50延迟允许超出基线的比例")
+    parser.add_argument("--memory-tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE, help="峰值内存允许超出基线的比例")
+    parser.add_argument("--max-seconds", type=float, default=MAX_SECONDS_PER_CASE, help="每个用例的时间预算")
+    parser.add_argument("--output", help="将本次结果写入JSON文件")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    corpus_items = synthetic_corpus() + sample_corpus(args.corpus_dir)
+    cases = [case for case in build_cases(corpus_items) if args.filter in case.key]
+    if not HAS_DOCX:
+        print("未安装python-docx，跳过 create_docx_smart 和 docx 解析用例")
+
+    results = {}
+    for case in cases:
+        results[case.key] = measure(case, max_seconds=args.max_seconds)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+
+    print_table(results, baseline)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        # 只更新本次运行的用例，保留其他用例的基线
+        merged = dict(baseline)
+        merged.update(results)
+        report["results"] = merged
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已更新: {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+    over_budget = check_budgets(cases, results)
+    if over_budget:
+        print(f"\n{len(over_budget)} 项超出延迟预算:")
+        for key, budget_ms, current in over_budget:
+            print(f"  {key} p50: {current:.3f} ms > 预算 {budget_ms} ms")
+    if regressions:
+        print(f"\n检测到 {len(regressions)} 项性能回退 (延迟容差 {args.tolerance:.0%}, 内存容差 {args.memory_tolerance:.0%}):")
+        for key, metric, reference, current in regressions:
+            print(f"  {key} {metric}: {reference:.3f} → {current:.3f}")
+        return 1
+    if over_budget:
+        return 1
+    if baseline:
+        print("\n未检测到性能回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
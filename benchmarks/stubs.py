@@ -0,0 +1,45 @@
+# ==========================================
+# 无界面运行所需的替身对象
+# 模拟 st.session_state 和 Streamlit 上传文件，基准测试不需要启动Streamlit
+# ==========================================
+from io import BytesIO
+
+from paragraph_store import ParagraphStore
+
+
+class StubSessionState(dict):
+    """同时支持 state['key'] 和 state.key 访问的会话状态替身"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class StubUploadedFile(BytesIO):
+    """带有name属性的上传文件替身，接口与 st.file_uploader 返回值一致"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+# 构造编辑阶段的会话状态
+def make_editing_state(paragraphs, logic_texts=None, confirmed_ratio=1.0, edited_every=3):
+    """按段落列表构造会话状态：前confirmed_ratio比例的段落已确认，每edited_every段有文本框修改"""
+    logic_texts = logic_texts or [""] * len(paragraphs)
+    state = StubSessionState(
+        sections_data=[{"logic": logic, "draft": draft} for logic, draft in zip(logic_texts, paragraphs)],
+        confirmed_paragraphs=set(range(int(len(paragraphs) * confirmed_ratio))),
+        confirmed_contents={},
+        refine_results={},
+        paragraph_store=ParagraphStore(),
+    )
+    for idx, draft in enumerate(paragraphs):
+        if edited_every and idx % edited_every == 0:
+            state[f"draft_p_{idx}"] = draft + " (edited)"
+    return state
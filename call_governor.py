@@ -0,0 +1,266 @@
+# ==========================================
+# 模型调用治理层
+# 所有generate_content调用都经过这里：按API Key的令牌桶限速、
+# 跨会话共享的并发信号量、带抖动的指数退避重试，
+# 流式调用中途失败时携带已输出内容续写；
+# 配置共享存储时每分钟请求数按API Key在所有工作进程间共同计数
+# ==========================================
+import hashlib
+import random
+import re
+import threading
+import time
+
+# 可重试的异常类型名（google.api_core.exceptions），按名称匹配避免硬依赖
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+    "InternalServerError", "GatewayTimeout", "ServerError",
+}
+# 限流类异常类型名，收到后暂停发放令牌
+RATE_LIMIT_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests"}
+
+# 可重试的HTTP状态码
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 无法识别类型和状态码时按错误信息判断；状态码必须是独立的数字，避免把 "1500 tokens" 当成500
+RETRYABLE_MESSAGE_RE = re.compile(
+    r"(?<![\w.])(?:429|500|502|503|504)(?![\w.])|\bresource (?:has been )?exhausted\b|\bunavailable\b"
+    r"|\bdeadline exceeded\b|\btimed out\b|\btimeout\b",
+    re.IGNORECASE,
+)
+RATE_LIMIT_MESSAGE_RE = re.compile(r"(?<![\w.])429(?![\w.])|\bresource (?:has been )?exhausted\b", re.IGNORECASE)
+
+
+# 读取异常携带的HTTP状态码
+def _status_code(error):
+    """google.api_core 异常的 code 为HTTP状态码，HTTP库的异常为 status_code；取不到时返回None"""
+    for attr in ("code", "status_code"):
+        code = getattr(error, attr, None)
+        if isinstance(code, int) and not isinstance(code, bool):
+            return code
+    return None
+
+
+# 按异常类型、状态码、错误信息的顺序分类
+def _classify(error, names, codes, message_re):
+    """类型名命中即成立；带状态码时只看状态码；两者都没有才匹配错误信息"""
+    if any(cls.__name__ in names for cls in type(error).__mro__):
+        return True
+    code = _status_code(error)
+    if code is not None:
+        return code in codes
+    return message_re.search(str(error)) is not None
+
+
+# 判断异常是否可重试
+def is_retryable_error(error):
+    """限流、服务不可用和超时类错误可以重试"""
+    return _classify(error, RETRYABLE_ERROR_NAMES, RETRYABLE_STATUS_CODES, RETRYABLE_MESSAGE_RE)
+
+
+# 判断异常是否为限流
+def is_rate_limit_error(error):
+    """配额耗尽（429）时需要让令牌桶暂停发放"""
+    return _classify(error, RATE_LIMIT_ERROR_NAMES, {429}, RATE_LIMIT_MESSAGE_RE)
+
+
+class TokenBucket:
+    """令牌桶限速器：每分钟补充rate个令牌，最多积攒capacity个"""
+
+    def __init__(self, rate_per_minute, capacity):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，不足时阻塞等待，返回等待的秒数"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._blocked_until and self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return waited
+                if now < self._blocked_until:
+                    delay = self._blocked_until - now
+                else:
+                    delay = (1.0 - self.tokens) / self.rate if self.rate else 1.0
+            time.sleep(delay)
+            waited += delay
+
+    def penalize(self, seconds):
+        """收到429后暂停发放令牌，避免其他调用继续冲击配额"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+class SharedRateLimiter:
+    """跨进程限速：本进程的令牌桶平滑突发，共享存储中的按分钟计数保证所有进程合计不超过配额；
+    接口与 TokenBucket 一致。共享存储不可用时只按本进程限速"""
+
+    # 窗口计数的保留时间（秒），略长于一个窗口
+    WINDOW_TTL = 120
+
+    def __init__(self, store, api_key, rate_per_minute, capacity):
+        self.store = store
+        self.rate_per_minute = rate_per_minute
+        self.local = TokenBucket(rate_per_minute, capacity)
+        # 共享存储中不保存API Key原文
+        self.key = "ratelimit:" + hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+    def acquire(self):
+        """先取本进程令牌，再占用共享的分钟窗口名额；当前窗口已满时等到下一个窗口，返回等待的秒数。
+        被拒绝的尝试不计入窗口计数"""
+        waited = self.local.acquire()
+        while True:
+            now = time.time()
+            blocked_until = self.store.get(self.key + ":blocked")
+            if blocked_until is not None and float(blocked_until) > now:
+                delay = float(blocked_until) - now
+            else:
+                window = int(now // 60)
+                window_key = f"{self.key}:{window}"
+                current = self.store.get(window_key)
+                if current is None or int(current) < self.rate_per_minute:
+                    count = self.store.incr(window_key, ttl=self.WINDOW_TTL)
+                    if count is None or count <= self.rate_per_minute:
+                        return waited
+                    # 与其他进程同时抢最后的名额时失败，退还本次计数
+                    self.store.incr(window_key, ttl=self.WINDOW_TTL, amount=-1)
+                # 加少量抖动，避免所有进程在窗口开始时同时发出请求
+                delay = (window + 1) * 60 - now + random.uniform(0, 1)
+            time.sleep(delay)
+            waited += delay
+
+    def penalize(self, seconds):
+        """收到429后所有进程一起暂停"""
+        self.local.penalize(seconds)
+        self.store.set(self.key + ":blocked", repr(time.time() + seconds), ttl=seconds + 1)
+
+
+class CallGovernor:
+    """进程内共享的调用治理器，限速、限并发并自动重试"""
+
+    def __init__(self, requests_per_minute=30, burst=5, max_concurrency=8, max_retries=4,
+                 base_delay=1.0, max_delay=30.0, shared_store=None):
+        self.requests_per_minute = requests_per_minute
+        self.shared_store = shared_store
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.stream_resumes = 0
+        self.throttled_seconds = 0.0
+
+    def bucket_for(self, api_key):
+        """返回指定API Key的令牌桶"""
+        with self._lock:
+            bucket = self._buckets.get(api_key)
+            if bucket is None:
+                if self.shared_store is not None:
+                    bucket = SharedRateLimiter(self.shared_store, api_key, self.requests_per_minute, self.burst)
+                else:
+                    bucket = TokenBucket(self.requests_per_minute, self.burst)
+                self._buckets[api_key] = bucket
+            return bucket
+
+    def backoff_delay(self, attempt):
+        """带完全抖动的指数退避时间"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, fn, api_key=None, on_retry=None):
+        """执行一次非流式调用，可重试错误按退避策略重试；每次重试前调用 on_retry(error)"""
+        bucket = self.bucket_for(api_key)
+        attempt = 0
+        while True:
+            self._record_wait(bucket.acquire())
+            with self._semaphore:
+                self._count("calls")
+                try:
+                    return fn()
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable_error(e):
+                        self._count("failures")
+                        raise
+                    error = e
+            delay = self.backoff_delay(attempt)
+            if is_rate_limit_error(error):
+                bucket.penalize(delay)
+            self._count("retries")
+            if on_retry is not None:
+                on_retry(error)
+            attempt += 1
+            time.sleep(delay)
+
+    def stream(self, start_stream, api_key=None, on_retry=None):
+        """执行流式调用并逐块产出文本
+
+        start_stream(partial_text) 返回响应流；中途失败时以已输出的文本再次调用，
+        由调用方构造续写请求，只产出新增的内容。每次重试前调用 on_retry(error)。
+        """
+        bucket = self.bucket_for(api_key)
+        partial = []
+        attempt = 0
+        while True:
+            self._record_wait(bucket.acquire())
+            with self._semaphore:
+                self._count("calls")
+                try:
+                    response_stream = start_stream("".join(partial))
+                    for chunk in response_stream:
+                        try:
+                            text = chunk.text
+                        except Exception:
+                            # 被过滤或不含文本的块直接跳过
+                            continue
+                        if text:
+                            partial.append(text)
+                            yield text
+                    return
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable_error(e):
+                        self._count("failures")
+                        raise
+                    error = e
+            delay = self.backoff_delay(attempt)
+            if is_rate_limit_error(error):
+                bucket.penalize(delay)
+            self._count("retries")
+            if on_retry is not None:
+                on_retry(error)
+            if partial:
+                self._count("stream_resumes")
+            attempt += 1
+            time.sleep(delay)
+
+    def stats(self):
+        """返回调用统计"""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "stream_resumes": self.stream_resumes,
+                "throttled_seconds": self.throttled_seconds,
+            }
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _record_wait(self, seconds):
+        if seconds:
+            with self._lock:
+                self.throttled_seconds += seconds
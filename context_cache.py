@@ -0,0 +1,220 @@
+# ==========================================
+# 提示词前缀缓存
+# 提示词拆成静态前缀和本次调用的后缀：前缀（全文分析的规则和输出格式）在多次调用间不变，
+# 达到服务端最小长度时通过后端的上下文缓存 (Gemini context caching) 注册一次，之后只发送后缀；
+# 后端不支持、前缀太短或注册失败时退回本地实现，照常发送完整提示词
+# （前缀在前、后缀在后的顺序不变，仍可命中服务端的隐式前缀缓存）
+#
+# 环境变量:
+#   PSR_CONTEXT_CACHE      auto (默认，后端支持时启用) / off
+#   PSR_CONTEXT_CACHE_TTL  服务端缓存的有效期（秒），默认 600
+# ==========================================
+import hashlib
+import os
+import threading
+import time
+
+from metrics import estimate_tokens
+
+CONTEXT_CACHE_ENV = "PSR_CONTEXT_CACHE"
+CONTEXT_CACHE_TTL_ENV = "PSR_CONTEXT_CACHE_TTL"
+
+# 服务端缓存的有效期（秒）；缓存按存储时长计费，只保留活跃使用的前缀
+DEFAULT_TTL_SECONDS = 600
+
+# 剩余有效期低于该比例时续期；低于该秒数时视为已过期，重新注册
+REFRESH_FRACTION = 0.5
+EXPIRY_MARGIN_SECONDS = 30
+
+# 注册失败后在该时间内不再尝试同一前缀（秒）
+FAILURE_BACKOFF_SECONDS = 300
+
+# 服务端上下文缓存要求的最小token数，按模型名前缀匹配
+MIN_CACHE_TOKENS = {
+    "gemini-2.5-pro": 4096,
+    "gemini-2.5-flash": 1024,
+}
+DEFAULT_MIN_CACHE_TOKENS = 4096
+
+# 进程内记录的前缀条目上限，超出时丢弃最早注册的条目（服务端按有效期自动删除）
+MAX_ENTRIES = 64
+
+
+class PromptParts(str):
+    """完整提示词（可直接当作str使用：缓存键、指标和模拟后端都看到完整文本），
+    同时保留静态前缀 prefix 和本次调用的后缀 suffix"""
+
+    def __new__(cls, prefix, suffix):
+        prompt = super().__new__(cls, prefix + suffix)
+        prompt.prefix = prefix
+        prompt.suffix = suffix
+        return prompt
+
+
+class _CacheEntry:
+    """一个已在服务端注册的前缀"""
+
+    __slots__ = ("handle", "model", "expires", "tokens")
+
+    def __init__(self, handle, model, expires, tokens):
+        self.handle = handle
+        self.model = model
+        self.expires = expires
+        self.tokens = tokens
+
+
+class NoopContextCache:
+    """本地实现：不注册服务端缓存，返回任务模型和完整提示词"""
+
+    name = "none"
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def resolve(self, task, prompt):
+        """返回 (模型, 内容列表)；图片和续写提示词由调用方追加在内容列表之后"""
+        return self.registry.get(task), [str(prompt)]
+
+    def stats(self):
+        return {"mode": self.name, "entries": 0, "hits": 0, "created": 0, "refreshed": 0,
+                "too_short": 0, "failures": 0, "saved_tokens": 0, "last_error": None}
+
+
+class ServerContextCache(NoopContextCache):
+    """服务端上下文缓存：相同 (模型, 任务, 前缀) 只注册一次，调用时只发送后缀"""
+
+    name = "server"
+
+    def __init__(self, registry, ttl_seconds=DEFAULT_TTL_SECONDS, min_tokens=None):
+        super().__init__(registry)
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens if min_tokens is not None else min_cache_tokens(registry.model_name)
+        self._entries = {}
+        self._failed_until = {}
+        # 正在注册或续期的前缀 → 完成事件；并发的同前缀调用等待并复用同一条缓存
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._generation = registry.configure_calls
+        self.hits = 0
+        self.created = 0
+        self.refreshed = 0
+        self.too_short = 0
+        self.failures = 0
+        self.saved_tokens = 0
+        self.last_error = None
+
+    def resolve(self, task, prompt):
+        prefix = getattr(prompt, "prefix", "")
+        if not prefix:
+            return super().resolve(task, prompt)
+        tokens = estimate_tokens(prefix)
+        if tokens < self.min_tokens:
+            with self._lock:
+                self.too_short += 1
+            return super().resolve(task, prompt)
+        entry = self._entry_for(task, prefix, tokens)
+        if entry is None:
+            return super().resolve(task, prompt)
+        return entry.model, [prompt.suffix]
+
+    def _entry_for(self, task, prefix, tokens):
+        key = hashlib.sha256(f"{self.registry.model_name}\0{task}\0{prefix}".encode("utf-8")).hexdigest()
+        while True:
+            with self._lock:
+                # API Key变化后旧缓存属于另一个项目，不再复用
+                if self.registry.configure_calls != self._generation:
+                    self._entries.clear()
+                    self._failed_until.clear()
+                    self._generation = self.registry.configure_calls
+                generation = self._generation
+                now = time.time()
+                entry = self._entries.get(key)
+                if entry is not None and entry.expires - now > self.ttl_seconds * REFRESH_FRACTION:
+                    return self._hit(entry)
+                if self._failed_until.get(key, 0) > now:
+                    return None
+                pending = self._pending.get(key)
+                if pending is not None:
+                    # 同前缀正在续期时旧条目仍然有效，直接使用；正在注册时等待结果后重新检查
+                    if entry is not None and entry.expires - now > EXPIRY_MARGIN_SECONDS:
+                        return self._hit(entry)
+                else:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            pending.wait()
+
+        # 注册和续期是网络调用，在全局锁外进行，不阻塞其他前缀的命中和注册
+        try:
+            return self._register(key, task, prefix, tokens, entry, generation)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.set()
+
+    def _hit(self, entry):
+        # 调用方持有 self._lock
+        self.hits += 1
+        self.saved_tokens += entry.tokens
+        return entry
+
+    def _register(self, key, task, prefix, tokens, entry, generation):
+        # 即将过期的条目先尝试续期，失败或已过期时重新注册
+        backend = self.registry.backend
+        now = time.time()
+        if entry is not None and entry.expires - now > EXPIRY_MARGIN_SECONDS:
+            try:
+                backend.refresh_cached_content(entry.handle, self.ttl_seconds)
+            except Exception as e:
+                with self._lock:
+                    self.last_error = str(e)
+            else:
+                with self._lock:
+                    entry.expires = now + self.ttl_seconds
+                    self.refreshed += 1
+                    return self._hit(entry)
+        try:
+            handle = backend.create_cached_content(self.registry.model_name, task, prefix, self.ttl_seconds)
+            model = backend.create_model_from_cache(handle, task, self.registry.task_configs.get(task) or None,
+                                                   prefix=prefix)
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+                self.last_error = str(e)
+                if generation == self._generation:
+                    self._failed_until[key] = now + FAILURE_BACKOFF_SECONDS
+            return None
+        with self._lock:
+            # 注册期间API Key已变化时丢弃结果，按本地实现发送完整提示词
+            if generation != self._generation:
+                return None
+            entry = _CacheEntry(handle, model, now + self.ttl_seconds, tokens)
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            self.created += 1
+            while len(self._entries) > MAX_ENTRIES:
+                del self._entries[next(iter(self._entries))]
+            return entry
+
+    def stats(self):
+        with self._lock:
+            return {"mode": self.name, "entries": len(self._entries), "hits": self.hits, "created": self.created,
+                    "refreshed": self.refreshed, "too_short": self.too_short, "failures": self.failures,
+                    "saved_tokens": self.saved_tokens, "last_error": self.last_error}
+
+
+# 模型对应的最小缓存长度
+def min_cache_tokens(model_name):
+    for prefix, tokens in MIN_CACHE_TOKENS.items():
+        if model_name.startswith(prefix):
+            return tokens
+    return DEFAULT_MIN_CACHE_TOKENS
+
+
+# 按环境变量和后端能力选择实现
+def create_context_cache(registry, environ=None):
+    """后端支持上下文缓存且未设置 PSR_CONTEXT_CACHE=off 时返回服务端实现，否则返回本地实现"""
+    environ = os.environ if environ is None else environ
+    mode = environ.get(CONTEXT_CACHE_ENV, "auto").lower()
+    if mode in ("off", "0", "false", "none") or not getattr(registry.backend, "supports_context_cache", False):
+        return NoopContextCache(registry)
+    return ServerContextCache(registry, ttl_seconds=int(environ.get(CONTEXT_CACHE_TTL_ENV, DEFAULT_TTL_SECONDS)))
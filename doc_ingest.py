@@ -0,0 +1,249 @@
+# ==========================================
+# 文档解析层
+# 按上传内容的哈希缓存解析结果（进程内LRU，可选共享存储供多个工作进程共用）；
+# 大型PDF按页分片在进程池中并行提取（spawn方式启动，PDF写入临时文件后按路径分发，每个进程只解析一次）；
+# DOCX同时提取页眉、正文段落和表格；每次解析记录各阶段耗时
+# ==========================================
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+HAS_DOCX = False
+HAS_PDF = False
+
+try:
+    # 尝试导入处理Word文档的库
+    from docx import Document
+    from docx.oxml.ns import qn
+    HAS_DOCX = True
+except ImportError:
+    pass
+
+try:
+    # 尝试导入处理PDF文件的库
+    import pypdf
+    HAS_PDF = True
+except ImportError:
+    pass
+
+# 解析结果缓存的最大条目数
+INGEST_CACHE_MAX_ENTRIES = 32
+
+# 页数达到该值时才启用进程池并行提取
+PDF_PARALLEL_MIN_PAGES = 16
+
+# 每个进程池任务处理的页数
+PDF_PAGES_PER_TASK = 8
+
+# PDF解析进程池的最大进程数
+PDF_MAX_WORKERS = 4
+
+# 进程池的启动方式：服务进程是多线程的，fork可能复制其他线程持有的锁，使用spawn启动干净的解释器
+PDF_POOL_START_METHOD = "spawn"
+
+# 每个工作进程缓存的已打开PDF数（同时解析多份文档时轮流使用）
+PDF_WORKER_READER_CACHE = 2
+
+# 解析结果在共享存储中的保留时间（秒）和键前缀
+INGEST_SHARED_TTL_SECONDS = 7 * 24 * 3600
+INGEST_SHARED_KEY_PREFIX = "ingest:"
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_shared_store = None
+_pool = None
+_pool_lock = threading.Lock()
+
+# 工作进程内：PDF临时文件路径 → 已打开的PdfReader
+_worker_readers = OrderedDict()
+
+
+class IngestResult:
+    """一次文档解析的结果与各阶段耗时"""
+
+    __slots__ = ("text", "file_name", "content_hash", "cached", "timings", "pages")
+
+    def __init__(self, text, file_name, content_hash, cached, timings, pages=None):
+        self.text = text
+        self.file_name = file_name
+        self.content_hash = content_hash
+        self.cached = cached
+        self.timings = timings
+        self.pages = pages
+
+    def summary(self):
+        """返回适合在界面显示的耗时摘要"""
+        source = "缓存命中" if self.cached else f"解析 {self.timings.get('parse_ms', 0):.0f} ms"
+        pages = f", {self.pages} 页" if self.pages else ""
+        return f"{self.file_name}: {len(self.text)} 字符{pages}, {source}, 总计 {self.timings.get('total_ms', 0):.0f} ms"
+
+
+# 解析上传的文件对象
+def ingest_file(uploaded_file):
+    """解析带有name和getvalue()的上传文件对象"""
+    return ingest_bytes(uploaded_file.getvalue(), uploaded_file.name)
+
+
+# 解析文件字节
+def ingest_bytes(data, file_name):
+    """按内容哈希缓存解析结果，解析失败时抛出异常"""
+    started = time.perf_counter()
+    file_type = file_name.rsplit(".", 1)[-1].lower()
+    content_hash = hashlib.sha256(data).hexdigest()
+    cache_key = (content_hash, file_type)
+    hash_ms = (time.perf_counter() - started) * 1000
+
+    with _cache_lock:
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            _cache.move_to_end(cache_key)
+    if cached is None and _shared_store is not None:
+        # 其他工作进程已解析过的文件
+        cached = _shared_get(cache_key)
+        if cached is not None:
+            _cache_put(cache_key, cached)
+    if cached is not None:
+        text, pages = cached
+        timings = {"hash_ms": hash_ms, "parse_ms": 0.0, "total_ms": (time.perf_counter() - started) * 1000}
+        return IngestResult(text, file_name, content_hash, True, timings, pages)
+
+    parse_started = time.perf_counter()
+    pages = None
+    if file_type == "docx" and HAS_DOCX:
+        text = _extract_docx(data)
+    elif file_type == "pdf" and HAS_PDF:
+        text, pages = _extract_pdf(data)
+    elif file_type == "txt":
+        text = data.decode("utf-8")
+    else:
+        text = ""
+    parse_ms = (time.perf_counter() - parse_started) * 1000
+
+    _cache_put(cache_key, (text, pages))
+    if _shared_store is not None:
+        _shared_store.set(_shared_key(cache_key), json.dumps({"text": text, "pages": pages}, ensure_ascii=False),
+                          ttl=INGEST_SHARED_TTL_SECONDS)
+
+    timings = {"hash_ms": hash_ms, "parse_ms": parse_ms, "total_ms": (time.perf_counter() - started) * 1000}
+    return IngestResult(text, file_name, content_hash, False, timings, pages)
+
+
+# 清空解析缓存
+def clear_ingest_cache():
+    """清空本进程已缓存的解析结果（共享存储中的条目按有效期过期）"""
+    with _cache_lock:
+        _cache.clear()
+
+
+# 设置共享存储
+def set_shared_store(store):
+    """多进程部署时解析结果同时写入共享存储，None表示只使用进程内缓存"""
+    global _shared_store
+    _shared_store = store
+
+
+def _cache_put(cache_key, entry):
+    with _cache_lock:
+        _cache[cache_key] = entry
+        _cache.move_to_end(cache_key)
+        while len(_cache) > INGEST_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def _shared_key(cache_key):
+    content_hash, file_type = cache_key
+    return f"{INGEST_SHARED_KEY_PREFIX}{content_hash}:{file_type}"
+
+
+def _shared_get(cache_key):
+    value = _shared_store.get(_shared_key(cache_key))
+    if value is None:
+        return None
+    entry = json.loads(value)
+    return entry["text"], entry["pages"]
+
+
+def _extract_docx(data):
+    # 按文档顺序提取页眉、段落和表格，使用列表收集后一次性拼接
+    doc = Document(BytesIO(data))
+    lines = []
+
+    seen_headers = set()
+    for section in doc.sections:
+        for para in section.header.paragraphs:
+            header_text = para.text.strip()
+            if header_text and header_text not in seen_headers:
+                seen_headers.add(header_text)
+                lines.append(header_text)
+
+    paragraph_tag = qn("w:p")
+    table_tag = qn("w:tbl")
+    paragraphs = iter(doc.paragraphs)
+    tables = iter(doc.tables)
+    for child in doc.element.body.iterchildren():
+        if child.tag == paragraph_tag:
+            lines.append(next(paragraphs).text)
+        elif child.tag == table_tag:
+            for row in next(tables).rows:
+                cells = []
+                for cell in row.cells:
+                    cell_text = cell.text.strip()
+                    # 合并单元格会重复出现，相邻重复只保留一次
+                    if not cells or cells[-1] != cell_text:
+                        cells.append(cell_text)
+                lines.append(" | ".join(cells))
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _extract_pdf(data):
+    reader = pypdf.PdfReader(BytesIO(data))
+    page_count = len(reader.pages)
+    if page_count < PDF_PARALLEL_MIN_PAGES:
+        page_texts = [page.extract_text() or "" for page in reader.pages]
+    else:
+        ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count))
+                  for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+        # 任务只传临时文件路径，不为每个分片重复序列化整份PDF
+        fd, path = tempfile.mkstemp(prefix="psr_ingest_", suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            pool = _get_pool()
+            futures = [pool.submit(_extract_pdf_pages, path, start, end) for start, end in ranges]
+            page_texts = []
+            for future in futures:
+                page_texts.extend(future.result())
+        finally:
+            os.unlink(path)
+    page_texts.append("")
+    return "\n".join(page_texts), page_count
+
+
+def _extract_pdf_pages(path, start, end):
+    # 进程池工作函数：同一份PDF在每个工作进程中只解析一次，之后的分片复用已打开的reader
+    reader = _worker_readers.get(path)
+    if reader is None:
+        reader = pypdf.PdfReader(path)
+        _worker_readers[path] = reader
+        while len(_worker_readers) > PDF_WORKER_READER_CACHE:
+            _worker_readers.popitem(last=False)
+    else:
+        _worker_readers.move_to_end(path)
+    return [reader.pages[idx].extract_text() or "" for idx in range(start, end)]
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_MAX_WORKERS,
+                                        mp_context=multiprocessing.get_context(PDF_POOL_START_METHOD))
+        return _pool
@@ -0,0 +1,118 @@
+# ==========================================
+# 图片预处理
+# 课程截图发送给模型前：按EXIF方向校正、缩放到最大边长、去除元数据并重新编码，
+# 相同内容的图片按哈希去重，处理结果按内容缓存
+# ==========================================
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# 缩放后的最大边长（像素）
+IMAGE_MAX_DIMENSION = 1600
+
+# 重新编码的格式和质量
+IMAGE_FORMAT = "JPEG"
+IMAGE_QUALITY = 85
+
+# 处理结果缓存的最大条目数
+IMAGE_CACHE_MAX_ENTRIES = 64
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class ProcessedImage:
+    """预处理后的图片数据与体积统计"""
+
+    __slots__ = ("data", "mime_type", "content_hash", "original_bytes", "size")
+
+    def __init__(self, data, mime_type, content_hash, original_bytes, size):
+        self.data = data
+        self.mime_type = mime_type
+        self.content_hash = content_hash
+        self.original_bytes = original_bytes
+        self.size = size
+
+    @property
+    def processed_bytes(self):
+        return len(self.data)
+
+    def as_part(self):
+        """转换为可直接传给generate_content的内容块"""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+
+# 预处理单张图片
+def preprocess_image(data, max_dimension=IMAGE_MAX_DIMENSION, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY):
+    """缩放、去除元数据并重新编码，结果比原图大时保留原图"""
+    content_hash = hashlib.sha256(data).hexdigest()
+    cache_key = (content_hash, max_dimension, image_format, quality)
+    with _cache_lock:
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            _cache.move_to_end(cache_key)
+            return cached
+
+    with Image.open(BytesIO(data)) as img:
+        original_format = (img.format or "").upper()
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        if image_format == "JPEG" and img.mode not in ("RGB", "L"):
+            # JPEG不支持透明通道，透明区域填充为白色
+            rgba = img.convert("RGBA")
+            background = Image.new("RGB", rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[-1])
+            img = background
+
+        output = BytesIO()
+        save_kwargs = {"optimize": True}
+        if image_format in ("JPEG", "WEBP"):
+            save_kwargs["quality"] = quality
+        img.save(output, format=image_format, **save_kwargs)
+        processed = output.getvalue()
+        size = img.size
+
+    if len(processed) < len(data) or original_format not in _MIME_TYPES:
+        result = ProcessedImage(processed, _MIME_TYPES[image_format], content_hash, len(data), size)
+    else:
+        result = ProcessedImage(data, _MIME_TYPES[original_format], content_hash, len(data), size)
+
+    with _cache_lock:
+        _cache[cache_key] = result
+        _cache.move_to_end(cache_key)
+        while len(_cache) > IMAGE_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return result
+
+
+# 批量预处理并去重
+def prepare_images(image_bytes_list, max_dimension=IMAGE_MAX_DIMENSION, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY):
+    """返回 (去重后的处理结果列表, 统计信息)"""
+    processed = []
+    seen = set()
+    duplicates = 0
+    for data in image_bytes_list:
+        result = preprocess_image(data, max_dimension, image_format, quality)
+        if result.content_hash in seen:
+            duplicates += 1
+            continue
+        seen.add(result.content_hash)
+        processed.append(result)
+
+    original_total = sum(len(data) for data in image_bytes_list)
+    processed_total = sum(item.processed_bytes for item in processed)
+    stats = {
+        "count": len(image_bytes_list),
+        "unique": len(processed),
+        "duplicates": duplicates,
+        "original_bytes": original_total,
+        "processed_bytes": processed_total,
+        "saved_bytes": original_total - processed_total,
+    }
+    return processed, stats
@@ -0,0 +1,274 @@
+# ==========================================
+# 后台任务队列
+# 长时间的模型调用在后台线程池中运行，不依赖Streamlit脚本线程：
+# 页面重跑、切换控件或连接断开都不会中断生成；输出边生成边保存到SQLite，
+# 界面只轮询任务状态。支持按任务取消，并限制每个会话的排队数量
+# ==========================================
+import contextvars
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+# 进程重启时仍在运行的任务，已输出的部分可从SQLite取回
+JOB_INTERRUPTED = "interrupted"
+
+ACTIVE_STATES = frozenset((JOB_QUEUED, JOB_RUNNING))
+
+# 后台线程数、每个会话最多同时排队或运行的任务数、全局排队上限
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_JOBS_PER_OWNER = 2
+DEFAULT_MAX_PENDING = 64
+
+# 部分输出写入SQLite的最小间隔（秒）
+PERSIST_INTERVAL = 1.0
+
+# 已结束的任务在内存中保留的时间（秒），之后只能从SQLite读取
+FINISHED_JOB_TTL = 3600
+
+
+class QueueFullError(Exception):
+    """会话或全局排队数量达到上限"""
+
+
+class JobCancelled(Exception):
+    """任务在运行中被取消"""
+
+
+class Job:
+    """一个后台任务的状态和（部分）输出"""
+
+    def __init__(self, job_id, owner, task, status=JOB_QUEUED, text="", error=None, created=None,
+                 finished=None):
+        self.job_id = job_id
+        self.owner = owner
+        self.task = task
+        self.status = status
+        self.error = error
+        self.created = created or time.time()
+        self.started = None
+        self.finished = finished
+        self._chunks = [text] if text else []
+        self._text = text
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._last_persist = 0.0
+        self._on_progress = None
+
+    @property
+    def text(self):
+        """已输出的全部文本"""
+        with self._lock:
+            if self._text is None:
+                self._text = "".join(self._chunks)
+                self._chunks = [self._text] if self._text else []
+            return self._text
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATES
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """由任务函数在耗时的阻塞调用（如发起模型请求）之前调用：任务已被取消时抛出 JobCancelled"""
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.job_id)
+
+    def append(self, text):
+        """由任务函数调用：追加输出；任务已被取消时抛出 JobCancelled"""
+        self.check_cancelled()
+        if text:
+            with self._lock:
+                self._chunks.append(text)
+                self._text = None
+            if self._on_progress:
+                self._on_progress(self)
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+class JobStore:
+    """任务状态和输出的SQLite持久层；同一台机器上的多个工作进程可共用一个文件"""
+
+    def __init__(self, db_path, worker=""):
+        self.db_path = db_path
+        self.worker = worker
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, owner TEXT NOT NULL, task TEXT NOT NULL, status TEXT NOT NULL, "
+            "text TEXT NOT NULL, error TEXT, created REAL NOT NULL, updated REAL NOT NULL, "
+            "worker TEXT NOT NULL DEFAULT '')"
+        )
+        if "worker" not in {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN worker TEXT NOT NULL DEFAULT ''")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs (updated)")
+        # 本进程上次退出时未结束的任务标记为中断，其他工作进程正在运行的任务不受影响
+        self._conn.execute("UPDATE jobs SET status = ? WHERE status IN (?, ?) AND worker IN (?, '')",
+                           (JOB_INTERRUPTED, JOB_QUEUED, JOB_RUNNING, worker))
+        self._conn.commit()
+
+    def save(self, job):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, owner, task, status, text, error, created, updated, worker) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.job_id, job.owner, job.task, job.status, job.text, job.error, job.created, time.time(),
+                 self.worker),
+            )
+            self._conn.commit()
+
+    def load(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, owner, task, status, text, error, created, updated FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, owner, task, status, text, error, created, updated = row
+        return Job(job_id, owner, task, status=status, text=text, error=error, created=created, finished=updated)
+
+    def purge(self, older_than_seconds):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE updated < ?", (time.time() - older_than_seconds,))
+            self._conn.commit()
+            return cursor.rowcount
+
+
+class JobQueue:
+    """后台任务队列：线程池执行任务函数 fn(job)，任务通过 job.append() 报告输出"""
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_jobs_per_owner=DEFAULT_MAX_JOBS_PER_OWNER,
+                 max_pending=DEFAULT_MAX_PENDING, db_path=None, retention_seconds=7 * 24 * 3600, worker=""):
+        self.max_workers = max_workers
+        self.max_jobs_per_owner = max_jobs_per_owner
+        self.max_pending = max_pending
+        self.store = JobStore(db_path, worker) if db_path else None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="psr-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.cancelled = 0
+        if self.store:
+            self.store.purge(retention_seconds)
+
+    def submit(self, owner, task, fn):
+        """提交任务，返回 Job；超出排队上限时抛出 QueueFullError"""
+        with self._lock:
+            self._drop_expired()
+            active = [job for job in self._jobs.values() if job.active]
+            if sum(1 for job in active if job.owner == owner) >= self.max_jobs_per_owner:
+                self.rejected += 1
+                raise QueueFullError(f"每个会话最多同时运行 {self.max_jobs_per_owner} 个生成任务")
+            if len(active) >= self.max_pending:
+                self.rejected += 1
+                raise QueueFullError("服务器繁忙，请稍后再试")
+            job = Job(uuid.uuid4().hex, owner, task)
+            # 输出按间隔写入SQLite
+            job._on_progress = self._persist
+            self._jobs[job.job_id] = job
+            self.submitted += 1
+        self._persist(job, force=True)
+        # 在提交线程的上下文中运行，保留日志的会话关联ID
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, self._run, job, fn)
+        return job
+
+    def get(self, job_id):
+        """按ID获取任务；进程内没有时从SQLite读取（例如服务重启前的任务）"""
+        if not job_id:
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store:
+            job = self.store.load(job_id)
+        return job
+
+    def cancel(self, job_id):
+        """取消任务并立即标记为已取消：排队中的任务不再执行；运行中的任务在下一次输出或下一次发起请求时停止，
+        阻塞在模型调用中的线程返回后，之后的输出被丢弃"""
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+        job._cancel_event.set()
+        self._finish(job, JOB_CANCELLED)
+        return True
+
+    def jobs_for(self, owner):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.owner == owner]
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "queued": sum(1 for job in jobs if job.status == JOB_QUEUED),
+            "running": sum(1 for job in jobs if job.status == JOB_RUNNING),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+        }
+
+    def _run(self, job, fn):
+        # 与 cancel 在同一把锁下切换状态，已取消的任务不会再被标记为运行中
+        with self._lock:
+            start = job.status == JOB_QUEUED and not job.cancel_requested
+            if start:
+                job.status = JOB_RUNNING
+                job.started = time.time()
+        if not start:
+            self._finish(job, JOB_CANCELLED)
+            return
+        self._persist(job, force=True)
+        try:
+            fn(job)
+        except JobCancelled:
+            self._finish(job, JOB_CANCELLED)
+        except Exception as e:
+            self._finish(job, JOB_FAILED, str(e))
+        else:
+            self._finish(job, JOB_CANCELLED if job.cancel_requested else JOB_DONE)
+
+    def _finish(self, job, status, error=None):
+        # 已结束的任务保持原状态：取消后任务函数才返回时不会覆盖为完成或失败
+        with self._lock:
+            if not job.active:
+                return
+            job.status = status
+            job.error = error
+            job.finished = time.time()
+            if status == JOB_CANCELLED:
+                self.cancelled += 1
+        self._persist(job, force=True)
+
+    def _persist(self, job, force=False):
+        if self.store is None:
+            return
+        now = time.monotonic()
+        if not force and now - job._last_persist < PERSIST_INTERVAL:
+            return
+        job._last_persist = now
+        self.store.save(job)
+
+    def _drop_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if not job.active and job.finished and now - job.finished > FINISHED_JOB_TTL]
+        for job_id in expired:
+            del self._jobs[job_id]
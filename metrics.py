@@ -0,0 +1,382 @@
+# ==========================================
+# 性能指标
+# 每次模型调用按任务记录首块延迟、总延迟、输入/输出token数和重试次数，
+# 本地阶段（文件解析、段落解析、差异对比、Word构建等）记录耗时；
+# 指标可导出为Prometheus文本格式（可选内置HTTP端点）或逐条追加到JSONL文件
+# （事件放入队列，由后台线程批量写入，记录指标时不做文件I/O）
+# ==========================================
+import json
+import math
+import queue
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 延迟直方图的桶边界（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# 侧边栏分位数基于最近的事件计算
+RECENT_EVENTS = 500
+
+METRIC_PREFIX = "psr"
+
+# /metrics 端点默认只监听本机
+DEFAULT_HTTP_HOST = "127.0.0.1"
+
+# 端口被占用（例如同一台机器上的其他工作进程）时依次尝试的后续端口数
+HTTP_PORT_ATTEMPTS = 16
+
+# 按字计token的字符：中日韩统一表意文字（含扩展A和兼容区）、假名、谚文
+_CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_ESTIMATE_RE = re.compile(rf"[{_CJK_CHARS}]|[^\W{_CJK_CHARS}]+|[^\w\s]")
+
+# 其他文字平均每个token的字符数
+CHARS_PER_TOKEN = 4
+
+
+# 估算文本的token数
+def estimate_tokens(text):
+    """模型未返回用量信息时的近似值：中日韩文字每字一个token，其他单词按字符数估算（至少一个），标点单独计"""
+    if not text:
+        return 0
+    return sum(math.ceil(len(token) / CHARS_PER_TOKEN) for token in _ESTIMATE_RE.findall(text))
+
+
+class Histogram:
+    """累计直方图，与Prometheus histogram语义一致"""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for pos, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[pos] += 1
+
+
+class ModelCall:
+    """一次模型调用的计时上下文，由 MetricsRegistry.model_call() 创建"""
+
+    def __init__(self, registry, task, prompt_text):
+        self.registry = registry
+        self.task = task
+        self.prompt_text = prompt_text
+        self.started = time.perf_counter()
+        self.first_chunk_seconds = None
+        self.prompt_tokens = None
+        self.cached_tokens = None
+        self.response_tokens = None
+        self.response_chars = 0
+        self.retries = 0
+        self.status = "ok"
+
+    def first_chunk(self):
+        """记录首块到达时间，只记录第一次"""
+        if self.first_chunk_seconds is None:
+            self.first_chunk_seconds = time.perf_counter() - self.started
+
+    def on_retry(self, error=None):
+        """作为调用治理层的重试回调"""
+        self.retries += 1
+
+    def record_usage(self, usage):
+        """记录模型返回的用量信息 (usage_metadata)"""
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        cached_tokens = getattr(usage, "cached_content_token_count", None)
+        response_tokens = getattr(usage, "candidates_token_count", None)
+        if prompt_tokens:
+            self.prompt_tokens = prompt_tokens
+        # 输入token中命中上下文缓存的部分（已包含在prompt_token_count中）
+        if cached_tokens:
+            self.cached_tokens = cached_tokens
+        if response_tokens:
+            self.response_tokens = response_tokens
+
+    def watch(self, response_stream):
+        """包装流式响应：首块计时并从块中读取用量信息"""
+        for chunk in response_stream:
+            self.first_chunk()
+            self.record_usage(getattr(chunk, "usage_metadata", None))
+            yield chunk
+
+    def finish(self, response_text):
+        """记录响应文本；没有用量信息时用估算值"""
+        self.first_chunk()
+        self.response_chars = len(response_text or "")
+        if self.response_tokens is None:
+            self.response_tokens = estimate_tokens(response_text)
+
+
+class MetricsRegistry:
+    """进程内共享的指标注册表"""
+
+    def __init__(self, jsonl_path=None):
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._ttfc = {}
+        self._stages = {}
+        self._counters = {}
+        self._recent_calls = deque(maxlen=RECENT_EVENTS)
+        self._recent_stages = deque(maxlen=RECENT_EVENTS)
+        self._server = None
+        self.http_port = None
+        # JSONL事件队列和写入线程，第一次写入事件时启动
+        self._event_queue = queue.SimpleQueue()
+        self._writer = None
+
+    @contextmanager
+    def model_call(self, task, prompt_text=""):
+        """模型调用计时：正常结束记为ok，异常记为error，用户中断记为cancelled"""
+        call = ModelCall(self, task, prompt_text)
+        try:
+            yield call
+        except Exception:
+            # 调用方已标记为cancelled（例如后台任务被取消）时保留
+            if call.status == "ok":
+                call.status = "error"
+            raise
+        except BaseException:
+            # Streamlit的rerun/stop通过BaseException中断脚本
+            call.status = "cancelled"
+            raise
+        finally:
+            self._record_call(call)
+
+    def record_cache_hit(self, task):
+        """响应缓存命中不计入延迟分布，只计数"""
+        self._inc(("cache_hits_total", (("task", task),)), 1)
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """本地阶段计时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - started, **labels)
+
+    def record_stage(self, name, seconds, **labels):
+        with self._lock:
+            self._stages.setdefault(name, Histogram(STAGE_BUCKETS)).observe(seconds)
+            self._recent_stages.append((name, seconds))
+        self._write_event({"type": "stage", "stage": name, "seconds": round(seconds, 6), **labels})
+
+    def _record_call(self, call):
+        latency = time.perf_counter() - call.started
+        if call.prompt_tokens is None:
+            call.prompt_tokens = estimate_tokens(call.prompt_text)
+        task_label = (("task", call.task),)
+        with self._lock:
+            self._latency.setdefault(call.task, Histogram(LATENCY_BUCKETS)).observe(latency)
+            if call.first_chunk_seconds is not None and call.status == "ok":
+                self._ttfc.setdefault(call.task, Histogram(LATENCY_BUCKETS)).observe(call.first_chunk_seconds)
+            self._recent_calls.append((call.task, latency, call.first_chunk_seconds, call.status))
+        self._inc(("calls_total", task_label + (("status", call.status),)), 1)
+        self._inc(("tokens_total", task_label + (("kind", "prompt"),)), call.prompt_tokens or 0)
+        self._inc(("tokens_total", task_label + (("kind", "cached"),)), call.cached_tokens or 0)
+        self._inc(("tokens_total", task_label + (("kind", "response"),)), call.response_tokens or 0)
+        self._inc(("retries_total", task_label), call.retries)
+        self._write_event({
+            "type": "model_call",
+            "task": call.task,
+            "status": call.status,
+            "latency_seconds": round(latency, 6),
+            "first_chunk_seconds": None if call.first_chunk_seconds is None else round(call.first_chunk_seconds, 6),
+            "prompt_tokens": call.prompt_tokens,
+            "cached_tokens": call.cached_tokens,
+            "response_tokens": call.response_tokens,
+            "retries": call.retries,
+        })
+
+    def _inc(self, key, amount):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def _write_event(self, event):
+        if not self.jsonl_path:
+            return
+        event["ts"] = round(time.time(), 3)
+        self._event_queue.put(json.dumps(event, ensure_ascii=False) + "\n")
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="psr-metrics-jsonl", daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        # 文件只打开一次；每次取出队列中已有的全部事件，以完整的行一次写入，
+        # 多个进程追加同一个文件时行不会交错
+        with open(self.jsonl_path, "ab", buffering=0) as f:
+            while True:
+                lines = [self._event_queue.get()]
+                while True:
+                    try:
+                        lines.append(self._event_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in lines
+                lines = [line for line in lines if line is not None]
+                if lines:
+                    f.write("".join(lines).encode("utf-8"))
+                if stop:
+                    return
+
+    def close(self):
+        """写完队列中的事件后停止写入线程（进程退出前或测试中调用）"""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._event_queue.put(None)
+            writer.join()
+
+    # ------------------------------------------
+    # 汇总与导出
+    # ------------------------------------------
+
+    def snapshot(self):
+        """侧边栏使用的汇总：每个任务和本地阶段的次数、p50/p95 和 token 数"""
+        with self._lock:
+            recent_calls = list(self._recent_calls)
+            recent_stages = list(self._recent_stages)
+            counters = dict(self._counters)
+
+        tasks = {}
+        for task, latency, ttfc, status in recent_calls:
+            entry = tasks.setdefault(task, {"latencies": [], "ttfc": []})
+            entry["latencies"].append(latency)
+            if ttfc is not None and status == "ok":
+                entry["ttfc"].append(ttfc)
+
+        task_rows = []
+        for task in sorted(tasks):
+            latencies = sorted(tasks[task]["latencies"])
+            ttfc = sorted(tasks[task]["ttfc"])
+            label = (("task", task),)
+            task_rows.append({
+                "任务": task,
+                "调用": len(latencies),
+                "p50 (s)": round(_quantile(latencies, 0.5), 2),
+                "p95 (s)": round(_quantile(latencies, 0.95), 2),
+                "首块p50 (s)": round(_quantile(ttfc, 0.5), 2),
+                "输入token": counters.get(("tokens_total", label + (("kind", "prompt"),)), 0),
+                "缓存输入token": counters.get(("tokens_total", label + (("kind", "cached"),)), 0),
+                "输出token": counters.get(("tokens_total", label + (("kind", "response"),)), 0),
+                "重试": counters.get(("retries_total", label), 0),
+                "缓存命中": counters.get(("cache_hits_total", label), 0),
+            })
+
+        stages = {}
+        for name, seconds in recent_stages:
+            stages.setdefault(name, []).append(seconds)
+        stage_rows = []
+        for name in sorted(stages):
+            values = sorted(stages[name])
+            stage_rows.append({
+                "阶段": name,
+                "次数": len(values),
+                "p50 (ms)": round(_quantile(values, 0.5) * 1000, 1),
+                "p95 (ms)": round(_quantile(values, 0.95) * 1000, 1),
+                "合计 (s)": round(sum(values), 2),
+            })
+        return {"tasks": task_rows, "stages": stage_rows}
+
+    def prometheus_text(self):
+        """Prometheus文本格式（exposition format 0.0.4）"""
+        lines = []
+        with self._lock:
+            _append_histograms(lines, f"{METRIC_PREFIX}_model_call_duration_seconds",
+                               "Total model call latency by task", "task", self._latency)
+            _append_histograms(lines, f"{METRIC_PREFIX}_model_first_chunk_seconds",
+                               "Time to first streamed chunk by task", "task", self._ttfc)
+            _append_histograms(lines, f"{METRIC_PREFIX}_stage_duration_seconds",
+                               "Local processing stage latency", "stage", self._stages)
+            counters = sorted(self._counters.items())
+
+        help_texts = {
+            "calls_total": "Model calls by task and status",
+            "tokens_total": "Prompt, cached prompt and response tokens by task",
+            "retries_total": "Retries issued by the call governor by task",
+            "cache_hits_total": "Response cache hits by task",
+        }
+        for name in sorted({key[0] for key, _ in counters}):
+            metric = f"{METRIC_PREFIX}_model_{name}"
+            lines.append(f"# HELP {metric} {help_texts.get(name, name)}")
+            lines.append(f"# TYPE {metric} counter")
+            for (counter_name, labels), value in counters:
+                if counter_name == name:
+                    lines.append(f"{metric}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port, host=DEFAULT_HTTP_HOST, attempts=HTTP_PORT_ATTEMPTS):
+        """在后台线程中提供 /metrics 端点，重复调用时只启动一次；默认只监听本机，对外提供需显式传入host。
+        端口被占用时依次尝试后续端口，实际端口记在 http_port，全部被占用时返回None"""
+        if self._server is not None:
+            return self._server
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        for candidate in range(port, port + max(1, attempts)):
+            try:
+                self._server = ThreadingHTTPServer((host, candidate), MetricsHandler)
+            except OSError:
+                continue
+            self.http_port = candidate
+            threading.Thread(target=self._server.serve_forever, name="psr-metrics", daemon=True).start()
+            return self._server
+        return None
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _append_histograms(lines, metric, help_text, label_name, histograms):
+    if not histograms:
+        return
+    lines.append(f"# HELP {metric} {help_text}")
+    lines.append(f"# TYPE {metric} histogram")
+    for key in sorted(histograms):
+        histogram = histograms[key]
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f"{metric}_bucket{_format_labels(((label_name, key), ('le', bound)))} {count}")
+        lines.append(f"{metric}_bucket{_format_labels(((label_name, key), ('le', '+Inf')))} {histogram.count}")
+        lines.append(f"{metric}_sum{_format_labels(((label_name, key),))} {histogram.sum:.6f}")
+        lines.append(f"{metric}_count{_format_labels(((label_name, key),))} {histogram.count}")
@@ -0,0 +1,398 @@
+# ==========================================
+# 模型后端
+# 所有GenerativeModel都通过后端创建：默认使用Gemini，设置环境变量 PSR_BACKEND=mock
+# 时使用本地模拟模型，按配置的速率回放录制的响应（或合成的 ===SECTION===/[[LOGIC]]/[[DRAFT]] 输出），
+# 并按错误率注入限流/服务不可用错误，用于离线压测
+#
+# 环境变量:
+#   PSR_BACKEND                 gemini (默认) / mock
+#   PSR_MOCK_RECORDINGS         录制文件(.jsonl)或目录
+#   PSR_MOCK_TOKENS_PER_SECOND  模拟出字速率，默认 80
+#   PSR_MOCK_FIRST_TOKEN_SECONDS 首字延迟，默认 0.5
+#   PSR_MOCK_ERROR_RATE         每次调用出错的概率，默认 0
+#   PSR_MOCK_SEED               随机种子，默认 0
+#   PSR_RECORD_DIR              使用Gemini时把响应录制到该目录，供模拟后端回放
+# ==========================================
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+BACKEND_ENV = "PSR_BACKEND"
+
+# 模拟后端使用的占位API Key
+MOCK_API_KEY = "mock-api-key"
+
+# 模拟后端的默认参数
+DEFAULT_TOKENS_PER_SECOND = 80.0
+DEFAULT_FIRST_TOKEN_SECONDS = 0.5
+DEFAULT_CHUNK_TOKENS = 8
+DEFAULT_MOCK_SECTIONS = 5
+
+# 近似分词：中文按字，英文按词，空白和标点单独计
+_TOKEN_RE = re.compile(r"[一-鿿]|\w+|\s+|[^\w\s]")
+
+
+# 计算提示词的哈希，用于录制和回放时匹配
+def prompt_hash(contents):
+    """只对文本部分计算哈希，图片等二进制部分忽略"""
+    return hashlib.sha256(_contents_text(contents).encode("utf-8")).hexdigest()
+
+
+def _contents_text(contents):
+    if isinstance(contents, str):
+        return contents
+    return "\n".join(part for part in contents if isinstance(part, str))
+
+
+def split_tokens(text):
+    """按近似的token边界切分文本"""
+    return _TOKEN_RE.findall(text)
+
+
+# ==========================================
+# Gemini 后端
+# ==========================================
+
+class GeminiBackend:
+    """调用真实Gemini API的后端，可选把响应录制到本地"""
+
+    name = "gemini"
+    requires_api_key = True
+    # 支持把静态提示词前缀注册为服务端上下文缓存（见 context_cache）
+    supports_context_cache = True
+
+    def __init__(self, record_dir=None):
+        import google.generativeai as genai
+        from psr_core import get_safety_settings
+
+        self._genai = genai
+        self._safety_settings = get_safety_settings()
+        self.recorder = ResponseRecorder(record_dir) if record_dir else None
+
+    def configure(self, api_key):
+        self._genai.configure(api_key=api_key)
+
+    def create_model(self, model_name, task, generation_config=None):
+        model = self._genai.GenerativeModel(
+            model_name,
+            safety_settings=self._safety_settings,
+            generation_config=generation_config or None,
+        )
+        if self.recorder is not None:
+            return RecordingModel(model, task, self.recorder)
+        return model
+
+    def create_cached_content(self, model_name, task, prefix, ttl_seconds):
+        """把提示词前缀注册为服务端上下文缓存，返回缓存句柄"""
+        from google.generativeai import caching
+        return caching.CachedContent.create(
+            model=model_name,
+            display_name=f"psr-{task}",
+            contents=[prefix],
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+        )
+
+    def refresh_cached_content(self, cached_content, ttl_seconds):
+        """延长上下文缓存的有效期"""
+        cached_content.update(ttl=datetime.timedelta(seconds=ttl_seconds))
+
+    def create_model_from_cache(self, cached_content, task, generation_config=None, prefix=""):
+        """创建以缓存前缀为上下文的模型，调用时只需发送后缀；prefix 只用于录制"""
+        model = self._genai.GenerativeModel.from_cached_content(
+            cached_content,
+            generation_config=generation_config or None,
+            safety_settings=self._safety_settings,
+        )
+        if self.recorder is not None:
+            # 录制时补回前缀，录制的提示词哈希与完整提示词一致，模拟后端可按完整提示词回放
+            return RecordingModel(model, task, self.recorder, prefix=prefix)
+        return model
+
+
+class ResponseRecorder:
+    """把 (任务, 提示词哈希, 响应) 追加写入 <目录>/<任务>.jsonl"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, task, contents, text):
+        entry = {"task": task, "prompt_hash": prompt_hash(contents), "response": text}
+        with self._lock:
+            with open(os.path.join(self.directory, f"{task}.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class RecordingModel:
+    """包装GenerativeModel，完整响应结束后录制"""
+
+    def __init__(self, model, task, recorder, prefix=""):
+        self._model = model
+        self._task = task
+        self._recorder = recorder
+        self._prefix = prefix
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        response = self._model.generate_content(contents, stream=stream, **kwargs)
+        full_contents = self._with_prefix(contents)
+        if not stream:
+            self._recorder.record(self._task, full_contents, response.text)
+            return response
+        return self._record_stream(full_contents, response)
+
+    def _with_prefix(self, contents):
+        if not self._prefix:
+            return contents
+        if isinstance(contents, str):
+            return self._prefix + contents
+        return [self._prefix + contents[0]] + list(contents[1:])
+
+    def _record_stream(self, contents, response):
+        parts = []
+        for chunk in response:
+            try:
+                parts.append(chunk.text)
+            except Exception:
+                pass
+            yield chunk
+        self._recorder.record(self._task, contents, "".join(parts))
+
+
+# ==========================================
+# 模拟后端
+# ==========================================
+
+class ResourceExhausted(Exception):
+    """模拟的429错误，类名与google.api_core.exceptions一致，可被调用治理层识别为可重试"""
+
+
+class ServiceUnavailable(Exception):
+    """模拟的503错误"""
+
+
+class MockChunk:
+    """与流式响应块接口一致，只有text属性"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class MockResponse:
+    """与非流式响应接口一致"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class MockBackend:
+    """本地模拟后端：回放录制的响应或合成结构化输出，按速率输出并注入错误"""
+
+    name = "mock"
+    requires_api_key = False
+    supports_context_cache = False
+
+    def __init__(self, recordings=None, tokens_per_second=DEFAULT_TOKENS_PER_SECOND,
+                 first_token_seconds=DEFAULT_FIRST_TOKEN_SECONDS, error_rate=0.0,
+                 chunk_tokens=DEFAULT_CHUNK_TOKENS, seed=0, sleep=time.sleep):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_seconds = first_token_seconds
+        self.error_rate = error_rate
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.seed = seed
+        self.sleep = sleep
+        self._by_hash = {}
+        self._by_task = {}
+        if recordings:
+            self.load_recordings(recordings)
+        self._lock = threading.Lock()
+        self._attempts = {}
+        self.calls = 0
+        self.injected_errors = 0
+
+    def configure(self, api_key):
+        pass
+
+    def create_model(self, model_name, task, generation_config=None):
+        return MockModel(self, task)
+
+    def load_recordings(self, path):
+        """加载录制文件或目录下的所有 .jsonl 文件"""
+        paths = [path]
+        if os.path.isdir(path):
+            paths = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".jsonl")]
+        for file_path in paths:
+            with open(file_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry.get("prompt_hash"):
+                        self._by_hash[entry["prompt_hash"]] = entry["response"]
+                    self._by_task.setdefault(entry.get("task", ""), []).append(entry["response"])
+
+    def response_for(self, task, contents, rng):
+        """优先按提示词精确回放，其次回放同任务的任意录制，最后合成"""
+        text = self._by_hash.get(prompt_hash(contents))
+        if text is not None:
+            return text
+        candidates = self._by_task.get(task)
+        if candidates:
+            return rng.choice(candidates)
+        return synthesize_response(task, _contents_text(contents), rng)
+
+    def rng_for(self, contents):
+        # 按 (种子, 提示词, 该提示词的第几次调用) 生成随机数，
+        # 并发交错时相同提示词的响应和错误序列仍然确定
+        key = prompt_hash(contents)
+        with self._lock:
+            self.calls += 1
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+        return random.Random(f"{self.seed}:{key}:{attempt}")
+
+    def maybe_fail(self, rng):
+        """按错误率决定本次调用是否失败"""
+        if self.error_rate and rng.random() < self.error_rate:
+            self.fail(rng)
+
+    def fail(self, rng):
+        """抛出一个可重试的模拟错误"""
+        with self._lock:
+            self.injected_errors += 1
+        if rng.random() < 0.5:
+            raise ResourceExhausted("429 Resource has been exhausted (mock)")
+        raise ServiceUnavailable("503 The service is currently unavailable (mock)")
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "injected_errors": self.injected_errors}
+
+
+class MockModel:
+    """与GenerativeModel.generate_content接口一致的模拟模型"""
+
+    def __init__(self, backend, task):
+        self.backend = backend
+        self.task = task
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        backend = self.backend
+        base_contents, continuation = _split_continuation(contents)
+        # 响应内容只由原始提示词决定，续写请求返回同一响应中尚未输出的部分
+        text = backend.response_for(self.task, base_contents, random.Random(f"{backend.seed}:{prompt_hash(base_contents)}"))
+        if continuation:
+            text = text[_emitted_prefix_length(text, continuation):]
+        rng = backend.rng_for(contents)
+        if not stream:
+            backend.sleep(backend.first_token_seconds)
+            backend.maybe_fail(rng)
+            backend.sleep(len(split_tokens(text)) / backend.tokens_per_second)
+            return MockResponse(text)
+        return self._stream(text, rng)
+
+    def _stream(self, text, rng):
+        backend = self.backend
+        tokens = split_tokens(text)
+        # 出错时一半在首个块之前，一半在输出中途
+        fail_at = None
+        if backend.error_rate and rng.random() < backend.error_rate:
+            fail_at = 0 if rng.random() < 0.5 else rng.randrange(max(1, len(tokens)))
+        backend.sleep(backend.first_token_seconds)
+        for start in range(0, len(tokens), backend.chunk_tokens):
+            if fail_at is not None and start >= fail_at:
+                backend.fail(rng)
+            chunk = tokens[start:start + backend.chunk_tokens]
+            backend.sleep(len(chunk) / backend.tokens_per_second)
+            yield MockChunk("".join(chunk))
+
+
+# 调用治理层续写时会在原始内容后追加续写提示词（见 psr_core.build_continuation_prompt）
+CONTINUATION_MARKER = "【续写说明】"
+
+
+def _split_continuation(contents):
+    if isinstance(contents, str) or not contents:
+        return contents, None
+    last = contents[-1]
+    if isinstance(last, str) and CONTINUATION_MARKER in last:
+        base = list(contents[:-1])
+        return (base[0] if len(base) == 1 and isinstance(base[0], str) else base), last
+    return contents, None
+
+
+def _emitted_prefix_length(text, continuation):
+    # 续写提示词中原样包含已输出的内容，找到它与完整响应的最长公共前缀
+    probe = text[:32]
+    start = continuation.find(probe) if probe else -1
+    if start == -1:
+        return 0
+    length = 0
+    limit = min(len(text), len(continuation) - start)
+    while length < limit and text[length] == continuation[start + length]:
+        length += 1
+    return length
+
+
+# 合成模拟响应
+def synthesize_response(task, prompt_text, rng):
+    """分析任务输出带标记的多段结构，其他任务输出一段带**高亮的正文"""
+    if task == "analysis":
+        sections = []
+        for i in range(DEFAULT_MOCK_SECTIONS):
+            sections.append(
+                f"===SECTION===\n[[LOGIC]]\n本段功能识别：[{rng.choice(_MOCK_TOPICS)}]\n"
+                f"修改思路：{rng.choice(_MOCK_LOGIC)}\n[[DRAFT]]\n{_mock_paragraph(rng)}\n"
+            )
+        return "".join(sections)
+    # 修改类任务的输出长度与输入大致相当
+    sentences = max(3, min(12, len(prompt_text) // 400))
+    return _mock_paragraph(rng, sentences)
+
+
+def _mock_paragraph(rng, sentences=5):
+    parts = []
+    for _ in range(sentences):
+        sentence = rng.choice(_MOCK_SENTENCES)
+        if rng.random() < 0.3:
+            sentence = f"**{sentence}**"
+        parts.append(sentence)
+    return " ".join(parts)
+
+
+_MOCK_TOPICS = ("动机", "学术背景", "研究经历", "工作经历", "职业规划", "择校理由")
+
+_MOCK_LOGIC = (
+    "补充具体课程细节，强化与目标项目的关联。",
+    "保留原有经历，压缩背景描述，突出个人贡献。",
+    "调整段落顺序，使动机与后续经历形成呼应。",
+)
+
+_MOCK_SENTENCES = (
+    "My undergraduate training gave me a rigorous foundation in statistics and programming.",
+    "I led a small team to build a data pipeline that cut reporting time by half.",
+    "This project showed me how careful measurement can change a policy decision.",
+    "The programme's focus on applied research matches my long-term goals.",
+    "I want to deepen my understanding of causal inference and experimental design.",
+    "During my internship I learned to explain technical trade-offs to non-specialists.",
+)
+
+
+# 按环境变量选择后端
+def get_backend(environ=None):
+    """PSR_BACKEND=mock 时返回模拟后端，否则返回Gemini后端"""
+    environ = os.environ if environ is None else environ
+    if environ.get(BACKEND_ENV, "gemini").lower() == "mock":
+        return MockBackend(
+            recordings=environ.get("PSR_MOCK_RECORDINGS") or None,
+            tokens_per_second=float(environ.get("PSR_MOCK_TOKENS_PER_SECOND", DEFAULT_TOKENS_PER_SECOND)),
+            first_token_seconds=float(environ.get("PSR_MOCK_FIRST_TOKEN_SECONDS", DEFAULT_FIRST_TOKEN_SECONDS)),
+            error_rate=float(environ.get("PSR_MOCK_ERROR_RATE", 0.0)),
+            seed=environ.get("PSR_MOCK_SEED", "0"),
+        )
+    return GeminiBackend(record_dir=environ.get("PSR_RECORD_DIR") or None)
@@ -0,0 +1,70 @@
+# ==========================================
+# 模型注册表
+# 进程内共享的Gemini模型对象：每个任务只构建一次GenerativeModel，
+# API Key未变化时不重复调用genai.configure，底层HTTP连接在会话和rerun之间复用；
+# 模型通过后端创建（见 model_backend），PSR_BACKEND=mock 时使用本地模拟模型
+# ==========================================
+import threading
+
+from model_backend import get_backend
+
+# 各任务的生成配置，空字典表示使用模型默认值
+TASK_GENERATION_CONFIGS = {
+    "analysis": {},
+    "refine": {},
+    "translate_us": {},
+    "translate_uk": {},
+    "english_refine": {},
+    "lint_fix": {},
+}
+
+
+class ModelRegistry:
+    """按任务缓存配置好的GenerativeModel，并统计复用情况"""
+
+    def __init__(self, model_name, task_configs=None, backend=None):
+        self.model_name = model_name
+        self.task_configs = dict(TASK_GENERATION_CONFIGS if task_configs is None else task_configs)
+        self.backend = backend if backend is not None else get_backend()
+        self._models = {}
+        self._lock = threading.Lock()
+        self._api_key = None
+        self.configure_calls = 0
+        self.models_created = 0
+        self.model_reuses = 0
+
+    def configure(self, api_key):
+        """仅在API Key变化时重新配置客户端，避免每次rerun重建连接"""
+        with self._lock:
+            if api_key == self._api_key:
+                return
+            self.backend.configure(api_key)
+            self._api_key = api_key
+            self.configure_calls += 1
+            # 客户端已重建，旧模型对象不再复用
+            self._models.clear()
+
+    def get(self, task):
+        """返回指定任务的模型对象，首次请求时构建"""
+        with self._lock:
+            model = self._models.get(task)
+            if model is not None:
+                self.model_reuses += 1
+                return model
+            model = self.backend.create_model(self.model_name, task, self.task_configs.get(task) or None)
+            self._models[task] = model
+            self.models_created += 1
+            return model
+
+    def stats(self):
+        """返回模型构建与复用统计"""
+        with self._lock:
+            total = self.models_created + self.model_reuses
+            return {
+                "backend": self.backend.name,
+                "configure_calls": self.configure_calls,
+                "models_created": self.models_created,
+                "model_reuses": self.model_reuses,
+                "reuse_rate": self.model_reuses / total if total else 0.0,
+                "tasks": sorted(self._models),
+            }
@@ -0,0 +1,173 @@
+# ==========================================
+# 段落存储
+# 按段落顺序保存已确认的段落内容，拼接后的全文以片段+偏移量的形式维护：
+# 确认或修改一个段落只替换对应片段，全文在首次读取时才生成
+# ==========================================
+from bisect import bisect_left
+
+PARAGRAPH_SEPARATOR = "\n\n"
+
+
+class ParagraphStore:
+    """有序段落存储，支持单段替换和惰性生成全文"""
+
+    def __init__(self, separator=PARAGRAPH_SEPARATOR):
+        self.separator = separator
+        self._indices = []
+        self._texts = {}
+        self._text = None
+        self._offsets = None
+        self.version = 0
+
+    def __contains__(self, idx):
+        return idx in self._texts
+
+    def __len__(self):
+        return len(self._indices)
+
+    @property
+    def indices(self):
+        """按顺序排列的段落索引"""
+        return list(self._indices)
+
+    def get(self, idx, default=None):
+        return self._texts.get(idx, default)
+
+    def set(self, idx, text):
+        """写入一个段落；空白内容视为移除该段落。返回全文是否发生变化"""
+        if not text or not text.strip():
+            return self.remove(idx)
+        if self._texts.get(idx) == text:
+            return False
+
+        if self._text is not None:
+            if idx in self._texts:
+                self._splice_replace(idx, text)
+            else:
+                self._splice_insert(idx, text)
+        if idx not in self._texts:
+            self._indices.insert(bisect_left(self._indices, idx), idx)
+        self._texts[idx] = text
+        self.version += 1
+        return True
+
+    def remove(self, idx):
+        """移除一个段落，返回全文是否发生变化"""
+        if idx not in self._texts:
+            return False
+        if self._text is not None:
+            self._splice_remove(idx)
+        self._indices.pop(bisect_left(self._indices, idx))
+        del self._texts[idx]
+        self.version += 1
+        return True
+
+    def reset(self, paragraphs):
+        """用 {索引: 文本} 整体重建存储"""
+        self._indices = []
+        self._texts = {}
+        self._text = None
+        self._offsets = None
+        for idx, text in paragraphs.items():
+            if text and text.strip():
+                self._texts[idx] = text
+        self._indices = sorted(self._texts)
+        self.version += 1
+
+    @property
+    def text(self):
+        """拼接后的全文，仅在首次读取或存储重建后计算"""
+        if self._text is None:
+            self._offsets = []
+            position = 0
+            for pos, idx in enumerate(self._indices):
+                if pos:
+                    position += len(self.separator)
+                start = position
+                position += len(self._texts[idx])
+                self._offsets.append((start, position))
+            self._text = self.separator.join(self._texts[idx] for idx in self._indices)
+        return self._text
+
+    def segment(self, idx):
+        """返回段落在全文中的 (起始, 结束) 偏移量"""
+        self.text
+        pos = bisect_left(self._indices, idx)
+        if pos == len(self._indices) or self._indices[pos] != idx:
+            return None
+        return self._offsets[pos]
+
+    def _shift(self, from_pos, delta):
+        for pos in range(from_pos, len(self._offsets)):
+            start, end = self._offsets[pos]
+            self._offsets[pos] = (start + delta, end + delta)
+
+    def _splice_replace(self, idx, text):
+        pos = bisect_left(self._indices, idx)
+        start, end = self._offsets[pos]
+        self._text = self._text[:start] + text + self._text[end:]
+        self._offsets[pos] = (start, start + len(text))
+        self._shift(pos + 1, len(text) - (end - start))
+
+    def _splice_insert(self, idx, text):
+        pos = bisect_left(self._indices, idx)
+        sep = len(self.separator)
+        if not self._indices:
+            self._text = text
+            self._offsets = [(0, len(text))]
+            return
+        if pos < len(self._indices):
+            # 插入到后一段之前：新段落 + 分隔符
+            start = self._offsets[pos][0]
+            self._text = self._text[:start] + text + self.separator + self._text[start:]
+            self._offsets.insert(pos, (start, start + len(text)))
+            self._shift(pos + 1, len(text) + sep)
+        else:
+            # 追加到末尾：分隔符 + 新段落
+            start = len(self._text) + sep
+            self._text = self._text + self.separator + text
+            self._offsets.append((start, start + len(text)))
+
+    def _splice_remove(self, idx):
+        pos = bisect_left(self._indices, idx)
+        start, end = self._offsets[pos]
+        sep = len(self.separator)
+        if len(self._indices) == 1:
+            self._text = ""
+            self._offsets = []
+            return
+        if pos < len(self._indices) - 1:
+            # 删除段落及其后的分隔符
+            self._text = self._text[:start] + self._text[end + sep:]
+            self._shift(pos + 1, -(end - start + sep))
+        else:
+            # 删除末尾段落及其前的分隔符
+            self._text = self._text[:start - sep]
+        self._offsets.pop(pos)
+
+
+# 按会话状态解析单个段落的最新内容
+def resolve_paragraph_text(state, idx):
+    """按 confirmed_contents → 文本框 → 修改结果 → 原始段落 的顺序获取段落内容
+
+    state 可以是 st.session_state 或任何同结构的字典。
+    """
+    current_text = state['confirmed_contents'].get(idx)
+    if current_text and current_text.strip():
+        return current_text
+    textarea_key = f"draft_p_{idx}"
+    if textarea_key in state:
+        fallback_text = state[textarea_key]
+        if fallback_text and fallback_text.strip():
+            return fallback_text
+    return state['refine_results'].get(f"para_{idx}", state['sections_data'][idx]['draft'])
+
+
+# 按会话状态完整重建段落存储
+def rebuild_store_from_state(state):
+    """用已确认段落整体重建 state['paragraph_store']，返回全文"""
+    store = state['paragraph_store']
+    sections_count = len(state['sections_data'])
+    confirmed_indices = sorted(idx for idx in state['confirmed_paragraphs'] if idx < sections_count)
+    store.reset({idx: resolve_paragraph_text(state, idx) for idx in confirmed_indices})
+    return store.text
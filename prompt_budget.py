@@ -0,0 +1,267 @@
+# ==========================================
+# 提示词token预算
+# 构建分析提示词之前估算各部分的token数：旧PS和写作策略原样保留，
+# 课程信息（常常是整本课程手册）按段切块，用本地BM25按与专业和PS的相关度排序，
+# 只保留预算内得分最高的段落（按原顺序拼接），并报告被舍弃的内容
+# ==========================================
+import math
+import re
+from collections import Counter
+
+from metrics import estimate_tokens
+from model_backend import split_tokens
+
+# 整个分析提示词（模板 + PS + 课程 + 策略）的默认token预算，不含图片
+DEFAULT_PROMPT_TOKEN_BUDGET = 16000
+
+# PS本身超出预算时，课程信息至少保留的token数
+MIN_CURRICULUM_TOKENS = 1500
+
+# 课程切块的目标大小（token）
+CHUNK_TOKENS = 200
+
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 查询中专业名称的权重高于PS正文
+MAJOR_QUERY_WEIGHT = 3.0
+
+# 报告中被舍弃段落的预览长度
+DROPPED_PREVIEW_CHARS = 60
+
+# 常见英文虚词，不参与相关度计算
+STOPWORDS = frozenset((
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "you your we our i my me their they he she his her which who this these those not but can may also into "
+    "than then there such each all any more most other some only over under about after before during "
+    "course module modules credit credits students student semester year week weeks hours"
+).split())
+
+# 句末标点，超长段落按句切分
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?。！？；;])\s*")
+
+
+class Passage:
+    """课程信息中的一个候选段落"""
+
+    __slots__ = ("index", "text", "tokens", "terms", "score")
+
+    def __init__(self, index, text, tokens, terms):
+        self.index = index
+        self.text = text
+        self.tokens = tokens
+        self.terms = terms
+        self.score = 0.0
+
+
+class BudgetResult:
+    """预算处理后的提示词输入和裁剪报告"""
+
+    def __init__(self, ps_text, course_text, strategy_text, budget, template_tokens, ps_tokens,
+                 strategy_tokens, course_tokens_before, course_tokens_after, kept, dropped, target_tokens=0):
+        self.ps_text = ps_text
+        self.course_text = course_text
+        self.strategy_text = strategy_text
+        self.budget = budget
+        self.template_tokens = template_tokens
+        self.ps_tokens = ps_tokens
+        self.strategy_tokens = strategy_tokens
+        self.course_tokens_before = course_tokens_before
+        self.course_tokens_after = course_tokens_after
+        self.kept = kept
+        self.dropped = dropped
+        # 目标学校和专业名称
+        self.target_tokens = target_tokens
+
+    @property
+    def trimmed(self):
+        return bool(self.dropped)
+
+    @property
+    def fixed_tokens(self):
+        """不会被裁剪的部分：模板、学校和专业、旧PS、写作策略"""
+        return self.template_tokens + self.target_tokens + self.ps_tokens + self.strategy_tokens
+
+    @property
+    def total_tokens(self):
+        return self.fixed_tokens + self.course_tokens_after
+
+    @property
+    def over_budget(self):
+        """裁剪后仍超出预算：固定部分本身超出，或为保留课程信息下限而超出（只能提示，不会裁剪用户原文）"""
+        return self.total_tokens > self.budget
+
+    def over_budget_message(self):
+        """超出预算时的中文说明，列出实际的组成"""
+        parts = (f"旧 PS 约 {self.ps_tokens}、写作策略约 {self.strategy_tokens}、"
+                 f"模板及学校专业约 {self.template_tokens + self.target_tokens}")
+        if self.fixed_tokens > self.budget:
+            return f"{parts}，合计约 {self.fixed_tokens} tokens，本身已超出预算 {self.budget}"
+        return (f"{parts}，合计约 {self.fixed_tokens} tokens；课程信息至少保留 {MIN_CURRICULUM_TOKENS} tokens 的下限，"
+                f"实际保留 {self.course_tokens_after} tokens，提示词共约 {self.total_tokens} tokens，超出预算 {self.budget}")
+
+    def summary(self):
+        """一行中文摘要，用于界面提示和日志"""
+        if not self.trimmed:
+            return f"提示词约 {self.total_tokens} tokens，未超出预算 {self.budget}"
+        return (f"课程信息约 {self.course_tokens_before} tokens，超出预算 {self.budget}："
+                f"保留相关度最高的 {len(self.kept)} 段 ({self.course_tokens_after} tokens)，"
+                f"舍弃 {len(self.dropped)} 段 ({self.course_tokens_before - self.course_tokens_after} tokens)")
+
+    def as_dict(self):
+        return {
+            "budget": self.budget,
+            "total_tokens": self.total_tokens,
+            "template_tokens": self.template_tokens,
+            "target_tokens": self.target_tokens,
+            "ps_tokens": self.ps_tokens,
+            "strategy_tokens": self.strategy_tokens,
+            "course_tokens_before": self.course_tokens_before,
+            "course_tokens_after": self.course_tokens_after,
+            "kept_passages": len(self.kept),
+            "dropped": [
+                {"index": p.index, "tokens": p.tokens, "score": round(p.score, 3), "preview": preview_passage(p.text)}
+                for p in self.dropped
+            ],
+        }
+
+
+# 相关度计算用的分词
+def index_terms(text):
+    """小写化，去掉空白、标点和虚词"""
+    terms = []
+    for token in split_tokens(text.lower()):
+        if token.isspace() or not (token[0].isalnum() or token[0] == "_"):
+            continue
+        if token in STOPWORDS or (token.isdigit() and len(token) < 3):
+            continue
+        terms.append(token)
+    return terms
+
+
+# 截取段落预览
+def preview_passage(text, limit=DROPPED_PREVIEW_CHARS):
+    flat = " ".join(text.split())
+    return flat if len(flat) <= limit else flat[:limit] + "…"
+
+
+# 将课程信息切分为段落
+def chunk_curriculum(text, chunk_tokens=CHUNK_TOKENS):
+    """空行处切分；PDF提取的文本常常没有空行，连续行累计到目标大小后切分；超长的行按句切分"""
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    def close_chunk():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append("\n".join(current))
+        current = []
+        current_tokens = 0
+
+    for line in text.splitlines():
+        if not line.strip():
+            close_chunk()
+            continue
+        line_tokens = estimate_tokens(line)
+        if line_tokens > chunk_tokens * 2:
+            close_chunk()
+            pieces = [s for s in _SENTENCE_END_RE.split(line) if s.strip()]
+            for piece in pieces:
+                piece_tokens = estimate_tokens(piece)
+                if current and current_tokens + piece_tokens > chunk_tokens:
+                    close_chunk()
+                current.append(piece)
+                current_tokens += piece_tokens
+            close_chunk()
+            continue
+        if current and current_tokens + line_tokens > chunk_tokens:
+            close_chunk()
+        current.append(line)
+        current_tokens += line_tokens
+    close_chunk()
+    return chunks
+
+
+# 用BM25为段落打分
+def score_passages(passages, query_weights, k1=BM25_K1, b=BM25_B):
+    """query_weights: {词: 权重}；结果写入每个段落的score"""
+    if not passages:
+        return
+    doc_freq = Counter()
+    for passage in passages:
+        doc_freq.update(set(passage.terms))
+    count = len(passages)
+    avg_len = sum(len(p.terms) for p in passages) / count or 1.0
+    idf = {term: math.log(1 + (count - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    for passage in passages:
+        freqs = Counter(passage.terms)
+        norm = k1 * (1 - b + b * len(passage.terms) / avg_len)
+        score = 0.0
+        # 遍历段落词表而不是查询词表：PS作为查询时词表往往大于单个段落
+        for term, tf in freqs.items():
+            weight = query_weights.get(term)
+            if weight:
+                score += weight * idf[term] * tf * (k1 + 1) / (tf + norm)
+        passage.score = score
+
+
+# 由专业、PS和策略构建查询
+def build_query(major, ps_text, strategy_text=""):
+    """查询词按出现次数取对数权重，专业名称中的词额外加权"""
+    weights = {}
+    for term, tf in Counter(index_terms(ps_text) + index_terms(strategy_text or "")).items():
+        weights[term] = 1 + math.log(tf)
+    for term in set(index_terms(major or "")):
+        weights[term] = weights.get(term, 1.0) + MAJOR_QUERY_WEIGHT
+    return weights
+
+
+# 预算处理入口
+def fit_prompt_inputs(school, major, ps_text, course_text, strategy_text="", budget=DEFAULT_PROMPT_TOKEN_BUDGET,
+                      template_tokens=0):
+    """返回 BudgetResult；课程信息在预算内时原样返回，不改变提示词（缓存键保持不变）"""
+    ps_tokens = estimate_tokens(ps_text)
+    strategy_tokens = estimate_tokens(strategy_text)
+    course_tokens = estimate_tokens(course_text)
+    target_tokens = estimate_tokens(school) + estimate_tokens(major)
+    fixed_tokens = template_tokens + ps_tokens + strategy_tokens + target_tokens
+
+    if fixed_tokens + course_tokens <= budget or not course_text.strip():
+        return BudgetResult(ps_text, course_text, strategy_text, budget, template_tokens, ps_tokens,
+                            strategy_tokens, course_tokens, course_tokens, [], [], target_tokens)
+
+    # 用户的PS不做裁剪，课程信息至少保留一个下限
+    course_budget = max(budget - fixed_tokens, MIN_CURRICULUM_TOKENS)
+    passages = [Passage(index, chunk, estimate_tokens(chunk), index_terms(chunk))
+                for index, chunk in enumerate(chunk_curriculum(course_text))]
+    score_passages(passages, build_query(major, ps_text, strategy_text))
+
+    # 按得分从高到低装入预算，得分相同时保留靠前的段落
+    kept, dropped = [], []
+    used = 0
+    for passage in sorted(passages, key=lambda p: (-p.score, p.index)):
+        if used + passage.tokens <= course_budget:
+            kept.append(passage)
+            used += passage.tokens
+        else:
+            dropped.append(passage)
+
+    kept.sort(key=lambda p: p.index)
+    dropped.sort(key=lambda p: p.index)
+    trimmed_text = "\n\n".join(p.text for p in kept)
+    return BudgetResult(ps_text, trimmed_text, strategy_text, budget, template_tokens, ps_tokens,
+                        strategy_tokens, course_tokens, used, kept, dropped, target_tokens)
+
+
+# 分析提示词的预算处理
+def fit_analysis_inputs(school, major, ps_text, course_text, has_images, strategy_text="",
+                        budget=DEFAULT_PROMPT_TOKEN_BUDGET):
+    """计入分析提示词模板本身的token数后调用 fit_prompt_inputs；
+    模板按实际的策略构建（有策略时才包含策略说明的外层文字），再减去策略本身"""
+    from psr_core import build_analysis_prompt
+    template_prompt = build_analysis_prompt("", "", "", "", has_images, strategy_text)
+    template_tokens = estimate_tokens(template_prompt) - estimate_tokens(strategy_text)
+    return fit_prompt_inputs(school, major, ps_text, course_text, strategy_text, budget, template_tokens)
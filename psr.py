@@ -1,11 +1,34 @@
 import os
-import streamlit as st
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import re
-import time
-from io import BytesIO
-from PIL import Image
+import hashlib
+import logging
+import secrets
+import streamlit as st
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from response_cache import ResponseCache
+from section_parser import SECTION_DELIMITER, SectionStreamParser, parse_sections
+from psr_logging import setup_logging, bind_session_id, preview, worker_log_path
+from doc_ingest import ingest_file, set_shared_store
+from shared_backend import DEFAULT_SHARED_BACKEND, SHARED_BACKEND_ENV, WORKER_ID_ENV, create_shared_store, worker_id
+from image_prep import prepare_images
+from model_registry import ModelRegistry
+from model_backend import BACKEND_ENV, MOCK_API_KEY
+from context_cache import create_context_cache
+from metrics import DEFAULT_HTTP_HOST, MetricsRegistry
+from paragraph_store import ParagraphStore, rebuild_store_from_state
+from session_store import SESSION_META_KEYS, SessionRegistry, bind_session_state
+from job_queue import JOB_CANCELLED, JOB_DONE, JOB_INTERRUPTED, JOB_QUEUED, JobCancelled, JobQueue, QueueFullError
+from text_cleaning import MODEL_OUTPUT_PIPELINE
+from stream_render import AdaptiveStreamRenderer
+from vocab_lint import highlight_lint_html, lint_text
+from prompt_budget import DEFAULT_PROMPT_TOKEN_BUDGET, fit_analysis_inputs, preview_passage
+from call_governor import CallGovernor
+from psr_core import (
+    HAS_DOCX, remove_markdown_bold,
+    create_docx_smart, generate_preview_html, highlight_differences, contains_chinese,
+    contains_annotation, extract_paragraph_topic, build_analysis_prompt, build_continuation_prompt,
+    build_refine_prompt, build_translate_prompt, build_english_refine_prompt, build_lint_fix_prompt,
+)
 
 # ==========================================
 # 🔴 网络代理配置
@@ -14,30 +37,6 @@ from PIL import Image
 # os.environ["HTTP_PROXY"] = "http://127.0.0.1:7897"
 # os.environ["HTTPS_PROXY"] = "http://127.0.0.1:7897"
 
-# ==========================================
-# 依赖库检测与初始化
-# 检查是否安装了处理Word文档和PDF文件的库，并相应设置标志
-# ==========================================
-HAS_DOCX = False
-HAS_PDF = False
-
-try:
-    # 尝试导入处理Word文档的库
-    from docx import Document
-    from docx.shared import Pt, Inches
-    from docx.enum.text import WD_ALIGN_PARAGRAPH
-    from docx.enum.section import WD_SECTION
-    HAS_DOCX = True
-except ImportError:
-    pass
-
-try:
-    # 尝试导入处理PDF文件的库
-    import pypdf
-    HAS_PDF = True
-except ImportError:
-    pass
-
 # ==========================================
 # 自定义UI样式函数
 # 通过注入CSS来创建米色背景和宝蓝色按钮的自定义界面
@@ -307,6 +306,23 @@ def apply_custom_css():
         background-color: #FFEB3B;
         font-weight: bold;
     }
+
+    /* 用词检查：禁用词和禁用句式、副词等提醒 */
+    .lint-error {
+        background-color: #fecaca;
+        color: inherit;
+        border-bottom: 2px solid #dc2626;
+    }
+    .lint-warning {
+        background-color: #fef3c7;
+        color: inherit;
+    }
+
+    /* 差异比较中被删除的内容 */
+    .deleted-text {
+        color: #94a3b8;
+        text-decoration: line-through;
+    }
     
     /* 确保上传文件区域和文本框顶端对齐 */
     .top-align-container {
@@ -371,95 +387,272 @@ apply_custom_css()
 # 调试模式标志
 DEBUG_MODE = True
 
-# 日志系统
-import logging
-from datetime import datetime
-
-def setup_logging():
-    """设置日志系统"""
-    logger = logging.getLogger('psr_debug')
-    logger.setLevel(logging.DEBUG)
-
-    # 避免重复添加handler
-    if not logger.handlers:
-        # 文件handler
-        fh = logging.FileHandler('psr_debug.log', encoding='utf-8')
-        fh.setLevel(logging.DEBUG)
+# URL中的会话ID格式
+SESSION_ID_RE = re.compile(r"[0-9a-f]{32}")
 
-        # 控制台handler（仅当DEBUG_MODE开启时）
-        if DEBUG_MODE:
-            ch = logging.StreamHandler()
-            ch.setLevel(logging.DEBUG)
+# 多进程部署：工作进程名（设置 PSR_WORKER_ID 时日志写入各自的文件）和共享存储地址
+WORKER_ID = worker_id()
+SHARED_BACKEND_URL = os.environ.get(SHARED_BACKEND_ENV, DEFAULT_SHARED_BACKEND)
 
-        # 格式化
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh.setFormatter(formatter)
-        if DEBUG_MODE:
-            ch.setFormatter(formatter)
-
-        logger.addHandler(fh)
-        if DEBUG_MODE:
-            logger.addHandler(ch)
-
-    return logger
-
-logger = setup_logging()
+# 日志系统：队列 + 后台写入线程，渲染线程不直接写文件
+logger = setup_logging(DEBUG_MODE, log_path=worker_log_path(os.environ.get(WORKER_ID_ENV)))
 
 def log_session_state_summary():
     """记录session state的摘要信息"""
     logger.info("=== Session State 摘要 ===")
-    logger.info(f"sections_data长度: {len(st.session_state.get('sections_data', []))}")
-    logger.info(f"confirmed_paragraphs: {st.session_state.get('confirmed_paragraphs', set())}")
-    logger.info(f"confirmed_contents keys: {list(st.session_state.get('confirmed_contents', {}).keys())}")
+    logger.info("sections_data长度: %s", len(st.session_state.get('sections_data', [])))
+    logger.info("confirmed_paragraphs: %s", st.session_state.get('confirmed_paragraphs', set()))
+    logger.info("confirmed_contents keys: %s", list(st.session_state.get('confirmed_contents', {}).keys()))
 
     # 检查confirmed_contents中的实际内容
     confirmed_contents = st.session_state.get('confirmed_contents', {})
     for idx, content in confirmed_contents.items():
-        logger.info(f"confirmed_contents[{idx}] 长度: {len(content) if content else 0}")
+        logger.info("confirmed_contents[%s] 长度: %s", idx, len(content) if content else 0)
         if content and len(content) < 100:
-            logger.debug(f"confirmed_contents[{idx}] 内容: {content}")
+            logger.debug("confirmed_contents[%s] 内容: %s", idx, content)
 
-    logger.info(f"final_preview_text长度: {len(st.session_state.get('final_preview_text', ''))}")
-    logger.info(f"final_preview_text_cleaned长度: {len(st.session_state.get('final_preview_text_cleaned', ''))}")
-    logger.info(f"generation_complete: {st.session_state.get('generation_complete', False)}")
-    logger.info(f"show_sections: {st.session_state.get('show_sections', False)}")
+    logger.info("final_preview_text长度: %s", len(st.session_state.get('final_preview_text', '')))
+    logger.info("final_preview_text_cleaned长度: %s", len(st.session_state.get('final_preview_text_cleaned', '')))
+    logger.info("generation_complete: %s", st.session_state.get('generation_complete', False))
+    logger.info("show_sections: %s", st.session_state.get('show_sections', False))
     logger.info("=== Session State 摘要结束 ===")
 
-# 在脚本开始时记录session state
-log_session_state_summary()
+# 在脚本开始时记录session state（INFO级别关闭时跳过整个摘要的构建）
+if logger.isEnabledFor(logging.INFO):
+    log_session_state_summary()
 
 # 初始化所有会话状态变量，用于在页面重新加载时保持数据
 if 'ps_content' not in st.session_state: st.session_state['ps_content'] = ""  # 原始PS内容
 if 'curr_content' not in st.session_state: st.session_state['curr_content'] = ""  # 课程内容
 if 'strategy_content' not in st.session_state: st.session_state['strategy_content'] = ""  # 策略内容
-if 'sections_data' not in st.session_state: st.session_state['sections_data'] = []  # 段落数据
-if 'translation_results' not in st.session_state: st.session_state['translation_results'] = {}  # 翻译结果
-if 'edited_translations' not in st.session_state: st.session_state['edited_translations'] = {}  # 编辑后的翻译
-if 'refine_results' not in st.session_state: st.session_state['refine_results'] = {}  # 修改结果
-if 'preview_results' not in st.session_state: st.session_state['preview_results'] = {}  # 预览结果
 if 'generation_complete' not in st.session_state: st.session_state['generation_complete'] = False  # 生成完成标志
-if 'full_response' not in st.session_state: st.session_state['full_response'] = ""  # 完整响应
 if 'show_sections' not in st.session_state: st.session_state['show_sections'] = False  # 显示段落标志
 if 'annotation_processing' not in st.session_state: st.session_state['annotation_processing'] = {}  # 批注处理状态
-if 'annotation_results' not in st.session_state: st.session_state['annotation_results'] = {}  # 批注处理结果
-if 'original_texts' not in st.session_state: st.session_state['original_texts'] = {}  # 原始文本，用于比较
 if 'final_preview_text' not in st.session_state: st.session_state['final_preview_text'] = ""  # 最终预览文本
 if 'final_preview_text_cleaned' not in st.session_state: st.session_state['final_preview_text_cleaned'] = ""  # 清理后的最终预览文本
+if 'final_preview_version' not in st.session_state: st.session_state['final_preview_version'] = 0  # 段落片段更新最终预览的次数，导出片段据此刷新
 if 'confirmed_paragraphs' not in st.session_state: st.session_state['confirmed_paragraphs'] = set()  # 已确认段落的索引
-if 'confirmed_contents' not in st.session_state: st.session_state['confirmed_contents'] = {}  # 已确认段落的内容
+if 'ingest_reports' not in st.session_state: st.session_state['ingest_reports'] = {}  # 文件解析耗时摘要
+if 'paragraph_store' not in st.session_state: st.session_state['paragraph_store'] = ParagraphStore()  # 已确认段落的有序存储
+if 'stream_partials' not in st.session_state: st.session_state['stream_partials'] = {}  # 被中止的流式输出的部分结果
+if 'analysis_job_id' not in st.session_state: st.session_state['analysis_job_id'] = None  # 后台运行的全文分析任务
+if 'analysis_progress' not in st.session_state: st.session_state['analysis_progress'] = None  # 分析任务的增量解析进度
+
+# 会话存储配置：SQLite路径、空闲卸载时间、内存中最多常驻的会话数
+SESSION_DB_PATH = "psr_sessions.sqlite3"
+SESSION_IDLE_SECONDS = 30 * 60
+SESSION_MAX_RESIDENT = 50
+
+@st.cache_resource(show_spinner=False)
+def get_session_registry():
+    """创建所有会话共享的会话存储表"""
+    return SessionRegistry(db_path=SESSION_DB_PATH, idle_seconds=SESSION_IDLE_SECONDS,
+                           max_resident=SESSION_MAX_RESIDENT)
+
+session_registry = get_session_registry()
+
+# 为每个浏览器会话分配随机ID并写入URL (?sid=)，服务重启或刷新页面后可按ID恢复会话；日志只显示前8位。
+# URL中的ID只用于恢复已存在的会话，不存在时生成新ID，不会按外部给定的ID创建会话
+if 'session_id' not in st.session_state:
+    requested_sid = st.query_params.get("sid", "")
+    if SESSION_ID_RE.fullmatch(requested_sid) and session_registry.exists(requested_sid):
+        st.session_state['session_id'] = requested_sid
+    else:
+        st.session_state['session_id'] = secrets.token_hex(16)
+if st.query_params.get("sid") != st.session_state['session_id']:
+    st.query_params["sid"] = st.session_state['session_id']
+bind_session_id(st.session_state['session_id'][:8])
+
+# 段落数据 (sections_data) 以及修改、批注、翻译、确认等结果统一保存在会话存储的段落记录中，
+# 会话状态中的同名键是记录的视图；首次打开时从SQLite恢复已保存的会话。
+# 空闲卸载的存储已保存并从会话表中移除，再次打开得到新的存储对象时重新绑定
+opened_store = session_registry.open(st.session_state['session_id'])
+if st.session_state.get('session_store') is not opened_store:
+    st.session_state['session_store'] = opened_store
+    bind_session_state(st.session_state, opened_store)
+    # 恢复的会话中已有确认段落时重建最终预览
+    if st.session_state['confirmed_paragraphs'] and st.session_state['sections_data']:
+        st.session_state['final_preview_text'] = rebuild_store_from_state(st.session_state)
+session_store = st.session_state['session_store']
+# 运行期间固定在内存中，其他会话触发的卸载检查不会释放本会话的记录
+session_store.begin_run()
+session_registry.evict_idle()
+
+# 保存会话存储
+def persist_session():
+    """同步需要持久化的会话状态，有修改时写入SQLite"""
+    session_store.sync_meta({key: st.session_state.get(key) for key in SESSION_META_KEYS})
+    session_store.save()
+
+# 重建最终预览文本
+def rebuild_final_preview():
+    """按段落顺序完整重建段落存储并返回最终预览文本（仅用于强制重建）"""
+    logger.info("=== 开始重建最终预览 ===")
+    store = st.session_state['paragraph_store']
+
+    if not st.session_state['sections_data']:
+        logger.warning("没有段落数据")
+        if DEBUG_MODE:
+            st.warning("没有段落数据")  # 调试信息
+        store.reset({})
+        return ""
+
+    confirmed_indices = sorted(idx for idx in st.session_state['confirmed_paragraphs']
+                               if idx < len(st.session_state['sections_data']))
+    if not confirmed_indices:
+        logger.warning("已确认段落为空: %s", st.session_state['confirmed_paragraphs'])
+        if DEBUG_MODE:
+            st.warning(f"已确认段落为空: {st.session_state['confirmed_paragraphs']}")  # 调试信息
+        store.reset({})
+        return ""
+
+    result = rebuild_store_from_state(st.session_state)
+    logger.info("重建完成，段落数: %s，最终结果长度: %s", len(store), len(result))
+    return result
+
+# 段落片段内更新最终预览
+def publish_final_preview(text):
+    """写入最终预览文本并递增版本号；段落片段只重跑自身，导出片段轮询到新版本后刷新预览和导出"""
+    st.session_state['final_preview_text'] = text
+    st.session_state['final_preview_text_cleaned'] = ''
+    st.session_state['final_preview_version'] += 1
+
+# 已确认段落被编辑时只替换该段落的片段
+def sync_confirmed_paragraph(idx):
+    """文本框on_change回调：已确认段落的修改同步到段落存储和最终预览"""
+    if idx not in st.session_state['confirmed_paragraphs']:
+        return
+    new_text = st.session_state.get(f"draft_p_{idx}", "")
+    if not new_text or not new_text.strip():
+        return
+    st.session_state['confirmed_contents'][idx] = new_text
+    if st.session_state['paragraph_store'].set(idx, new_text):
+        publish_final_preview(st.session_state['paragraph_store'].text)
+        logger.info("段落 %s 已编辑，最终预览已局部更新", idx)
+
+# 响应缓存配置：内存LRU条目数、SQLite持久层路径(None则不持久化)、过期时间与容量上限
+RESPONSE_CACHE_MAX_ENTRIES = 256
+RESPONSE_CACHE_DB_PATH = "psr_cache.sqlite3"
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+RESPONSE_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+@st.cache_resource(show_spinner=False)
+def get_shared_store():
+    """创建所有工作进程共用的存储（响应缓存、文档解析缓存、调用限速计数），none 时返回None"""
+    store = create_shared_store(SHARED_BACKEND_URL)
+    set_shared_store(store)
+    logger.info("工作进程 %s 使用共享存储: %s", WORKER_ID, store.stats() if store else "none")
+    return store
+
+shared_store = get_shared_store()
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    """创建进程内共享的响应缓存，所有会话共用；配置了共享存储时持久层放在共享存储中"""
+    return ResponseCache(
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        db_path=RESPONSE_CACHE_DB_PATH,
+        ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+        max_db_bytes=RESPONSE_CACHE_MAX_BYTES,
+        shared=shared_store,
+    )
+
+response_cache = get_response_cache()
+if 'use_response_cache' not in st.session_state: st.session_state['use_response_cache'] = True  # 是否使用响应缓存
+
+# 设置默认使用的模型
+model_name = "gemini-2.5-pro"
+
+@st.cache_resource(show_spinner=False)
+def get_model_registry(name):
+    """创建进程内共享的模型注册表，按任务复用模型对象和底层连接"""
+    return ModelRegistry(name)
+
+model_registry = get_model_registry(model_name)
+
+@st.cache_resource(show_spinner=False)
+def get_context_cache(name):
+    """创建进程内共享的提示词前缀缓存：后端支持时把静态前缀注册为上下文缓存，否则发送完整提示词"""
+    return create_context_cache(get_model_registry(name))
+
+context_cache = get_context_cache(model_name)
+
+# 调用治理配置：每个API Key每分钟请求数、突发上限、全进程并发上限和最大重试次数
+# 配置了共享存储时每分钟请求数是所有工作进程的合计
+# 压测时可通过环境变量覆盖（例如配合 PSR_BACKEND=mock 放宽限速）
+GEMINI_REQUESTS_PER_MINUTE = float(os.environ.get("PSR_REQUESTS_PER_MINUTE", 30))
+GEMINI_BURST = int(os.environ.get("PSR_BURST", 5))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("PSR_MAX_CONCURRENCY", 8))
+GEMINI_MAX_RETRIES = 4
+
+@st.cache_resource(show_spinner=False)
+def get_call_governor():
+    """创建所有会话共享的调用治理器"""
+    return CallGovernor(
+        requests_per_minute=GEMINI_REQUESTS_PER_MINUTE,
+        burst=GEMINI_BURST,
+        max_concurrency=GEMINI_MAX_CONCURRENCY,
+        max_retries=GEMINI_MAX_RETRIES,
+        shared_store=shared_store,
+    )
+
+call_governor = get_call_governor()
+
+# 性能指标导出：JSONL文件路径和Prometheus端点端口，未设置则不导出；
+# 端点默认只监听本机，需要由其他机器抓取时设置 PSR_METRICS_HOST（例如 0.0.0.0）
+METRICS_JSONL_PATH = os.environ.get("PSR_METRICS_JSONL")
+METRICS_PORT = os.environ.get("PSR_METRICS_PORT")
+METRICS_HOST = os.environ.get("PSR_METRICS_HOST", DEFAULT_HTTP_HOST)
+
+@st.cache_resource(show_spinner=False)
+def get_metrics():
+    """创建所有会话共享的指标注册表，配置了端口时启动 /metrics 端点"""
+    registry = MetricsRegistry(jsonl_path=METRICS_JSONL_PATH)
+    if METRICS_PORT:
+        # 同一台机器上的多个工作进程依次使用后续端口
+        if registry.start_http_server(int(METRICS_PORT), host=METRICS_HOST) is None:
+            logger.warning("Prometheus指标端点启动失败: 端口 %s 起均被占用", METRICS_PORT)
+        else:
+            logger.info("Prometheus指标端点已启动: %s:%s/metrics", METRICS_HOST, registry.http_port)
+    return registry
 
-# 从Streamlit secrets获取Google API Key
+metrics = get_metrics()
+
+# 后台任务配置：线程数、每个会话同时排队或运行的任务上限、部分输出的SQLite路径、界面轮询间隔
+JOB_MAX_WORKERS = 8
+JOB_MAX_PER_SESSION = 2
+JOB_DB_PATH = "psr_jobs.sqlite3"
+JOB_POLL_SECONDS = 1.0
+# 最终导出片段检查预览版本号的间隔（秒）
+EXPORT_POLL_SECONDS = 1.0
+
+@st.cache_resource(show_spinner=False)
+def get_job_queue():
+    """创建所有会话共享的后台任务队列"""
+    return JobQueue(max_workers=JOB_MAX_WORKERS, max_jobs_per_owner=JOB_MAX_PER_SESSION, db_path=JOB_DB_PATH,
+                    worker=WORKER_ID)
+
+job_queue = get_job_queue()
+
+# 分析提示词的token预算（不含图片），课程信息超出时只保留与专业和PS最相关的段落
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PSR_PROMPT_TOKEN_BUDGET", DEFAULT_PROMPT_TOKEN_BUDGET))
+
+# 从Streamlit secrets获取Google API Key；模拟后端不需要真实的Key
 api_key = st.secrets.get("GOOGLE_API_KEY")
+if not api_key and not model_registry.backend.requires_api_key:
+    api_key = MOCK_API_KEY
 if api_key:
     os.environ["GOOGLE_API_KEY"] = api_key
-    genai.configure(api_key=api_key)
+    model_registry.configure(api_key)
 else:
     pass  # 错误信息在侧边栏中显示
 
 # 侧边栏设置
 with st.sidebar:
     st.markdown("### 设置")
-    if api_key:
+    if not model_registry.backend.requires_api_key:
+        st.warning(f"⚠️ 正在使用本地模拟模型 ({BACKEND_ENV}={model_registry.backend.name})")
+    elif api_key:
         st.success("✅ API Key 已从 Secrets 加载")
     else:
         st.sidebar.error("❌ API Key 未配置")
@@ -509,605 +702,415 @@ with st.sidebar:
     else:
         st.warning("confirmed_contents为空")
 
+    # 模型复用统计
+    registry_stats = model_registry.stats()
+    st.caption(f"模型对象: 构建 {registry_stats['models_created']} 次 / 复用 {registry_stats['model_reuses']} 次 "
+               f"(复用率 {registry_stats['reuse_rate']:.0%}) | 客户端配置 {registry_stats['configure_calls']} 次")
+
+    # 提示词前缀缓存统计
+    prefix_stats = context_cache.stats()
+    st.caption(f"前缀缓存 ({prefix_stats['mode']}): 复用 {prefix_stats['hits']} 次 / 注册 {prefix_stats['created']} 个 | "
+               f"前缀过短 {prefix_stats['too_short']} 次 | 注册失败 {prefix_stats['failures']} 次 | "
+               f"节省约 {prefix_stats['saved_tokens']} 输入tokens")
+
+    # 会话存储统计
+    session_stats = session_registry.stats()
+    store_stats = session_store.stats()
+    st.caption(f"会话存储: 本会话 {store_stats['paragraphs']} 段 / 去重文本 {store_stats['texts']} 条 "
+               f"({store_stats['chars'] / 1024:.0f}K字符) | 常驻 {session_stats['resident']}/{session_stats['sessions']} 个会话 | "
+               f"已卸载 {session_stats['evictions']} 次")
+
+    # 后台任务统计
+    job_stats = job_queue.stats()
+    st.caption(f"后台任务: 运行 {job_stats['running']} 个 | 排队 {job_stats['queued']} 个 | "
+               f"已提交 {job_stats['submitted']} 个 | 已取消 {job_stats['cancelled']} 个 | 超出上限 {job_stats['rejected']} 次")
+
+    # 调用治理统计
+    governor_stats = call_governor.stats()
+    st.caption(f"模型调用: {governor_stats['calls']} 次 | 重试 {governor_stats['retries']} 次 | "
+               f"续写 {governor_stats['stream_resumes']} 次 | 失败 {governor_stats['failures']} 次 | "
+               f"限速等待 {governor_stats['throttled_seconds']:.1f}s")
+
+    # 性能指标：模型调用按任务汇总，本地阶段单独计时
+    with st.expander("性能指标", expanded=False):
+        metrics_snapshot = metrics.snapshot()
+        if metrics_snapshot["tasks"]:
+            st.table(metrics_snapshot["tasks"])
+        if metrics_snapshot["stages"]:
+            st.table(metrics_snapshot["stages"])
+        if not metrics_snapshot["tasks"] and not metrics_snapshot["stages"]:
+            st.caption("暂无数据")
+        st.download_button("导出 Prometheus 指标", metrics.prometheus_text(), file_name="psr_metrics.prom",
+                           mime="text/plain", key="metrics_export_btn")
+        if metrics.http_port:
+            st.caption(f"Prometheus端点: {METRICS_HOST}:{metrics.http_port}/metrics")
+        elif METRICS_PORT:
+            st.caption(f"Prometheus端点未启动: 端口 {METRICS_PORT} 起均被占用")
+        if METRICS_JSONL_PATH:
+            st.caption(f"JSONL: {METRICS_JSONL_PATH}")
+
+    # 响应缓存统计
+    st.divider()
+    st.markdown("### 响应缓存")
+    st.checkbox("使用响应缓存", key="use_response_cache")
+    cache_stats = response_cache.stats()
+    st.info(f"命中: {cache_stats['hits']} (内存 {cache_stats['memory_hits']} / 磁盘 {cache_stats['disk_hits']}) | "
+            f"未命中: {cache_stats['misses']} | 命中率: {cache_stats['hit_rate']:.0%}")
+    disk_entries = "-" if cache_stats['disk_entries'] is None else cache_stats['disk_entries']
+    st.caption(f"内存条目: {cache_stats['memory_entries']} | 磁盘条目: {disk_entries}")
+    if shared_store is not None:
+        shared_stats = shared_store.stats()
+        st.caption(f"共享存储: {shared_stats['backend']} ({shared_stats['location']}) | 工作进程 {WORKER_ID} | "
+                   f"存储错误 {shared_stats['errors']} 次")
+    if st.button("🗑️ 清空响应缓存", key="clear_cache_btn",
+                 help="只清空本进程的缓存；共享存储中的缓存由所有工作进程共用，不会被清空"):
+        response_cache.clear()
+        st.rerun()
+
     # 诊断按钮
     st.divider()
     col1, col2 = st.columns(2)
     with col1:
         if st.button("📋 输出详细诊断日志", key="diagnostic_btn"):
-            logger.info(f"=== 详细诊断日志 ===")
-            logger.info(f"final_preview_text长度: {len(st.session_state['final_preview_text'])}")
-            logger.info(f"final_preview_text_cleaned长度: {len(st.session_state.get('final_preview_text_cleaned', ''))}")
-            logger.info(f"final_preview_text_display session state存在: {'final_preview_text_display' in st.session_state}")
-            logger.info(f"sections_data长度: {len(st.session_state['sections_data'])}")
-            logger.info(f"confirmed_paragraphs: {st.session_state['confirmed_paragraphs']}")
-            logger.info(f"confirmed_contents keys: {list(st.session_state['confirmed_contents'].keys())}")
+            logger.info("=== 详细诊断日志 ===")
+            logger.info("final_preview_text长度: %s", len(st.session_state['final_preview_text']))
+            logger.info("final_preview_text_cleaned长度: %s", len(st.session_state.get('final_preview_text_cleaned', '')))
+            logger.info("final_preview_text_display session state存在: %s", 'final_preview_text_display' in st.session_state)
+            logger.info("sections_data长度: %s", len(st.session_state['sections_data']))
+            logger.info("confirmed_paragraphs: %s", st.session_state['confirmed_paragraphs'])
+            logger.info("confirmed_contents keys: %s", list(st.session_state['confirmed_contents'].keys()))
 
             # 检查每个confirmed_contents的内容
             for idx, content in st.session_state['confirmed_contents'].items():
-                logger.info(f"confirmed_contents[{idx}]长度: {len(content) if content else 0}")
+                logger.info("confirmed_contents[%s]长度: %s", idx, len(content) if content else 0)
                 if content and len(content) < 500:
-                    logger.info(f"confirmed_contents[{idx}]内容前200字符: {content[:200]}")
+                    logger.info("confirmed_contents[%s]内容前200字符: %s", idx, preview(content, 200))
 
             # 检查final_preview_text_display
             if 'final_preview_text_display' in st.session_state:
                 display_val = st.session_state['final_preview_text_display']
-                logger.info(f"final_preview_text_display长度: {len(display_val) if display_val else 0}")
+                logger.info("final_preview_text_display长度: %s", len(display_val) if display_val else 0)
                 if display_val and len(display_val) < 500:
-                    logger.info(f"final_preview_text_display前200字符: {display_val[:200]}")
+                    logger.info("final_preview_text_display前200字符: %s", preview(display_val, 200))
 
             # 检查display_text的计算
             cleaned_text = st.session_state.get('final_preview_text_cleaned', '')
             if cleaned_text and cleaned_text.strip():
                 display_text = cleaned_text
-                logger.info(f"display_text使用final_preview_text_cleaned，长度: {len(display_text)}")
+                logger.info("display_text使用final_preview_text_cleaned，长度: %s", len(display_text))
             else:
                 display_text = st.session_state['final_preview_text']
-                logger.info(f"display_text使用final_preview_text，长度: {len(display_text)}")
-            logger.info(f"display_text前200字符: {display_text[:200] if display_text else '空'}")
+                logger.info("display_text使用final_preview_text，长度: %s", len(display_text))
+            logger.info("display_text前200字符: %s", preview(display_text, 200))
 
-            logger.info(f"=== 诊断日志结束 ===")
+            logger.info("=== 诊断日志结束 ===")
             st.success("详细诊断日志已输出到日志文件")
 
     with col2:
         if st.button("🔄 强制重建预览", key="rebuild_preview_btn"):
-            logger.info(f"=== 强制重建预览 ===")
+            logger.info("=== 强制重建预览 ===")
             rebuilt_text = rebuild_final_preview()
-            logger.info(f"重建结果长度: {len(rebuilt_text)}")
+            logger.info("重建结果长度: %s", len(rebuilt_text))
             if rebuilt_text and rebuilt_text.strip():
                 st.session_state['final_preview_text'] = rebuilt_text
-                logger.info(f"final_preview_text已更新，长度: {len(rebuilt_text)}")
+                logger.info("final_preview_text已更新，长度: %s", len(rebuilt_text))
                 st.success(f"预览已重建，长度: {len(rebuilt_text)} 字符")
                 # 清除清理版本
                 st.session_state['final_preview_text_cleaned'] = ''
                 logger.info("已清除final_preview_text_cleaned")
                 st.rerun()
             else:
-                logger.warning(f"重建结果为空")
+                logger.warning("重建结果为空")
                 st.error("重建失败，结果为空")
 
-# 设置默认使用的模型
-model_name = "gemini-2.5-pro"
+# 批量翻译时同时发送的最大请求数
+TRANSLATE_MAX_WORKERS = 4
 
-# 安全设置，用于交互式API调用
-safety_settings_interactive = {
-    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-}
+# 翻译结果未通过本地用词检查时，最多重新调用模型修正的次数
+LINT_FIX_MAX_ATTEMPTS = 1
+
+# 流式输出的批量刷新策略：累计字符数或时间间隔任一达到即刷新界面
+BUFFER_SIZE = 200  # 字符阈值
+UPDATE_INTERVAL = 0.05  # 50ms
 
 # ==========================================
 # 工具函数
 # 包含各种辅助功能，如文件处理、文本清理和格式转换
 # ==========================================
 
-# 从上传的文件中提取文本内容
-def extract_text_from_file(uploaded_file):
-    """从上传的文件中提取文本，支持DOCX、PDF和TXT格式"""
-    if not uploaded_file: return ""
-    file_type = uploaded_file.name.split('.')[-1].lower()
-    text = ""
-    try:
-        if file_type == 'docx' and HAS_DOCX:
-            doc = Document(uploaded_file)
-            for para in doc.paragraphs: text += para.text + "\n"
-        elif file_type == 'pdf' and HAS_PDF:
-            reader = pypdf.PdfReader(uploaded_file)
-            for page in reader.pages: text += page.extract_text() + "\n"
-        elif file_type == 'txt':
-            text = uploaded_file.getvalue().decode("utf-8")
-    except Exception as e:
-        return f"[读取文件出错: {e}]"
+# 带缓存的非流式模型调用
+def generate_text_cached(prompt, task, style="", use_cache=True):
+    """调用指定任务的模型生成文本，相同的模型、提示词和风格直接返回缓存结果"""
+    cache_key = ResponseCache.make_key(model_name, prompt, style=style)
+    if use_cache:
+        cached_text = response_cache.get(cache_key)
+        if cached_text is not None:
+            metrics.record_cache_hit(task)
+            return cached_text
+
+    # 静态前缀已注册为上下文缓存时只发送后缀
+    model, contents = context_cache.resolve(task, prompt)
+    with metrics.model_call(task, prompt) as call:
+        res = call_governor.call(lambda: model.generate_content(contents), api_key, on_retry=call.on_retry)
+        text = res.text
+        call.record_usage(getattr(res, "usage_metadata", None))
+        call.finish(text)
+    response_cache.set(cache_key, text)
     return text
 
-# 清除文本中的星号
-def clean_asterisks(text):
-    """移除文本中的所有星号字符"""
-    if not text: return ""
-    return text.replace("*", "")
-
-# 移除Markdown加粗标记
-def remove_markdown_bold(text):
-    """移除文本中的Markdown加粗标记（**）"""
-    return text.replace("**", "")
-
-# 过滤AI生成内容中的问候语
-def filter_ai_greeting(text):
-    """移除AI生成内容开头的常见问候语和介绍语"""
-    greeting_patterns = [
-        r'^好的，作为.*?顾问.*?\n+',
-        r'^作为.*?顾问.*?\n+',
-        r'^我将.*?分析.*?\n+',
-        r'^下面我将.*?\n+',
-        r'^我会.*?帮助您.*?\n+',
-        r'^让我.*?为您.*?\n+'
-    ]
-    
-    for pattern in greeting_patterns:
-        text = re.sub(pattern, '', text, flags=re.DOTALL)
-    
+# 修正未通过用词检查的文本
+def fix_lint_errors(text, use_cache=True, max_attempts=LINT_FIX_MAX_ATTEMPTS):
+    """本地检查禁用词和禁用句式，只有存在错误时才调用模型修正；修正后错误没有减少则保留原文"""
+    with metrics.stage("lint"):
+        result = lint_text(text)
+    for _ in range(max_attempts):
+        if not result.failed:
+            break
+        fixed = generate_text_cached(build_lint_fix_prompt(text, result.errors), "lint_fix", use_cache=use_cache)
+        with metrics.stage("lint"):
+            fixed_result = lint_text(fixed)
+        logger.info("用词检查修正: %s 处 → %s 处", len(result.errors), len(fixed_result.errors))
+        if len(fixed_result.errors) >= len(result.errors):
+            break
+        text, result = fixed, fixed_result
     return text
 
-# 创建带有格式的Word文档
-def create_docx_smart(text_content, major_name=""):
-    """创建格式化的Word文档，包括页眉、字体设置和加粗高亮"""
-    if not HAS_DOCX: return None
-    doc = Document()
-    
-    # 设置页面边距
-    sections = doc.sections
-    for section in sections:
-        section.top_margin = Inches(1)
-        section.bottom_margin = Inches(1)
-        section.left_margin = Inches(1)
-        section.right_margin = Inches(1)
-    
-    # 添加页眉
-    header_text = f"Personal Statement - {major_name}" if major_name else "Personal Statement"
-    header = doc.sections[0].header
-    header_para = header.paragraphs[0]
-    header_para.text = header_text
-    header_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    
-    # 设置页眉文本格式
-    header_run = header_para.runs[0]
-    header_run.font.name = 'Arial'
-    header_run.font.size = Pt(11)
-
-    # 设置正文默认样式
-    style = doc.styles['Normal']
-    font = style.font
-    font.name = 'Arial'
-    font.size = Pt(11)
-    
-    # 处理正文内容，保留加粗格式
-    lines = text_content.split('\n')
-    for line in lines:
-        if not line.strip(): continue
-        clean_line = line.replace('[[LOGIC]]', '').replace('[[DRAFT]]', '')
-        p = doc.add_paragraph()
-        parts = re.split(r'(\*\*.*?\*\*)', clean_line)
-        for part in parts:
-            if part.startswith('**') and part.endswith('**'):
-                clean_text = part[2:-2]
-                run = p.add_run(clean_text)
-                run.bold = True
-            else:
-                p.add_run(part)
-    
-    # 将文档保存到内存缓冲区
-    buffer = BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
-
-# 生成HTML预览，高亮显示加粗部分
-def generate_preview_html(text_with_markdown):
-    """将Markdown格式的文本转换为HTML预览，高亮显示加粗部分"""
-    # 替换markdown加粗语法为HTML span标签
-    html_text = re.sub(r'\*\*(.*?)\*\*', r'<span style="background-color: #FFEB3B; font-weight: bold;">\1</span>', text_with_markdown)
-    
-    # 添加HTML样式，确保与文本框样式一致
-    styled_html = f"""
-    <div class="preview-container">
-        <div class="preview-text">
-            {html_text}
-        </div>
-    </div>
-    """
-    return styled_html
-
-# 新增函数：比较文本并高亮差异部分
-def highlight_differences(original_text, new_text):
-    """比较原始文本和新文本，高亮显示差异部分"""
-    # 这是一个简化的实现，实际上需要更复杂的文本差异比较算法
-    # 这里我们使用一个简单的方法：将新文本中的每个句子与原文本比较
-    
-    # 如果原文本为空，则将整个新文本高亮显示
-    if not original_text:
-        return f"<span class='modified-text'>{new_text}</span>"
-    
-    # 将文本分割成句子
-    def split_into_sentences(text):
-        # 使用正则表达式分割句子，考虑各种标点符号
-        return re.split(r'([.!?。！？\n]+)', text)
-    
-    orig_sentences = split_into_sentences(original_text)
-    new_sentences = split_into_sentences(new_text)
-    
-    # 合并相邻的分割结果
-    orig_sentences_merged = []
-    for i in range(0, len(orig_sentences)-1, 2):
-        if i+1 < len(orig_sentences):
-            orig_sentences_merged.append(orig_sentences[i] + orig_sentences[i+1])
-        else:
-            orig_sentences_merged.append(orig_sentences[i])
-    
-    new_sentences_merged = []
-    for i in range(0, len(new_sentences)-1, 2):
-        if i+1 < len(new_sentences):
-            new_sentences_merged.append(new_sentences[i] + new_sentences[i+1])
-        else:
-            new_sentences_merged.append(new_sentences[i])
-    
-    # 标记每个新句子是否存在于原文本中
-    result = []
-    for sentence in new_sentences_merged:
-        if sentence.strip() and sentence.strip() not in original_text:
-            result.append(f"<span class='modified-text'>{sentence}</span>")
-        else:
-            result.append(sentence)
-    
-    # 合并结果
-    return "".join(result)
-
-# 检测文本是否包含中文
-def contains_chinese(text):
-    """检测文本中是否包含中文字符"""
-    for char in text:
-        if '\u4e00' <= char <= '\u9fff':
-            return True
-    return False
-
-# 检测文本是否包含批注标记
-def contains_annotation(text):
-    """检测文本是否包含【】或[]形式的批注标记"""
-    return ('【' in text and '】' in text) or ('[' in text and ']' in text)
-
-# 从AI修改思路中提取段落主题
-def extract_paragraph_topic(logic_text):
-    """从AI修改思路中提取段落主题"""
-    if not logic_text:
-        return "未识别"
-
-    # 尝试从常见模式中提取
-    patterns = [
-        r"本段功能识别：\[(.+?)\]",
-        r"功能：(.+?)(?:\n|$)",
-        r"主题：(.+?)(?:\n|$)"
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, logic_text)
-        if match:
-            return match.group(1).strip()
-
-    # 根据关键词推断
-    keywords = {
-        "动机": ["动机", "兴趣", "inspiration", "motivation"],
-        "学术背景": ["学术", "学习", "课程", "academic"],
-        "研究经历": ["研究", "项目", "实验", "research"],
-        "工作经历": ["工作", "实习", "职业", "work"],
-        "职业规划": ["规划", "目标", "未来", "career"],
-        "择校理由": ["学校", "课程", "专业", "why school"]
-    }
-
-    for topic, key_list in keywords.items():
-        if any(key in logic_text.lower() for key in key_list):
-            return topic
-
-    return "段落内容"
-
-# 重建最终预览文本
-def rebuild_final_preview():
-    """按段落顺序重建最终预览文本"""
-    logger.info(f"=== 开始重建最终预览 ===")
-    logger.info(f"sections_data长度: {len(st.session_state.get('sections_data', []))}")
-    logger.info(f"confirmed_paragraphs: {st.session_state.get('confirmed_paragraphs', set())}")
-    logger.info(f"confirmed_contents keys: {list(st.session_state.get('confirmed_contents', {}).keys())}")
-
-    if not st.session_state['sections_data']:
-        logger.warning("没有段落数据")
-        if DEBUG_MODE:
-            st.warning("没有段落数据")  # 调试信息
-        return ""
+# 中止流式生成：点击停止按钮会中断正在运行的脚本，这里只记录中止标记
+def cancel_stream(stream_key):
+    """停止按钮回调，标记该流式任务已被用户中止"""
+    logger.info("用户中止流式生成: %s", stream_key)
+    st.session_state['stream_partials'].setdefault(stream_key, "")
 
-    # 确保confirmed_paragraphs是list类型
-    if isinstance(st.session_state['confirmed_paragraphs'], set):
-        confirmed_indices = sorted(list(st.session_state['confirmed_paragraphs']))
-    else:
-        confirmed_indices = sorted(st.session_state['confirmed_paragraphs'])
-
-    logger.info(f"confirmed_indices: {confirmed_indices}")
-
-    if not confirmed_indices:
-        logger.warning(f"已确认段落为空: {st.session_state['confirmed_paragraphs']}")
-        if DEBUG_MODE:
-            st.warning(f"已确认段落为空: {st.session_state['confirmed_paragraphs']}")  # 调试信息
-        return ""
-
-    paragraphs = []
-    for idx in confirmed_indices:
-        if idx < len(st.session_state['sections_data']):
-            # 调试输出
-            has_content = idx in st.session_state['confirmed_contents']
-            logger.info(f"处理段落 {idx}, confirmed_contents中有: {has_content}")
-
-            if DEBUG_MODE:
-                st.info(f"处理段落 {idx}, confirmed_contents中有: {has_content}")
-
-            if idx in st.session_state['confirmed_contents']:
-                current_text = st.session_state['confirmed_contents'][idx]
-                logger.info(f"段落 {idx} 从confirmed_contents获取内容，长度: {len(current_text) if current_text else 0}")
-                logger.debug(f"段落 {idx} 内容前100字符: {current_text[:100] if current_text else '空'}")
-
-                # 如果confirmed_contents中的内容为空，尝试从其他地方获取
-                if not current_text or not current_text.strip():
-                    logger.warning(f"段落 {idx} confirmed_contents中的内容为空，尝试从其他地方获取")
-                    textarea_key = f"draft_p_{idx}"
-                    if textarea_key in st.session_state:
-                        fallback_text = st.session_state[textarea_key]
-                        if fallback_text and fallback_text.strip():
-                            current_text = fallback_text
-                            logger.info(f"段落 {idx} 从textarea获取替代内容，长度: {len(current_text)}")
-                    else:
-                        # 最后回退到段落原始内容
-                        draft_key = f"para_{idx}"
-                        fallback_text = st.session_state['refine_results'].get(draft_key, st.session_state['sections_data'][idx]['draft'])
-                        if fallback_text and fallback_text.strip():
-                            current_text = fallback_text
-                            logger.info(f"段落 {idx} 回退到原始内容，长度: {len(current_text)}")
-            else:
-                # 如果没有保存的内容，尝试从文本框获取最新内容
-                textarea_key = f"draft_p_{idx}"
-                if textarea_key in st.session_state:
-                    current_text = st.session_state[textarea_key]
-                    logger.info(f"段落 {idx} 从textarea获取内容，长度: {len(current_text) if current_text else 0}")
-                else:
-                    # 最后回退到段落原始内容
-                    draft_key = f"para_{idx}"
-                    current_text = st.session_state['refine_results'].get(draft_key, st.session_state['sections_data'][idx]['draft'])
-                    logger.info(f"段落 {idx} 回退到原始内容，长度: {len(current_text) if current_text else 0}")
-
-            if current_text and current_text.strip():
-                paragraphs.append(current_text)
-                logger.info(f"段落 {idx} 已添加到paragraphs列表，长度: {len(current_text)}")
-            else:
-                logger.warning(f"段落 {idx} 内容为空或仅空白字符")
-
-    result = "\n\n".join(paragraphs)
-    logger.info(f"最终结果长度: {len(result)}")
-    logger.debug(f"最终结果前200字符: {result[:200] if result else '空'}")
-
-    if DEBUG_MODE:
-        st.info(f"重建结果长度: {len(result)}")  # 调试信息
-
-    logger.info(f"=== 重建完成 ===")
-    return result
-
-# ==========================================
-# Prompt构建函数
-# 为不同任务创建专门的提示词，如分析、修改和翻译
-# ==========================================
-
-# 构建初始分析提示词
-def build_analysis_prompt(school, major, old_text, new_course_text, has_images, strategy_text):
-    """构建用于初始分析和生成中英混合文本的提示词"""
-    # 如果上传了图片，添加相关指示
-    image_instruction = "我同时也上传了课程设置的截图，请务必结合截图内容。" if has_images else ""
-    
-    # 如果提供了策略文本，添加到提示中
-    custom_strategy_instruction = ""
-    if strategy_text and strategy_text.strip():
-        custom_strategy_instruction = f"""
-        【用户特别指令 (优先级最高)】
-        {strategy_text}
-        """
-    
-    # 返回完整的提示词
-    return f"""
-    你是一位专业的留学文书顾问。
-    【任务目标】将用户的【旧个人陈述】适配到新的申请目标：**{school}** 的 **{major}** 专业。
-    {custom_strategy_instruction}
-    【输入材料】
-    1. 旧 PS 内容：
-    {old_text}
-    2. 新项目课程信息：
-    {new_course_text}
-    {image_instruction}
-    
-    【核心修改逻辑 (必须严格执行)】
-    1. **结构与顺序 (尊重原文)**：
-       - 请**顺应旧文书原本的段落结构和逻辑顺序**进行输出，不要强行打乱或重组。
-       - **关键要求**：在处理每一段时，你必须在 `[[LOGIC]]` 中明确识别出**这一段的功能**。
-    
-    2. **针对"课程设置/择校理由"段落 (智能识别并深度重写)**：
-       - 当你处理到**涉及学校、课程、Why School**的段落时，必须**完全重写**。
-       - **筛选逻辑**：排除通用课程，只选与学生背景结合紧密的核心课。
-       - **深度与具体化**：必须深入引用该课程模块中的**关键概念 (Key Concepts)** 或 **具体方法学**。
-
-    3. **针对其他段落 (全篇适配与优化)**：
-       - **范围覆盖**：开头动机、学习/实践经历、职业规划。
-       - **适配新专业**：检查内容是否符合新专业逻辑。
-
-    【⚠️⚠️⚠️ 绝对强制执行规则 (ABSOLUTE MANDATORY RULES) ⚠️⚠️⚠️】
-    在生成 `[[DRAFT]]` 时，必须严格执行以下"中英混合"逻辑，这是最高优先级指令：
-    1. **Unchanged Parts (未修改部分)**: MUST remain in **Original English**. Do NOT translate them into Chinese. 未修改部分必须保留原始英文。
-    2. **Modified/New Parts (修改/新增部分)**: MUST be written in **CHINESE (中文)** directly without any brackets or parentheses. 所有修改或新增的部分必须直接用中文写出，不要用任何符号包裹。
-       - Example: Original English text... 这里插入一句关于课程 A 的具体分析，强调它如何提升我的数据挖掘能力... more original English text.
-    3. **Rewrite Sections (重写段落)**: If a whole paragraph (like Why School) is rewritten, output it **entirely in Chinese** without any brackets. 如果整段重写（如Why School段落），必须将整段内容直接用中文写出。
-       - Example: 整段重写的内容...
-    
-    【⚠️ 严格禁止】
-    1. 不要在输出开头添加任何问候语或介绍语，如"作为一名专业的留学文书顾问..."
-    2. 直接从第一段内容开始输出，不要有任何前言或开场白
-    3. 所有修改过的内容必须用中文表达，不要直接输出英文修改
-    4. 不要用英文输出任何修改内容，所有修改必须是中文
-    5. 不要使用任何符号（如方括号[]、圆括号()等）来包裹中文内容，直接输出中文即可
-
-    【输出格式示例】
-    ===SECTION===
-    [[LOGIC]]
-    本段功能识别：[例如：学术背景]
-    这里用中文解释修改思路...
-    [[DRAFT]]
-    Original English sentence here. 这里插入一句补充说明，强调量化能力. Another original English sentence.
-    ===SECTION===
-    ...
-
-    请开始输出：
-    """
-
-# 构建修改提示词 - 修改后确保直接替换原文本，修改部分用**高亮
-def build_refine_prompt(text_with_instructions, has_chinese):
-    """构建用于根据批注修改文本的提示词，根据文本是否包含中文决定输出语言，修改部分高亮显示"""
-    # 根据文本是否包含中文决定输出语言
-    output_language = "CHINESE" if has_chinese else "ENGLISH"
-
-    return f"""
-    You are an expert editor. The user has provided a draft text below, but they have inserted **modification instructions** inside brackets `【...】` or `[...]`.
-    **Your Task:**
-    1. Read the text carefully.
-    2. Identify the instructions inside `【】` or `[]` (e.g., "【把这段语气改得更自信一点】", "[make this more professional]").
-    3. **Execute** these instructions to rewrite the text.
-    4. **Remove** the instruction markers and the instruction text itself from the final output.
-    5. Keep the rest of the text that was not targeted by instructions unchanged.
-    6. Ensure the final output is smooth and coherent.
-
-    **IMPORTANT OUTPUT LANGUAGE RULE:**
-    - The text contains Chinese: {has_chinese}
-    - Your output MUST be in {output_language}.
-    - If the input contains Chinese text, keep using Chinese in your output.
-    - If the input is entirely in English, respond in English.
-
-    **HIGHLIGHTING RULE:**
-    - Wrap ALL modified parts with double asterisks (**) to highlight them (e.g., **this text was modified**).
-    - Do NOT use any other Markdown formatting symbols.
-    - Keep the original text that was not modified unchanged and without highlighting.
-
-    **Input Text:**
-    {text_with_instructions}
-    **Output:**
-    Output ONLY the refined text with modified parts highlighted using ** (no explanations).
-    """
-
-# 修改翻译prompt，明确指示将中文翻译为英文，确保输出纯英文且无Markdown符号
-def build_translate_prompt(hybrid_text, style="US"):
-    """构建用于将中英混合文本翻译为纯英文的提示词，支持美式和英式拼写，遵循专业写作规范"""
-    # 根据指定风格设置拼写规则
-    spelling_rule = "American Spelling (Color, Honor, Analyze)" if style == "US" else "British Spelling (Colour, Honour, Analyse)"
-
-    return f"""
-    You are an expert Admissions Essay Translator.
-    Task: Translate the hybrid Chinese-English paragraph into professional English.
-    Spelling Convention: {spelling_rule}.
-    Input (Hybrid Draft):
-    {hybrid_text}
-    CRITICAL RULES (MUST FOLLOW)
-    1. **TRANSLATION EXECUTION**:
-       - **MUST translate ALL Chinese text** into professional English following the rules below.
-       - Any text inside brackets like `(...)` or `【...】` must be translated to English.
-       - Merge translations smoothly with the existing English text.
-       - **DO NOT use any Markdown formatting symbols** (no asterisks, bold, etc.)
-       - Output clean text without any formatting marks.
-       - Output ONLY the final English paragraph.
-    2. **BANNED VOCABULARY (DO NOT USE)**:
-       - master / mastery
-       - my goal is to
-       - permit
-       - deep comprehension
-       - look forward to
-       - address
-       - command
-       - drawn to / draw
-       - privilege
-       - testament
-       - commitment
-       - tenure
-       - thereby / thereby doing
-       - cultivate
-       - Building on this / Building on this foundation
-       - intend to
-       - demonstrate (use sparingly, avoid frequent appearance)
-    3. **PROHIBITED STRUCTURES (ABSOLUTELY FORBIDDEN)**:
-       - **Adverbs**: Do not use adverbs (including adverbs as logical connectors).
-       - **-ing forms as nouns**: Avoid using -ing forms as nouns (gerunds as subjects/objects).
-       - **Adverb + verb/adjective structures**: Avoid combinations like "significantly improve" or "deeply understand".
-       - **Main clause + , + -ing participial phrases**: Avoid structures like "I completed the project, demonstrating my skills".
-    4. **SENTENCE STRUCTURE REQUIREMENTS**:
-       - **Use subordinate clauses** to enhance logical connections. For example: "...which in turn leads to..." instead of "...this [verb]..."
-       - **Use semicolons (;)** to connect complete but conceptually related sentences, not periods.
-       - Ensure logical coherence and smooth flow.
-    5. **PUNCTUATION STANDARDS**:
-       - **Quotation marks**: Do NOT place commas or periods inside quotation marks. Place punctuation OUTSIDE quotation marks.
-       - Example: Use "example", not "example,".
-    6. **PROFESSIONAL WRITING STANDARDS**:
-       - Use precise, professional terminology.
-       - Avoid colloquial expressions.
-       - Maintain formal academic tone appropriate for personal statements.
-    7. **ORIGINAL ENGLISH PRESERVATION**:
-       - Keep original English parts unchanged.
-       - Apply all rules above only to newly translated parts (from Chinese to English).
-    """
+# 带缓存的流式模型调用
+def generate_text_streaming(prompt, task, placeholder, stream_key, style="", use_cache=True):
+    """流式生成文本并按批量刷新策略写入placeholder，完成后写入缓存并返回全文
 
-# 修改英文精修提示词，确保输出纯英文，遵循专业写作规范，修改部分用**高亮
-def build_english_refine_prompt(text_with_instructions):
-    """构建用于英文精修阶段的提示词，确保输出纯英文，遵循专业写作规范，修改部分高亮显示"""
-    return f"""
-    You are an expert academic editor specializing in personal statements for graduate school applications.
-
-    **Your Task:**
-    1. Read the English text carefully.
-    2. Identify the instructions inside `【】` or `[]` (e.g., "[make this more professional]", "【improve this sentence】").
-    3. **Execute** these instructions to improve the text.
-    4. **Remove** the instruction markers and the instruction text itself from the final output.
-    5. Keep the rest of the text that was not targeted by instructions unchanged.
-    6. Ensure the final output is smooth, coherent, and maintains a professional academic tone.
-
-    **CRITICAL RULES (MUST FOLLOW):**
-    1. **OUTPUT FORMAT**:
-       - Output MUST be in ENGLISH only.
-       - **HIGHLIGHTING**: Wrap ALL modified parts with double asterisks (**) to highlight them (e.g., **this text was modified**).
-       - Do NOT use any other Markdown formatting symbols (no single asterisks, underscores, etc.).
-       - Keep the original text that was not modified unchanged and without highlighting.
-
-    2. **BANNED VOCABULARY (DO NOT USE)**:
-       - master / mastery
-       - my goal is to
-       - permit
-       - deep comprehension
-       - look forward to
-       - address
-       - command
-       - drawn to / draw
-       - privilege
-       - testament
-       - commitment
-       - tenure
-       - thereby / thereby doing
-       - cultivate
-       - Building on this / Building on this foundation
-       - intend to
-       - demonstrate (use sparingly, avoid frequent appearance)
-
-    3. **PROHIBITED STRUCTURES (ABSOLUTELY FORBIDDEN)**:
-       - **Adverbs**: Do not use adverbs (including adverbs as logical connectors).
-       - **-ing forms as nouns**: Avoid using -ing forms as nouns (gerunds as subjects/objects).
-       - **Adverb + verb/adjective structures**: Avoid combinations like "significantly improve" or "deeply understand".
-       - **Main clause + , + -ing participial phrases**: Avoid structures like "I completed the project, demonstrating my skills".
-
-    4. **SENTENCE STRUCTURE REQUIREMENTS**:
-       - **Use subordinate clauses** to enhance logical connections. For example: "...which in turn leads to..." instead of "...this [verb]..."
-       - **Use semicolons (;)** to connect complete but conceptually related sentences, not periods.
-       - Ensure logical coherence and smooth flow.
-
-    5. **PUNCTUATION STANDARDS**:
-       - **Quotation marks**: Do NOT place commas or periods inside quotation marks. Place punctuation OUTSIDE quotation marks.
-       - Example: Use "example", not "example,".
-
-    6. **PROFESSIONAL WRITING STANDARDS**:
-       - Use precise, professional terminology.
-       - Avoid colloquial expressions.
-       - Maintain formal academic tone appropriate for personal statements.
-       - Maintain the original meaning and intent of the text.
-
-    **Input Text:**
-    {text_with_instructions}
-
-    **Output:**
-    Output ONLY the refined English text with modified parts highlighted using ** (no explanations).
+    生成过程中显示停止按钮；用户中止时脚本被中断，已输出的部分保存到
+    st.session_state['stream_partials'][stream_key]。
     """
-
+    cache_key = ResponseCache.make_key(model_name, prompt, style=style)
+    if use_cache:
+        cached_text = response_cache.get(cache_key)
+        if cached_text is not None:
+            metrics.record_cache_hit(task)
+            return cached_text
+
+    # 静态前缀已注册为上下文缓存时只发送后缀
+    model, contents = context_cache.resolve(task, prompt)
+
+    def start_stream(partial_text):
+        """发起流式请求；中途失败重试时附带已输出内容要求模型续写"""
+        if partial_text:
+            return call.watch(model.generate_content(contents + [build_continuation_prompt(partial_text)], stream=True))
+        return call.watch(model.generate_content(contents, stream=True))
+
+    st.session_state['stream_partials'].pop(stream_key, None)
+    stop_slot = st.empty()
+    stop_slot.button("⏹ 停止生成", key=f"stop_{stream_key}", on_click=cancel_stream, args=(stream_key,))
+
+    full_text = ""
+    # 单段输出不拆分段落，只按实测渲染耗时放宽刷新间隔
+    renderer = AdaptiveStreamRenderer(placeholder.container().empty, buffer_size=BUFFER_SIZE,
+                                      min_interval=UPDATE_INTERVAL, split_sections=False)
+    completed = False
+    with metrics.model_call(task, prompt) as call:
+        stream = call_governor.stream(start_stream, api_key, on_retry=call.on_retry)
+        try:
+            for chunk_text in stream:
+                full_text += chunk_text
+                renderer.feed(chunk_text)
+            completed = True
+        finally:
+            # 关闭响应流，释放治理层的并发名额；未完成时保留已输出的部分
+            stream.close()
+            call.finish(full_text)
+            metrics.record_stage("render", renderer.render_seconds, task=task)
+            if not completed:
+                if full_text:
+                    st.session_state['stream_partials'][stream_key] = full_text
+                    logger.info("流式生成未完成 %s，保留部分输出 %s 字符", stream_key, len(full_text))
+
+    stop_slot.empty()
+    placeholder.empty()
+    response_cache.set(cache_key, full_text)
+    return full_text
+
+# 后台运行的全文分析
+def run_analysis_job(job, prompt_text, image_parts, cache_key):
+    """在后台线程中流式生成分析结果，清理后的输出逐块追加到任务中（不能调用st.*）"""
+    # 静态规则前缀已注册为上下文缓存时只发送后缀，图片放在后缀之后
+    model, content_parts = context_cache.resolve("analysis", prompt_text)
+    content_parts = content_parts + image_parts
+
+    def start_analysis_stream(partial_text):
+        """发起流式请求；中途失败重试时附带已输出内容要求模型续写"""
+        # 限速等待或重试退避期间任务可能已被取消，取消后不再发起请求
+        job.check_cancelled()
+        if partial_text:
+            return call.watch(model.generate_content(content_parts + [build_continuation_prompt(partial_text)], stream=True))
+        return call.watch(model.generate_content(content_parts, stream=True))
+
+    # 流式清理器：逐块去除星号，开头的问候语在确定后再输出
+    output_cleaner = MODEL_OUTPUT_PIPELINE.stream()
+    # 记录首块延迟、总延迟、token数和重试次数
+    with metrics.model_call("analysis", prompt_text) as call:
+        stream = call_governor.stream(start_analysis_stream, api_key, on_retry=call.on_retry)
+        try:
+            for chunk_text in stream:
+                job.append(output_cleaner.feed(chunk_text))
+            job.append(output_cleaner.flush())
+        except JobCancelled:
+            call.status = "cancelled"
+            raise
+        finally:
+            # 关闭响应流，释放治理层的并发名额
+            stream.close()
+            call.finish(job.text)
+
+    # 写入缓存的是流式清理后的结果，命中缓存时原样使用，不再重复清理
+    response_cache.set(cache_key, job.text)
+
+# 增量解析后台任务的输出
+def sync_analysis_sections(job, final=False):
+    """把任务新追加的输出交给增量解析器，已完成的段落立即追加到会话存储；
+    final=True 时解析最后一个段落。返回本次新追加的段落数"""
+    progress = st.session_state['analysis_progress']
+    if progress is None or progress['job_id'] != job.job_id:
+        progress = {'job_id': job.job_id, 'offset': 0, 'parser': SectionStreamParser()}
+        st.session_state['analysis_progress'] = progress
+    parser = progress['parser']
+    text = job.text
+    with metrics.stage("parse"):
+        parser.feed(text[progress['offset']:])
+        progress['offset'] = len(text)
+        if final:
+            parser.close()
+    # 开始生成时已清空段落，存储中的段落都来自本任务（页面刷新后由SQLite恢复），只追加尚未写入的部分
+    loaded = len(st.session_state['sections_data'])
+    new_sections = parser.sections[loaded:]
+    if new_sections:
+        session_store.extend_sections(new_sections)
+    return len(new_sections)
+
+# 保存全文分析结果
+def apply_analysis_result(full_response, job=None):
+    """解析全文分析结果并写入会话存储；来自后台任务时只补充增量解析尚未写入的段落"""
+    if job is not None:
+        sync_analysis_sections(job, final=True)
+        st.session_state['analysis_progress'] = None
+    else:
+        with metrics.stage("parse"):
+            sections = parse_sections(full_response)
+        session_store.load_sections(sections)
+    session_store.set_full_response(full_response)
+    st.session_state['generation_complete'] = True
+
+# 全文分析进度
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_analysis_job_progress(job_id):
+    """定时轮询后台任务，已完成的段落写入会话存储后刷新整页以便编辑，正在生成的内容在片段内显示；
+    任务结束后刷新整页处理结果"""
+    job = job_queue.get(job_id)
+    if job is None or not job.active:
+        st.rerun()
+    if sync_analysis_sections(job):
+        st.rerun()
+    text = job.text
+    col_status, col_stop = st.columns([4, 1])
+    with col_status:
+        if job.status == JOB_QUEUED:
+            st.info("全文分析排队中...")
+        else:
+            st.info(f"正在使用 {model_name} 进行全篇结构分析：已生成 {len(text)} 字符，"
+                    f"已完成 {len(st.session_state['sections_data'])} 个段落，用时 {job.elapsed():.0f}s")
+    with col_stop:
+        st.button("⏹ 停止生成", key="stop_analysis_job", on_click=job_queue.cancel, args=(job_id,))
+    if text:
+        # 已完成的段落各占一个元素且内容不变，每次轮询只有正在生成的段落变化
+        renderer = AdaptiveStreamRenderer(st.container().empty, buffer_size=BUFFER_SIZE, min_interval=UPDATE_INTERVAL)
+        renderer.feed(text)
+        renderer.flush()
+        metrics.record_stage("render", renderer.render_seconds, task="analysis")
+
+# 显示被中止的流式输出，可选择采用或丢弃
+def render_stream_partial(stream_key, on_accept):
+    """如果该任务有中止时保留的部分输出，显示它并提供采用/丢弃按钮"""
+    partial_text = st.session_state['stream_partials'].get(stream_key)
+    if partial_text is None:
+        return
+    if not partial_text:
+        st.caption("生成已中止")
+        st.session_state['stream_partials'].pop(stream_key, None)
+        return
+    with st.expander(f"生成已中止，保留了 {len(partial_text)} 个字符的部分输出", expanded=False):
+        st.markdown(partial_text)
+        col_accept, col_discard = st.columns(2)
+        if col_accept.button("采用部分结果", key=f"accept_partial_{stream_key}"):
+            on_accept(partial_text)
+            st.session_state['stream_partials'].pop(stream_key, None)
+            st.rerun(scope="fragment")
+        if col_discard.button("丢弃", key=f"discard_partial_{stream_key}"):
+            st.session_state['stream_partials'].pop(stream_key, None)
+            st.rerun(scope="fragment")
+
+# Word文档缓存的最大条目数
+DOCX_CACHE_MAX_ENTRIES = 8
+
+# 带缓存的Word文档构建
+@st.cache_data(max_entries=DOCX_CACHE_MAX_ENTRIES, show_spinner=False)
+def build_docx_bytes(text_hash, major_name, keep_highlight, _text_content):
+    """按 (文本哈希, 页眉, 是否保留高亮) 缓存Word文档字节，文本本身不参与哈希"""
+    export_text = _text_content if keep_highlight else remove_markdown_bold(_text_content)
+    with metrics.stage("docx_build"):
+        buffer = create_docx_smart(export_text, major_name)
+    return buffer.getvalue() if buffer else None
+
+# 并发翻译所有段落
+def translate_all_paragraphs(paragraph_texts, style="US", max_workers=TRANSLATE_MAX_WORKERS, on_done=None, use_cache=True):
+    """通过有界线程池同时翻译所有段落，每完成一段即回调on_done(idx, text, error)"""
+    def translate_one(text):
+        translated = generate_text_cached(build_translate_prompt(text, style), f"translate_{style.lower()}",
+                                          style=style, use_cache=use_cache)
+        return fix_lint_errors(translated, use_cache=use_cache)
+
+    results = {}
+    jobs = {idx: text for idx, text in paragraph_texts.items() if text and text.strip()}
+    if not jobs:
+        return results
+
+    # 工作线程只负责模型调用，所有session state和UI更新都在主线程完成
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as executor:
+        futures = {executor.submit(translate_one, text): idx for idx, text in jobs.items()}
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                text = future.result()
+                results[idx] = text
+                error = None
+            except Exception as e:
+                text = None
+                error = e
+            if on_done:
+                on_done(idx, text, error)
+    return results
+
+# 文件上传回调：解析文件并记录耗时
+def handle_upload(uploader_key, content_key):
+    """解析上传的文件写入对应文本框，并保存解析耗时摘要"""
+    uploaded_file = st.session_state.get(uploader_key)
+    if not uploaded_file:
+        st.session_state['ingest_reports'].pop(uploader_key, None)
+        return
+    try:
+        result = ingest_file(uploaded_file)
+    except Exception as e:
+        st.session_state[content_key] = f"[读取文件出错: {e}]"
+        st.session_state['ingest_reports'].pop(uploader_key, None)
+        return
+    st.session_state[content_key] = result.text
+    st.session_state['ingest_reports'][uploader_key] = result.summary()
+    metrics.record_stage("ingest", result.timings["total_ms"] / 1000, cached=result.cached)
+    logger.info("文件解析完成: %s", result.summary())
 
 # ==========================================
 # 主界面布局
@@ -1119,7 +1122,9 @@ st.markdown("<h1>个人陈述修改</h1>", unsafe_allow_html=True)
 with st.expander("**1. 原始文书**", expanded=True):
     # 上传文件区域 - 放在上面
     st.file_uploader("上传文件", type=['docx', 'pdf', 'txt'], key="uploader_ps", 
-                     on_change=lambda: st.session_state.update({'ps_content': extract_text_from_file(st.session_state.uploader_ps)}))
+                     on_change=handle_upload, args=("uploader_ps", "ps_content"))
+    if st.session_state['ingest_reports'].get("uploader_ps"):
+        st.caption(st.session_state['ingest_reports']["uploader_ps"])
     
     # 文本输入区 - 放在下面
     st.text_area(label="", 
@@ -1140,7 +1145,9 @@ with st.expander("**2. 新项目信息**", expanded=True):
     st.markdown("---")
     # 课程大纲上传
     st.file_uploader("上传课程大纲", type=['docx', 'pdf', 'txt'], key="uploader_curr",
-                     on_change=lambda: st.session_state.update({'curr_content': extract_text_from_file(st.session_state.uploader_curr)}))
+                     on_change=handle_upload, args=("uploader_curr", "curr_content"))
+    if st.session_state['ingest_reports'].get("uploader_curr"):
+        st.caption(st.session_state['ingest_reports']["uploader_curr"])
 
     # 图片上传区，支持多个图片
     uploaded_images = st.file_uploader("上传图片", type=['png', 'jpg', 'jpeg', 'webp'], accept_multiple_files=True)
@@ -1172,126 +1179,120 @@ if generate_btn:
         st.error("请检查 API Key、旧 PS 内容和目标学校是否完整")
     else:
         # 重置所有状态变量，准备新的生成
-        st.session_state['full_response'] = ""
-        st.session_state['sections_data'] = [] 
-        st.session_state['translation_results'] = {}
-        st.session_state['edited_translations'] = {}
-        st.session_state['refine_results'] = {}
-        st.session_state['preview_results'] = {}
+        session_store.reset()  # 清空段落记录（段落数据、修改、翻译、批注和确认内容）
         st.session_state['generation_complete'] = False
         st.session_state['show_sections'] = False
         st.session_state['annotation_processing'] = {}
-        st.session_state['annotation_results'] = {}
-        st.session_state['original_texts'] = {}
         st.session_state['final_preview_text'] = ""  # 重置最终预览文本
         st.session_state['final_preview_text_cleaned'] = ""  # 重置清理后的预览文本
         st.session_state['confirmed_paragraphs'] = set()  # 重置已确认段落
-        st.session_state['confirmed_contents'] = {}  # 重置已确认内容
-        
-        # 创建一个空白占位符用于显示生成进度
-        output_placeholder = st.empty()
+        st.session_state['paragraph_store'] = ParagraphStore()  # 重置段落存储
+        st.session_state['stream_partials'] = {}  # 重置中止的部分输出
+        # 同一会话重新生成时取消上一次还在运行的分析任务
+        job_queue.cancel(st.session_state['analysis_job_id'])
+        st.session_state['analysis_job_id'] = None
+        st.session_state['analysis_progress'] = None
         
-        with st.spinner(f"正在连接 {model_name} 进行全篇结构分析..."):
+        with st.spinner("正在准备全篇结构分析..."):
             try:
                 # 检查是否上传了图片
                 has_imgs = True if uploaded_images else False
+                # 课程信息超出token预算时按相关度裁剪，并提示舍弃了哪些内容
+                with metrics.stage("prompt_budget"):
+                    budget_result = fit_analysis_inputs(target_school, target_major, final_old_ps, final_new_curr,
+                                                        has_imgs, final_strategy, budget=PROMPT_TOKEN_BUDGET)
+                if budget_result.trimmed:
+                    st.caption(f"✂️ {budget_result.summary()}")
+                    with st.expander(f"查看被舍弃的课程段落 ({len(budget_result.dropped)})"):
+                        for passage in budget_result.dropped:
+                            st.markdown(f"- 第 {passage.index + 1} 段 · {passage.tokens} tokens · "
+                                        f"相关度 {passage.score:.2f}：{preview_passage(passage.text)}")
+                    logger.info("提示词预算: %s", budget_result.summary())
+                if budget_result.over_budget:
+                    st.warning(f"{budget_result.over_budget_message()}，生成可能较慢或被截断")
                 # 构建分析提示词
-                prompt_text = build_analysis_prompt(target_school, target_major, final_old_ps, final_new_curr, has_imgs, final_strategy)
+                prompt_text = build_analysis_prompt(target_school, target_major, final_old_ps, budget_result.course_text,
+                                                    has_imgs, final_strategy)
                 
-                # 准备内容部分，包括提示词和图片(如果有)
-                content_parts = [prompt_text]
+                # 准备图片内容部分(如果有)，发送时放在提示词之后
+                image_parts = []
+                image_bytes_list = []
                 if uploaded_images:
-                    for img_file in uploaded_images:
-                        content_parts.append(Image.open(img_file))
-                
-                # 初始化Gemini模型
-                model = genai.GenerativeModel(model_name)
-                
-                # 设置安全过滤级别
-                safety_settings = {
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                }
-
-                # 流式生成内容
-                response_stream = model.generate_content(
-                    content_parts, 
-                    stream=True,
-                    safety_settings=safety_settings 
-                )
-                
-                # 实时显示生成的内容 - 批处理优化版本
-                full_response = ""
-                BUFFER_SIZE = 200  # 字符阈值
-                UPDATE_INTERVAL = 0.05  # 50ms
-                buffer = ""
-                last_update = time.perf_counter()
-
-                for chunk in response_stream:
-                    try:
-                        if chunk.text:
-                            buffer += chunk.text  # 暂不清理
-                            current_time = time.perf_counter()
-
-                            # 达到阈值或时间间隔时更新
-                            if len(buffer) >= BUFFER_SIZE or (current_time - last_update) >= UPDATE_INTERVAL:
-                                clean_buffer = clean_asterisks(buffer)
-                                full_response += clean_buffer
-                                output_placeholder.markdown(full_response + '<span class="streaming-cursor"></span>', unsafe_allow_html=True)
-                                buffer = ""
-                                last_update = current_time
-                    except Exception:
-                        pass
-
-                # 最后处理剩余缓冲
-                if buffer:
-                    clean_buffer = clean_asterisks(buffer)
-                    full_response += clean_buffer
-                    output_placeholder.markdown(full_response + '<span class="streaming-cursor"></span>', unsafe_allow_html=True)
-                
-                # 清理和过滤最终响应
-                full_response = clean_asterisks(full_response)
-                full_response = filter_ai_greeting(full_response)
-                output_placeholder.markdown(full_response)
-                
-                # 保存完整响应
-                st.session_state['full_response'] = full_response
-                st.session_state['generation_complete'] = True
-                
-                # 解析响应数据为结构化段落
-                raw_sections = full_response.split('===SECTION===')
-                parsed_data = []
-                
-                for sec in raw_sections:
-                    if not sec.strip(): continue
-                    # 过滤不包含核心标记的段落
-                    if "[[LOGIC]]" not in sec and "[[DRAFT]]" not in sec:
-                        continue
-                        
-                    logic_part = ""
-                    draft_part = ""
-                    if "[[LOGIC]]" in sec:
-                        parts = sec.split("[[DRAFT]]")
-                        logic_part = parts[0].replace("[[LOGIC]]", "").replace("Part 1:", "").strip()
-                        if len(parts) > 1:
-                            draft_part = parts[1].replace("Part 2:", "").strip()
-                    else:
-                        draft_part = sec.strip()
-                        
-                    parsed_data.append({"logic": logic_part, "draft": draft_part})
-                
-                # 保存解析后的段落数据
-                st.session_state['sections_data'] = parsed_data
-                
+                    image_bytes_list = [img_file.getvalue() for img_file in uploaded_images]
+                    # 缩放、去元数据并去重后再发送，减小请求体积
+                    with metrics.stage("image_prep"):
+                        processed_images, image_stats = prepare_images(image_bytes_list)
+                    image_parts = [item.as_part() for item in processed_images]
+                    st.caption(f"图片预处理: {image_stats['count']} 张 (去重 {image_stats['duplicates']} 张), "
+                               f"{image_stats['original_bytes'] / 1024:.0f} KB → {image_stats['processed_bytes'] / 1024:.0f} KB, "
+                               f"节省 {image_stats['saved_bytes'] / 1024:.0f} KB")
+                    logger.info("图片预处理统计: %s", image_stats)
+
+                # 相同的提示词与图片直接复用缓存的分析结果
+                analysis_cache_key = ResponseCache.make_key(model_name, prompt_text, image_bytes_list)
+                cached_response = response_cache.get(analysis_cache_key) if st.session_state['use_response_cache'] else None
+
+                if cached_response is not None:
+                    # 命中缓存，跳过API调用；缓存内容已在生成时清理过，问候语清理不是幂等的，不能再清理一次
+                    metrics.record_cache_hit("analysis")
+                    apply_analysis_result(cached_response)
+                else:
+                    # 模型调用交给后台任务，页面重跑或断开连接不会中断生成
+                    analysis_job = job_queue.submit(
+                        st.session_state['session_id'], "analysis",
+                        lambda job: run_analysis_job(job, prompt_text, image_parts, analysis_cache_key),
+                    )
+                    st.session_state['analysis_job_id'] = analysis_job.job_id
+                    logger.info("全文分析任务已提交: %s", analysis_job.job_id)
+
+            except QueueFullError as e:
+                st.error(f"无法开始生成: {e}")
             except Exception as e:
                 st.error(f"生成失败: {e}")
 
+# 全文分析任务：运行中由片段定时轮询显示进度，结束后在整页运行中处理结果
+analysis_job = job_queue.get(st.session_state['analysis_job_id'])
+if analysis_job is not None and analysis_job.active:
+    render_analysis_job_progress(analysis_job.job_id)
+    # 已完成的段落在生成过程中即可编辑，后续段落完成后追加在末尾
+    if st.session_state['sections_data'] and not st.session_state['show_sections']:
+        if st.button("2. 开始编辑已完成的段落", key="start_editing_streaming_btn"):
+            st.session_state['show_sections'] = True
+            st.rerun()
+elif analysis_job is not None:
+    if analysis_job.status == JOB_DONE:
+        apply_analysis_result(analysis_job.text, job=analysis_job)
+        st.session_state['analysis_job_id'] = None
+    else:
+        # 失败、取消或服务重启中断：保留已生成的部分，可以选择采用
+        if analysis_job.status == JOB_CANCELLED:
+            st.warning("全文分析已停止")
+        elif analysis_job.status == JOB_INTERRUPTED:
+            st.warning("全文分析因服务重启而中断")
+        else:
+            st.error(f"生成失败: {analysis_job.error}")
+        partial_sections = analysis_job.text.count(SECTION_DELIMITER)
+        if analysis_job.text.strip():
+            with st.expander(f"已生成的部分 ({len(analysis_job.text)} 字符，约 {partial_sections} 个段落)"):
+                st.markdown(analysis_job.text)
+        col_accept_job, col_discard_job = st.columns([1, 1])
+        with col_accept_job:
+            if analysis_job.text.strip() and st.button("采用已生成的部分", key="accept_analysis_partial"):
+                apply_analysis_result(analysis_job.text, job=analysis_job)
+                st.session_state['analysis_job_id'] = None
+                st.rerun()
+        with col_discard_job:
+            if st.button("丢弃", key="discard_analysis_partial"):
+                # 同时丢弃生成过程中已写入的段落
+                session_store.reset()
+                st.session_state['analysis_job_id'] = None
+                st.session_state['analysis_progress'] = None
+                st.rerun()
+
 # 显示生成完成的全文
 if st.session_state['generation_complete'] and not st.session_state['show_sections']:
     st.markdown("### 生成完成")
-    st.markdown(st.session_state['full_response'])
+    st.markdown(session_store.full_response)
     
     # 显示"开始编辑"按钮
     if st.button("2. 开始编辑段落", key="start_editing_btn", type="primary"):
@@ -1299,312 +1300,369 @@ if st.session_state['generation_complete'] and not st.session_state['show_sectio
         st.rerun()
 
 # ==========================================
-# 全篇交互编辑区域
-# 提供段落级别的编辑、翻译和修改功能
+# 段落卡片与最终导出片段
+# 使用st.fragment拆分为独立的可重跑单元，段落内的操作不会重新执行整个脚本
 # ==========================================
-if st.session_state['show_sections'] and st.session_state['sections_data']:
-    st.divider()
-    st.subheader("全篇编辑模式")
-    st.caption("请在左侧文本框中直接编辑，或在 `【】` 或 `[]` 中输入修改指令，然后点击下方按钮执行修改。")
 
-    # 使用全局安全设置 safety_settings_interactive
+# 保存批注修改结果
+def apply_refine_result(i, refined_text):
+    """保存第i段的批注修改结果，并清除该段落已过期的翻译结果"""
+    # 更新会话状态 - 保存修改结果但不直接替换
+    st.session_state['refine_results'][f"para_{i}"] = refined_text
+    st.session_state['annotation_results'][f"para_{i}"] = refined_text
+    
+    # 清除该段落的翻译相关结果
+    if f"trans_{i}" in st.session_state['translation_results']:
+        del st.session_state['translation_results'][f"trans_{i}"]
+    if f"trans_{i}" in st.session_state['edited_translations']:
+        del st.session_state['edited_translations'][f"trans_{i}"]
+    if f"preview_trans_{i}" in st.session_state['preview_results']:
+        del st.session_state['preview_results'][f"preview_trans_{i}"]
+    
+    # 设置批注处理状态
+    st.session_state['annotation_processing'][f"para_{i}"] = True
+
+# 保存翻译结果
+def apply_translation_result(i, trans_text, style):
+    """保存第i段的翻译结果，首次翻译时同时初始化编辑版本"""
+    st.session_state['translation_results'][f"trans_{i}"] = {
+        "text": trans_text,
+        "style": style
+    }
+    # 初始化编辑版本
+    if f"trans_{i}" not in st.session_state['edited_translations']:
+        st.session_state['edited_translations'][f"trans_{i}"] = trans_text
+
+# 保存用词修正结果
+def apply_lint_fix_result(i, fixed_text):
+    """用修正后的文本替换第i段翻译的编辑版本，修正前的文本保存用于比较"""
+    st.session_state['original_texts'][f"trans_{i}"] = st.session_state['edited_translations'].get(f"trans_{i}", "")
+    st.session_state['edited_translations'][f"trans_{i}"] = fixed_text
+
+# 保存翻译批注修改结果
+def apply_english_refine_result(i, refined_text):
+    """保存第i段翻译的批注修改结果和预览HTML"""
+    # 生成预览HTML并保存
+    st.session_state['preview_results'][f"preview_trans_{i}"] = generate_preview_html(refined_text)
+    # 保存修改后的文本
+    st.session_state['edited_translations'][f"trans_{i}"] = refined_text
+
+# 单个段落的编辑卡片
+@st.fragment
+def render_paragraph_card(i):
+    """渲染第i个段落的编辑、批注修改、翻译和确认界面"""
+    section_data = st.session_state['sections_data'][i]
+
+    # 在段落标题旁显示状态
+    topic = extract_paragraph_topic(section_data['logic'])
+    if i in st.session_state['confirmed_paragraphs']:
+        st.markdown(f"### {topic} ✅")
+    else:
+        st.markdown(f"### {topic}")
+    
+    # 布局：左侧编辑区，右侧逻辑说明
+    col_draft, col_logic = st.columns([0.65, 0.35], gap="large")
+    
+    # 右侧：显示AI修改思路和批注指南
+    with col_logic:
+        st.info(f"**AI 修改思路 (Logic):**\n\n{section_data['logic']}")
+        if "**" in section_data['draft']:
+            st.success("已包含高亮修改")
+            
+        # 添加批注使用指南
+        st.markdown("""
+        **批注指南:**
+        1. 在文本框中使用【】或[]添加批注
+        2. 例如：【把这段语气改得更自信】
+        3. 点击"执行批注修改"按钮应用修改
+        """)
+        
+        # 检查当前文本是否包含批注，如有则提示用户
+        current_text = st.session_state['sections_data'][i]['draft']
+        if contains_annotation(current_text):
+            st.warning("检测到批注，请点击'执行批注修改'按钮应用修改")
+
+    # 左侧：文本编辑区域
+    with col_draft:
+        # 检查是否有之前的修改结果，如有则优先显示
+        draft_key = f"para_{i}"
+        display_text = st.session_state['refine_results'].get(draft_key, section_data['draft'])
+        
+        # 文本编辑框
+        current_draft = st.text_area(
+            label="内容编辑",
+            value=display_text,
+            height=300,
+            key=f"draft_p_{i}",
+            label_visibility="collapsed",
+            on_change=sync_confirmed_paragraph,
+            args=(i,)
+        )
+        
+        # 实时保存用户编辑的内容
+        st.session_state['sections_data'][i]['draft'] = current_draft
+        
+        # 检查文本是否包含中文，用于决定输出语言
+        has_chinese = contains_chinese(current_draft)
+        
+        # 操作按钮行
+        c_btn1, c_btn2, c_btn3, c_btn4 = st.columns([1, 1, 1, 1])
+        # 流式输出占位，位于按钮行下方
+        stream_placeholder = st.empty()
+        
+        # 批注修改按钮 - 修改为直接替换原文本并显示预览
+        with c_btn1:
+            if st.button("执行修改", key=f"btn_refine_{i}"):
+                # 检查是否包含批注标记
+                if contains_annotation(current_draft):
+                    try:
+                        # 保存原始文本用于比较
+                        st.session_state['original_texts'][f"para_{i}"] = current_draft
+                        
+                        # 流式生成修改后的内容（相同输入命中缓存）
+                        refined_text = generate_text_streaming(
+                            build_refine_prompt(current_draft, has_chinese),
+                            "refine",
+                            stream_placeholder,
+                            f"refine_{i}",
+                            use_cache=st.session_state['use_response_cache']
+                        )
+                        apply_refine_result(i, refined_text)
+                        
+                        # 显示成功消息并刷新页面
+                        st.success("批注修改已应用")
+                        st.rerun(scope="fragment")
+                    except Exception as e:
+                        st.error(f"修改失败: {e}")
+                else:
+                    st.warning("未检测到批注标记。请在文本中添加【】或[]形式的批注。")
+
+        # 美式英语翻译按钮
+        with c_btn2:
+            if st.button("🇺🇸翻译", key=f"btn_us_{i}"):
+                try:
+                    # 流式生成翻译（相同输入命中缓存）
+                    trans_text = generate_text_streaming(
+                        build_translate_prompt(current_draft, "US"),
+                        "translate_us",
+                        stream_placeholder,
+                        f"translate_us_{i}",
+                        style="US",
+                        use_cache=st.session_state['use_response_cache']
+                    )
+                    apply_translation_result(i, trans_text, "US")
+                    st.rerun(scope="fragment")
+                except Exception as e:
+                    st.error(str(e))
+        
+        # 英式英语翻译按钮
+        with c_btn3:
+            if st.button("🇬🇧翻译", key=f"btn_uk_{i}"):
+                try:
+                    # 流式生成翻译（相同输入命中缓存）
+                    trans_text = generate_text_streaming(
+                        build_translate_prompt(current_draft, "UK"),
+                        "translate_uk",
+                        stream_placeholder,
+                        f"translate_uk_{i}",
+                        style="UK",
+                        use_cache=st.session_state['use_response_cache']
+                    )
+                    apply_translation_result(i, trans_text, "UK")
+                    st.rerun(scope="fragment")
+                except Exception as e:
+                    st.error(str(e))
+        
+        # 添加确认内容按钮
+        with c_btn4:
+            # 如果段落尚未确认，显示确认按钮
+            if i not in st.session_state['confirmed_paragraphs']:
+                if st.button("✅ 确认内容", key=f"confirm_p_{i}"):
+                    logger.info("=== 点击确认段落 %s ===", i)
+                    logger.info("current_draft长度: %s", len(current_draft) if current_draft else 0)
+
+                    # 调试输出
+                    if DEBUG_MODE:
+                        st.write(f"调试: 点击确认段落 {i}")
+                        st.write(f"调试: confirmed_paragraphs = {st.session_state['confirmed_paragraphs']}")
+
+                    # 标记段落为已确认
+                    st.session_state['confirmed_paragraphs'].add(i)
+                    logger.info("段落 %s 添加到 confirmed_paragraphs", i)
+
+                    # 保存当前段落内容到confirmed_contents
+                    # 优先从文本框session state获取最新内容
+                    textarea_key = f"draft_p_{i}"
+                    latest_content = st.session_state.get(textarea_key, current_draft)
+                    # 如果latest_content为空或只有空白字符，使用段落原始内容
+                    if not latest_content or not latest_content.strip():
+                        latest_content = st.session_state['sections_data'][i]['draft']
+                        logger.info("段落 %s latest_content为空，使用原始段落内容，长度: %s", i, len(latest_content) if latest_content else 0)
+                    st.session_state['confirmed_contents'][i] = latest_content
+                    logger.info("段落 %s 保存到 confirmed_contents, 长度: %s", i, len(latest_content) if latest_content else 0)
+                    logger.debug("段落 %s 内容前100字符: %s", i, preview(latest_content, 100))
+
+                    if DEBUG_MODE:
+                        st.write(f"调试: confirmed_contents[{i}] = {st.session_state['confirmed_contents'].get(i, 'NOT FOUND')}")
+
+                    # 只把该段落插入段落存储，不重新解析其他段落
+                    st.session_state['paragraph_store'].set(i, latest_content)
+                    rebuilt_text = st.session_state['paragraph_store'].text
+                    logger.info("段落存储更新后全文长度: %s", len(rebuilt_text))
+
+                    if rebuilt_text and rebuilt_text.strip():
+                        # 写入预览并清空清理版本，导出片段按新版本号刷新
+                        publish_final_preview(rebuilt_text)
+                        logger.info("final_preview_text 设置为重建结果，长度: %s", len(rebuilt_text))
 
-    # 遍历所有段落，为每个段落创建编辑界面
-    for i, section_data in enumerate(st.session_state['sections_data']):
-        # 在段落标题旁显示状态
-        topic = extract_paragraph_topic(section_data['logic'])
-        if i in st.session_state['confirmed_paragraphs']:
-            st.markdown(f"### {topic} ✅")
-        else:
-            st.markdown(f"### {topic}")
+                        if DEBUG_MODE:
+                            st.write(f"调试: rebuild结果长度 = {len(rebuilt_text)}")
+
+                        logger.info("=== 段落 %s 确认完成 ===", i)
+                        st.success("内容已添加到最终预览")
+                    else:
+                        logger.error("重建的文本为空！段落 %s 确认失败", i)
+                        st.error(f"无法重建最终预览文本。请检查段落 {i+1} 是否有内容。")
+
+                    # 标题在本片段内，最终预览由导出片段按版本号刷新，只需重跑本片段
+                    st.rerun(scope="fragment")
+            else:
+                # 如果段落已确认，显示已确认状态
+                st.success("✓ 已确认")
         
-        # 布局：左侧编辑区，右侧逻辑说明
-        col_draft, col_logic = st.columns([0.65, 0.35], gap="large")
+        # 被中止的修改或翻译保留的部分输出，可以选择采用
+        render_stream_partial(f"refine_{i}", lambda text: apply_refine_result(i, text))
+        render_stream_partial(f"translate_us_{i}", lambda text: apply_translation_result(i, text, "US"))
+        render_stream_partial(f"translate_uk_{i}", lambda text: apply_translation_result(i, text, "UK"))
         
-        # 右侧：显示AI修改思路和批注指南
-        with col_logic:
-            st.info(f"**AI 修改思路 (Logic):**\n\n{section_data['logic']}")
-            if "**" in section_data['draft']:
-                st.success("已包含高亮修改")
-                
-            # 添加批注使用指南
-            st.markdown("""
-            **批注指南:**
-            1. 在文本框中使用【】或[]添加批注
-            2. 例如：【把这段语气改得更自信】
-            3. 点击"执行批注修改"按钮应用修改
-            """)
+        # 显示批注修改结果（如果有）
+        if f"para_{i}" in st.session_state['annotation_results']:
+            # 获取原始文本和修改后的文本
+            original_text = st.session_state['original_texts'].get(f"para_{i}", "")
+            refined_text = st.session_state['annotation_results'][f"para_{i}"]
             
-            # 检查当前文本是否包含批注，如有则提示用户
-            current_text = st.session_state['sections_data'][i]['draft']
-            if contains_annotation(current_text):
-                st.warning("检测到批注，请点击'执行批注修改'按钮应用修改")
-
-        # 左侧：文本编辑区域
-        with col_draft:
-            # 检查是否有之前的修改结果，如有则优先显示
-            draft_key = f"para_{i}"
-            display_text = st.session_state['refine_results'].get(draft_key, section_data['draft'])
+            # 高亮显示差异部分
+            with metrics.stage("diff"):
+                highlighted_html = highlight_differences(original_text, refined_text)
+            
+            # 显示修改结果预览
+            st.markdown("**批注修改结果预览:**")
+            st.markdown(f"""
+            <div class="annotation-result-container">
+                {highlighted_html}
+            </div>
+            """, unsafe_allow_html=True)
+            
+            # 修改提示文字
+            st.caption("修改后的文本已自动更新到上方文本框。黄色高亮部分为修改内容。如不满意，可直接在上方文本框中继续编辑或在【】内添加新批注。")
+        
+        # 显示翻译结果（如果有）
+        trans_key = f"trans_{i}"
+        if trans_key in st.session_state['translation_results']:
+            trans_data = st.session_state['translation_results'][trans_key]
+            st.markdown(f"**{trans_data['style']}式翻译结果:** (可在下方编辑并添加【】批注)")
             
-            # 文本编辑框
-            current_draft = st.text_area(
-                label="内容编辑",
-                value=display_text,
+            # 翻译结果编辑区
+            edited_trans = st.text_area(
+                "编辑翻译结果",
+                value=st.session_state['edited_translations'].get(trans_key, trans_data["text"]),
                 height=300,
-                key=f"draft_p_{i}",
-                label_visibility="collapsed"
+                key=f"edit_trans_{i}"
             )
             
-            # 实时保存用户编辑的内容
-            st.session_state['sections_data'][i]['draft'] = current_draft
-            
-            # 检查文本是否包含中文，用于决定输出语言
-            has_chinese = contains_chinese(current_draft)
+            # 保存编辑后的翻译结果
+            st.session_state['edited_translations'][trans_key] = edited_trans
+
+            # 本地检查禁用词和禁用句式，标出命中的位置
+            with metrics.stage("lint"):
+                lint_result = lint_text(edited_trans)
+            if lint_result.issues:
+                lint_caption = f"用词检查: {lint_result.summary()}（红色为禁用词和禁用句式，黄色为副词等提醒）"
+                if lint_result.failed:
+                    st.warning(lint_caption)
+                else:
+                    st.caption(lint_caption)
+                st.markdown(f'<div class="preview-container"><div class="preview-text">{highlight_lint_html(lint_result)}</div></div>',
+                            unsafe_allow_html=True)
+            else:
+                st.caption("用词检查: 未发现禁用词和禁用句式")
             
-            # 操作按钮行
-            c_btn1, c_btn2, c_btn3, c_btn4 = st.columns([1, 1, 1, 1])
+            # 翻译操作按钮
+            col1, col_lint_fix = st.columns([1, 1])
+            # 翻译批注修改的流式输出占位
+            trans_stream_placeholder = st.empty()
+
+            # 只对检查未通过的段落重新调用模型，修正命中的位置而不是重新翻译
+            with col_lint_fix:
+                if lint_result.failed and st.button("修正禁用词/句式", key=f"lint_fix_trans_{i}"):
+                    try:
+                        fixed_text = generate_text_streaming(
+                            build_lint_fix_prompt(edited_trans, lint_result.errors),
+                            "lint_fix",
+                            trans_stream_placeholder,
+                            f"lint_fix_{i}",
+                            use_cache=st.session_state['use_response_cache']
+                        )
+                        apply_lint_fix_result(i, fixed_text)
+                        st.rerun(scope="fragment")
+                    except Exception as e:
+                        st.error(f"修正失败: {e}")
             
-            # 批注修改按钮 - 修改为直接替换原文本并显示预览
-            with c_btn1:
-                if st.button("执行修改", key=f"btn_refine_{i}"):
+            # 执行翻译批注修改按钮 - 修改为使用英文精修提示词
+            with col1:
+                if st.button("执行翻译批注修改", key=f"refine_trans_{i}"):
                     # 检查是否包含批注标记
-                    if contains_annotation(current_draft):
-                        with st.spinner("正在根据您的批注优化..."):
-                            try:
-                                # 保存原始文本用于比较
-                                st.session_state['original_texts'][f"para_{i}"] = current_draft
-                                
-                                # 初始化模型并生成修改后的内容
-                                refine_model = genai.GenerativeModel(model_name)
-                                res = refine_model.generate_content(
-                                    build_refine_prompt(current_draft, has_chinese),
-                                    safety_settings=safety_settings_interactive
-                                )
-                                
-                                # 获取优化后的文本
-                                refined_text = res.text
-                                
-                                # 更新会话状态 - 保存修改结果但不直接替换
-                                st.session_state['refine_results'][f"para_{i}"] = refined_text
-                                st.session_state['annotation_results'][f"para_{i}"] = refined_text
-                                
-                                # 清除该段落的翻译相关结果
-                                if f"trans_{i}" in st.session_state['translation_results']:
-                                    del st.session_state['translation_results'][f"trans_{i}"]
-                                if f"trans_{i}" in st.session_state['edited_translations']:
-                                    del st.session_state['edited_translations'][f"trans_{i}"]
-                                if f"preview_trans_{i}" in st.session_state['preview_results']:
-                                    del st.session_state['preview_results'][f"preview_trans_{i}"]
-                                
-                                # 设置批注处理状态
-                                st.session_state['annotation_processing'][f"para_{i}"] = True
-                                
-                                # 显示成功消息并刷新页面
-                                st.success("批注修改已应用")
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"修改失败: {e}")
-                    else:
-                        st.warning("未检测到批注标记。请在文本中添加【】或[]形式的批注。")
-
-            # 美式英语翻译按钮
-            with c_btn2:
-                if st.button("🇺🇸翻译", key=f"btn_us_{i}"):
-                    with st.spinner("Translating to US English..."):
-                        try:
-                            # 初始化模型并生成翻译
-                            trans_model = genai.GenerativeModel(model_name)
-                            res = trans_model.generate_content(
-                                build_translate_prompt(current_draft, "US"),
-                                safety_settings=safety_settings_interactive
-                            )
-                            # 保存翻译结果
-                            st.session_state['translation_results'][f"trans_{i}"] = {
-                                "text": res.text,
-                                "style": "US"
-                            }
-                            # 初始化编辑版本
-                            if f"trans_{i}" not in st.session_state['edited_translations']:
-                                st.session_state['edited_translations'][f"trans_{i}"] = res.text
-                            st.rerun()
-                        except Exception as e:
-                            st.error(str(e))
-            
-            # 英式英语翻译按钮
-            with c_btn3:
-                if st.button("🇬🇧翻译", key=f"btn_uk_{i}"):
-                    with st.spinner("Translating to UK English..."):
+                    if contains_annotation(edited_trans):
                         try:
-                            # 初始化模型并生成翻译
-                            trans_model = genai.GenerativeModel(model_name)
-                            res = trans_model.generate_content(
-                                build_translate_prompt(current_draft, "UK"),
-                                safety_settings=safety_settings_interactive
+                            # 保存原始翻译文本用于比较
+                            st.session_state['original_texts'][f"trans_{i}"] = edited_trans
+                            
+                            # 流式生成修改 - 使用英文精修提示词（相同输入命中缓存）
+                            refined_text = generate_text_streaming(
+                                build_english_refine_prompt(edited_trans),
+                                "english_refine",
+                                trans_stream_placeholder,
+                                f"english_refine_{i}",
+                                use_cache=st.session_state['use_response_cache']
                             )
-                            # 保存翻译结果
-                            st.session_state['translation_results'][f"trans_{i}"] = {
-                                "text": res.text,
-                                "style": "UK"
-                            }
-                            # 初始化编辑版本
-                            if f"trans_{i}" not in st.session_state['edited_translations']:
-                                st.session_state['edited_translations'][f"trans_{i}"] = res.text
-                            st.rerun()
+                            apply_english_refine_result(i, refined_text)
+                            
+                            # 显示成功消息并刷新页面
+                            st.success("翻译批注修改已应用")
+                            st.rerun(scope="fragment")
                         except Exception as e:
-                            st.error(str(e))
+                            st.error(f"修改失败: {e}")
+                    else:
+                        st.warning("未检测到批注标记。请在文本中添加【】或[]形式的批注。")
             
-            # 添加确认内容按钮
-            with c_btn4:
-                # 如果段落尚未确认，显示确认按钮
-                if i not in st.session_state['confirmed_paragraphs']:
-                    if st.button("✅ 确认内容", key=f"confirm_p_{i}"):
-                        logger.info(f"=== 点击确认段落 {i} ===")
-                        logger.info(f"current_draft长度: {len(current_draft) if current_draft else 0}")
-
-                        # 调试输出
-                        if DEBUG_MODE:
-                            st.write(f"调试: 点击确认段落 {i}")
-                            st.write(f"调试: confirmed_paragraphs = {st.session_state['confirmed_paragraphs']}")
-
-                        # 标记段落为已确认
-                        st.session_state['confirmed_paragraphs'].add(i)
-                        logger.info(f"段落 {i} 添加到 confirmed_paragraphs")
-
-                        # 保存当前段落内容到confirmed_contents
-                        # 优先从文本框session state获取最新内容
-                        textarea_key = f"draft_p_{i}"
-                        latest_content = st.session_state.get(textarea_key, current_draft)
-                        # 如果latest_content为空或只有空白字符，使用段落原始内容
-                        if not latest_content or not latest_content.strip():
-                            latest_content = st.session_state['sections_data'][i]['draft']
-                            logger.info(f"段落 {i} latest_content为空，使用原始段落内容，长度: {len(latest_content) if latest_content else 0}")
-                        st.session_state['confirmed_contents'][i] = latest_content
-                        logger.info(f"段落 {i} 保存到 confirmed_contents, 长度: {len(latest_content) if latest_content else 0}")
-                        logger.debug(f"段落 {i} 内容前100字符: {latest_content[:100] if latest_content else '空'}")
-
-                        if DEBUG_MODE:
-                            st.write(f"调试: confirmed_contents[{i}] = {st.session_state['confirmed_contents'].get(i, 'NOT FOUND')}")
-
-                        # 重建最终预览文本
-                        logger.info("开始调用 rebuild_final_preview()")
-                        rebuilt_text = rebuild_final_preview()
-                        logger.info(f"rebuild_final_preview() 返回长度: {len(rebuilt_text)}")
-
-                        if rebuilt_text and rebuilt_text.strip():
-                            st.session_state['final_preview_text'] = rebuilt_text
-                            logger.info(f"final_preview_text 设置为重建结果，长度: {len(rebuilt_text)}")
-
-                            if DEBUG_MODE:
-                                st.write(f"调试: rebuild结果长度 = {len(rebuilt_text)}")
-
-                            # 清空清理版本，因为内容已更新
-                            st.session_state['final_preview_text_cleaned'] = ''
-                            logger.info("已清空 final_preview_text_cleaned")
-
-                            logger.info(f"=== 段落 {i} 确认完成 ===")
-                            st.success("内容已添加到最终预览")
-                        else:
-                            logger.error(f"重建的文本为空！段落 {i} 确认失败")
-                            st.error(f"无法重建最终预览文本。请检查段落 {i+1} 是否有内容。")
-
-                        st.rerun()
-                else:
-                    # 如果段落已确认，显示已确认状态
-                    st.success("✓ 已确认")
+            render_stream_partial(f"english_refine_{i}", lambda text: apply_english_refine_result(i, text))
+            render_stream_partial(f"lint_fix_{i}", lambda text: apply_lint_fix_result(i, text))
             
-            # 显示批注修改结果（如果有）
-            if f"para_{i}" in st.session_state['annotation_results']:
-                # 获取原始文本和修改后的文本
-                original_text = st.session_state['original_texts'].get(f"para_{i}", "")
-                refined_text = st.session_state['annotation_results'][f"para_{i}"]
+            # 显示预览结果（如果有）
+            preview_key = f"preview_trans_{i}"
+            if preview_key in st.session_state['preview_results']:
+                st.markdown("**翻译修改预览结果:**")
+                # 显示带有高亮的HTML预览
+                preview_html = st.session_state['preview_results'][preview_key]
+                st.markdown(preview_html, unsafe_allow_html=True)
                 
-                # 高亮显示差异部分
-                highlighted_html = highlight_differences(original_text, refined_text)
-                
-                # 显示修改结果预览
-                st.markdown("**批注修改结果预览:**")
-                st.markdown(f"""
-                <div class="annotation-result-container">
-                    {highlighted_html}
-                </div>
-                """, unsafe_allow_html=True)
-                
-                # 修改提示文字
-                st.caption("修改后的文本已自动更新到上方文本框。黄色高亮部分为修改内容。如不满意，可直接在上方文本框中继续编辑或在【】内添加新批注。")
-            
-            # 显示翻译结果（如果有）
-            trans_key = f"trans_{i}"
-            if trans_key in st.session_state['translation_results']:
-                trans_data = st.session_state['translation_results'][trans_key]
-                st.markdown(f"**{trans_data['style']}式翻译结果:** (可在下方编辑并添加【】批注)")
-                
-                # 翻译结果编辑区
-                edited_trans = st.text_area(
-                    "编辑翻译结果",
-                    value=st.session_state['edited_translations'].get(trans_key, trans_data["text"]),
-                    height=300,
-                    key=f"edit_trans_{i}"
-                )
-                
-                # 保存编辑后的翻译结果
-                st.session_state['edited_translations'][trans_key] = edited_trans
-                
-                # 翻译操作按钮
-                col1 = st.columns(1)[0]
-                
-                # 执行翻译批注修改按钮 - 修改为使用英文精修提示词
-                with col1:
-                    if st.button("执行翻译批注修改", key=f"refine_trans_{i}"):
-                        # 检查是否包含批注标记
-                        if contains_annotation(edited_trans):
-                            with st.spinner("正在根据您的批注优化翻译..."):
-                                try:
-                                    # 保存原始翻译文本用于比较
-                                    st.session_state['original_texts'][f"trans_{i}"] = edited_trans
-                                    
-                                    # 初始化模型并生成修改 - 使用英文精修提示词
-                                    refine_model = genai.GenerativeModel(model_name)
-                                    res = refine_model.generate_content(
-                                        build_english_refine_prompt(edited_trans),
-                                        safety_settings=safety_settings_interactive
-                                    )
-                                    # 获取修改后的文本
-                                    refined_text = res.text
-                                    
-                                    # 生成预览HTML并保存
-                                    preview_html = generate_preview_html(refined_text)
-                                    preview_key = f"preview_trans_{i}"
-                                    st.session_state['preview_results'][preview_key] = preview_html
-                                    
-                                    # 保存修改后的文本
-                                    st.session_state['edited_translations'][trans_key] = refined_text
-                                    
-                                    # 显示成功消息并刷新页面
-                                    st.success("翻译批注修改已应用")
-                                    st.rerun()
-                                except Exception as e:
-                                    st.error(f"修改失败: {e}")
-                        else:
-                            st.warning("未检测到批注标记。请在文本中添加【】或[]形式的批注。")
-                
-                # 显示预览结果（如果有）
-                preview_key = f"preview_trans_{i}"
-                if preview_key in st.session_state['preview_results']:
-                    st.markdown("**翻译修改预览结果:**")
-                    # 显示带有高亮的HTML预览
-                    preview_html = st.session_state['preview_results'][preview_key]
-                    st.markdown(preview_html, unsafe_allow_html=True)
-                    
-                    # 添加提示文字
-                    st.caption("✏️ 修改后的文本已自动更新到上方编辑框。黄色高亮部分为修改内容。如不满意，可直接在上方编辑框中继续编辑或在【】内添加新批注。")
-        
-        # 段落分割线
-        st.divider()
+                # 添加提示文字
+                st.caption("✏️ 修改后的文本已自动更新到上方编辑框。黄色高亮部分为修改内容。如不满意，可直接在上方编辑框中继续编辑或在【】内添加新批注。")
+    
+    # 段落分割线
+    st.divider()
 
-    # ==========================================
-    # 最终导出区域
-    # 提供文档预览和导出功能
-    # ==========================================
+    # 片段单独重跑时不会执行到脚本末尾，在这里保存本段落的修改
+    persist_session()
+
+# 最终导出区域
+@st.fragment(run_every=EXPORT_POLL_SECONDS)
+def render_final_export():
+    """渲染最终预览和Word导出区域；定时重跑，段落片段修改的预览在下一次轮询时显示"""
+    # 预览版本变化时丢弃文本框保存的旧值，按新的预览文本显示
+    if st.session_state.get('final_export_version') != st.session_state['final_preview_version']:
+        st.session_state['final_export_version'] = st.session_state['final_preview_version']
+        st.session_state.pop('final_preview_text_display', None)
     st.subheader("最终导出")
     # 导出选项（单列布局）
     # 是否保留加粗高亮
@@ -1632,17 +1690,17 @@ if st.session_state['show_sections'] and st.session_state['sections_data']:
     cleaned_text = st.session_state.get('final_preview_text_cleaned', '')
     if cleaned_text and cleaned_text.strip():  # 检查清理版本是否存在且非空
         display_text = cleaned_text
-        logger.info(f"使用final_preview_text_cleaned作为显示文本")
+        logger.info("使用final_preview_text_cleaned作为显示文本")
     else:
         display_text = st.session_state['final_preview_text']
-        logger.info(f"使用final_preview_text作为显示文本")
+        logger.info("使用final_preview_text作为显示文本")
 
-    logger.info(f"=== 显示最终预览 ===")
-    logger.info(f"final_preview_text长度: {len(st.session_state['final_preview_text'])}")
-    logger.info(f"final_preview_text_cleaned长度: {len(st.session_state.get('final_preview_text_cleaned', ''))}")
-    logger.info(f"显示文本长度: {len(display_text)}")
-    logger.debug(f"final_preview_text前100字符: {st.session_state['final_preview_text'][:100] if st.session_state['final_preview_text'] else '空'}")
-    logger.debug(f"display_text前100字符: {display_text[:100] if display_text else '空'}")
+    logger.info("=== 显示最终预览 ===")
+    logger.info("final_preview_text长度: %s", len(st.session_state['final_preview_text']))
+    logger.info("final_preview_text_cleaned长度: %s", len(st.session_state.get('final_preview_text_cleaned', '')))
+    logger.info("显示文本长度: %s", len(display_text))
+    logger.debug("final_preview_text前100字符: %s", preview(st.session_state['final_preview_text'], 100))
+    logger.debug("display_text前100字符: %s", preview(display_text, 100))
 
     # 如果文本为空，显示提示信息
     if not display_text.strip() and not st.session_state['final_preview_text'].strip():
@@ -1672,28 +1730,28 @@ if st.session_state['show_sections'] and st.session_state['sections_data']:
     def update_final_preview():
         """更新最终预览文本的回调函数"""
         new_value = st.session_state.get('final_preview_text_display', '')
-        logger.info(f"=== 文本区域on_change回调被调用 ===")
-        logger.info(f"new_value长度: {len(new_value)}")
-        logger.info(f"new_value类型: {type(new_value)}")
+        logger.info("=== 文本区域on_change回调被调用 ===")
+        logger.info("new_value长度: %s", len(new_value))
+        logger.info("new_value类型: %s", type(new_value))
         if new_value:
-            logger.debug(f"new_value前100字符: {new_value[:100]}")
+            logger.debug("new_value前100字符: %s", preview(new_value, 100))
 
         # 获取当前的清理版本
         current_cleaned = st.session_state.get('final_preview_text_cleaned', '')
-        logger.info(f"当前final_preview_text_cleaned长度: {len(current_cleaned)}")
+        logger.info("当前final_preview_text_cleaned长度: %s", len(current_cleaned))
 
         # 检查新值是否与清理版本相同（可能是AI处理后的自动更新）
         is_same_as_cleaned = new_value == current_cleaned
-        logger.info(f"新值与清理版本相同: {is_same_as_cleaned}")
+        logger.info("新值与清理版本相同: %s", is_same_as_cleaned)
 
         original_length = len(st.session_state.get('final_preview_text', ''))
-        logger.info(f"原final_preview_text长度: {original_length}")
+        logger.info("原final_preview_text长度: %s", original_length)
 
         if new_value:
             st.session_state['final_preview_text'] = new_value
-            logger.info(f"更新final_preview_text，新长度: {len(new_value)}")
+            logger.info("更新final_preview_text，新长度: %s", len(new_value))
         else:
-            logger.warning(f"new_value为空或None，不更新final_preview_text")
+            logger.warning("new_value为空或None，不更新final_preview_text")
 
         # 只有在新值与清理版本不同时才清除清理版本（表示用户手动编辑）
         if not is_same_as_cleaned and current_cleaned:
@@ -1705,15 +1763,15 @@ if st.session_state['show_sections'] and st.session_state['sections_data']:
     # 确保display_text是字符串
     text_area_value = str(display_text) if display_text is not None else ""
 
-    logger.info(f"=== 文本区域渲染信息 ===")
-    logger.info(f"display_text类型: {type(display_text)}")
-    logger.info(f"display_text长度: {len(display_text) if display_text else 0}")
-    logger.info(f"text_area_value类型: {type(text_area_value)}")
-    logger.info(f"text_area_value长度: {len(text_area_value)}")
-    logger.debug(f"text_area_value前200字符: {text_area_value[:200] if text_area_value else '空'}")
-    logger.info(f"final_preview_text_cleaned存在: {'final_preview_text_cleaned' in st.session_state}")
-    logger.info(f"final_preview_text_cleaned长度: {len(st.session_state.get('final_preview_text_cleaned', ''))}")
-    logger.info(f"final_preview_text_display session state存在: {'final_preview_text_display' in st.session_state}")
+    logger.info("=== 文本区域渲染信息 ===")
+    logger.info("display_text类型: %s", type(display_text))
+    logger.info("display_text长度: %s", len(display_text) if display_text else 0)
+    logger.info("text_area_value类型: %s", type(text_area_value))
+    logger.info("text_area_value长度: %s", len(text_area_value))
+    logger.debug("text_area_value前200字符: %s", preview(text_area_value, 200))
+    logger.info("final_preview_text_cleaned存在: %s", 'final_preview_text_cleaned' in st.session_state)
+    logger.info("final_preview_text_cleaned长度: %s", len(st.session_state.get('final_preview_text_cleaned', '')))
+    logger.info("final_preview_text_display session state存在: %s", 'final_preview_text_display' in st.session_state)
 
     # 在主界面显示调试信息
     if DEBUG_MODE:
@@ -1765,19 +1823,87 @@ if st.session_state['show_sections'] and st.session_state['sections_data']:
     if HAS_DOCX:
         # 准备导出文本 - 优先使用清理版本
         export_text = st.session_state.get('final_preview_text_cleaned') or st.session_state['final_preview_text']
-        if not keep_highlight:
-            export_text = remove_markdown_bold(export_text)
-        
-        # 创建Word文档
-        docx_file = create_docx_smart(export_text, custom_header)
-        
-        # 添加下载按钮
-        st.download_button(
-            label="下载Word文档",
-            data=docx_file,
-            file_name=f"Personal_Statement_{target_school.replace(' ', '_') if target_school else 'Final'}.docx",
-            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            type="primary",
-            use_container_width=True
-        )
-        
+        export_signature = (hashlib.sha256(export_text.encode('utf-8')).hexdigest(), custom_header, keep_highlight)
+
+        # 仅在用户请求导出后才构建Word文档，文本、页眉或高亮选项变化后需重新生成
+        if st.button("生成Word文档", key="prepare_docx_btn", use_container_width=True):
+            st.session_state['docx_requested_signature'] = export_signature
+
+        if st.session_state.get('docx_requested_signature') == export_signature:
+            docx_bytes = build_docx_bytes(*export_signature, export_text)
+
+            # 添加下载按钮
+            st.download_button(
+                label="下载Word文档",
+                data=docx_bytes,
+                file_name=f"Personal_Statement_{target_school.replace(' ', '_') if target_school else 'Final'}.docx",
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                type="primary",
+                use_container_width=True
+            )
+        elif st.session_state.get('docx_requested_signature'):
+            st.caption("预览内容或导出选项已变化，请重新生成Word文档")
+
+# ==========================================
+# 全篇交互编辑区域
+# 提供段落级别的编辑、翻译和修改功能
+# ==========================================
+if st.session_state['show_sections'] and st.session_state['sections_data']:
+    st.divider()
+    st.subheader("全篇编辑模式")
+    st.caption("请在左侧文本框中直接编辑，或在 `【】` 或 `[]` 中输入修改指令，然后点击下方按钮执行修改。")
+
+    # 所有模型调用共用进程级模型注册表 model_registry
+
+    # 批量翻译：并发翻译所有段落，全部完成后只刷新一次
+    col_all_us, col_all_uk, col_workers = st.columns([1, 1, 1])
+    with col_workers:
+        translate_workers = st.number_input("并发数", min_value=1, max_value=16,
+                                            value=TRANSLATE_MAX_WORKERS, step=1, key="translate_workers")
+    translate_all_style = None
+    with col_all_us:
+        if st.button("🇺🇸全部翻译", key="btn_us_all"):
+            translate_all_style = "US"
+    with col_all_uk:
+        if st.button("🇬🇧全部翻译", key="btn_uk_all"):
+            translate_all_style = "UK"
+
+    if translate_all_style:
+        # 优先使用文本框中的最新内容
+        paragraph_texts = {
+            idx: st.session_state.get(f"draft_p_{idx}", section['draft'])
+            for idx, section in enumerate(st.session_state['sections_data'])
+        }
+        total = max(1, sum(1 for text in paragraph_texts.values() if text and text.strip()))
+        progress_bar = st.progress(0.0, text=f"正在并发翻译 {total} 个段落...")
+        failed = []
+        finished = [0]
+
+        def on_translation_done(idx, text, error):
+            """单段翻译完成后立即写入翻译结果"""
+            finished[0] += 1
+            if error is not None:
+                failed.append(idx)
+                logger.error("段落 %s 批量翻译失败: %s", idx, error)
+            else:
+                apply_translation_result(idx, text, translate_all_style)
+            progress_bar.progress(finished[0] / total, text=f"已完成 {finished[0]}/{total} 个段落")
+
+        translate_all_paragraphs(paragraph_texts, translate_all_style, int(translate_workers), on_translation_done,
+                                 use_cache=st.session_state['use_response_cache'])
+
+        if failed:
+            st.error(f"以下段落翻译失败: {[idx + 1 for idx in sorted(failed)]}")
+        else:
+            st.rerun()
+
+    # 遍历所有段落，每个段落卡片是独立片段，段落内的操作只重新执行该段落
+    for i in range(len(st.session_state['sections_data'])):
+        render_paragraph_card(i)
+
+    # 最终导出区域同样作为独立片段运行
+    render_final_export()
+
+# 脚本运行结束时保存会话存储
+persist_session()
+session_store.end_run()
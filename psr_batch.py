@@ -0,0 +1,242 @@
+# ==========================================
+# 个人陈述批量适配 - 命令行入口
+# 读取一份清单 (CSV/JSON)，将同一篇个人陈述并发适配到多个目标项目，
+# 每个目标输出一个Word文档和一个段落JSON，并通过进度文件支持断点续跑
+#
+# 用法:
+#   python psr_batch.py --ps old_ps.docx --manifest targets.csv --out output/
+#   （未安装 python-docx 时需加 --no-docx，只输出段落JSON）
+#
+# 清单字段: school, major, curriculum (课程文件路径，可选), curriculum_text (可选),
+#           strategy (写作策略文本，可选), strategy_file (可选), name (输出文件名，可选)
+# ==========================================
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from psr_core import (
+    HAS_DOCX, extract_text_from_path, clean_model_output, create_docx_smart,
+    build_analysis_prompt,
+)
+from call_governor import CallGovernor
+from metrics import MetricsRegistry
+from prompt_budget import DEFAULT_PROMPT_TOKEN_BUDGET, fit_analysis_inputs
+from section_parser import parse_sections
+
+DEFAULT_MODEL_NAME = "gemini-2.5-pro"
+PROGRESS_FILE_NAME = "progress.json"
+
+
+class ProgressFile:
+    """记录每个目标的完成状态，重复运行时跳过已完成的目标"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def is_done(self, target_id):
+        return self.entries.get(target_id, {}).get("status") == "done"
+
+    def update(self, target_id, **fields):
+        """更新一个目标的状态并原子地写回文件"""
+        with self._lock:
+            entry = self.entries.setdefault(target_id, {})
+            entry.update(fields)
+            entry["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+# 读取清单文件
+def load_manifest(path):
+    """读取CSV或JSON清单，返回目标列表"""
+    if path.lower().endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            targets = json.load(f)
+    else:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            targets = list(csv.DictReader(f))
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for target in targets:
+        # 清单中的相对路径按清单所在目录解析
+        for field in ("curriculum", "strategy_file"):
+            if target.get(field) and not os.path.isabs(target[field]):
+                target[field] = os.path.join(base_dir, target[field])
+    return targets
+
+
+# 生成目标的输出文件名
+def target_id_for(target, index):
+    """优先使用清单中的name，否则由学校和专业生成"""
+    raw = target.get("name") or f"{index + 1:02d}_{target.get('school', '')}_{target.get('major', '')}"
+    return re.sub(r"[^\w\-]+", "_", raw).strip("_") or f"target_{index + 1:02d}"
+
+
+# 读取目标的课程和策略文本
+def load_target_inputs(target):
+    """返回 (课程文本, 策略文本)"""
+    course_text = target.get("curriculum_text") or ""
+    if target.get("curriculum"):
+        course_text = (course_text + "\n" + extract_text_from_path(target["curriculum"])).strip()
+
+    strategy_text = target.get("strategy") or ""
+    if target.get("strategy_file"):
+        with open(target["strategy_file"], "r", encoding="utf-8") as f:
+            strategy_text = (strategy_text + "\n" + f.read()).strip()
+    return course_text, strategy_text
+
+
+# 对单个目标运行分析
+def run_target(target, target_id, ps_text, args, governor, context_cache, api_key, metrics):
+    """生成一个目标的分析结果并写出Word文档和段落JSON"""
+    course_text, strategy_text = load_target_inputs(target)
+    # 课程手册超出token预算时只保留与专业和PS最相关的段落
+    with metrics.stage("prompt_budget"):
+        budget_result = fit_analysis_inputs(target.get("school", ""), target.get("major", ""), ps_text,
+                                            course_text, False, strategy_text, budget=args.prompt_budget)
+    if budget_result.trimmed:
+        print(f"[预算] {target_id}: {budget_result.summary()}")
+    prompt = build_analysis_prompt(target.get("school", ""), target.get("major", ""), ps_text,
+                                   budget_result.course_text, False, strategy_text)
+
+    # 所有目标共用同一段静态规则前缀，只注册一次，之后每个目标只发送后缀
+    model, contents = context_cache.resolve("analysis", prompt)
+    started = time.perf_counter()
+    # 限速、退避重试由调用治理层统一处理
+    with metrics.model_call("analysis", prompt) as call:
+        response = governor.call(lambda: model.generate_content(contents), api_key, on_retry=call.on_retry)
+        full_response = response.text
+        call.record_usage(getattr(response, "usage_metadata", None))
+        call.finish(full_response)
+    elapsed = time.perf_counter() - started
+
+    full_response = clean_model_output(full_response)
+    sections = parse_sections(full_response)
+
+    json_path = os.path.join(args.out, f"{target_id}.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "school": target.get("school", ""),
+            "major": target.get("major", ""),
+            "model": args.model,
+            "elapsed_seconds": round(elapsed, 2),
+            "prompt_budget": budget_result.as_dict(),
+            "sections": sections,
+        }, f, ensure_ascii=False, indent=2)
+
+    docx_path = None
+    if not args.no_docx:
+        docx_path = os.path.join(args.out, f"{target_id}.docx")
+        with metrics.stage("docx_build"):
+            buffer = create_docx_smart("\n\n".join(section["draft"] for section in sections), target.get("major", ""))
+        with open(docx_path, "wb") as f:
+            f.write(buffer.getvalue())
+
+    return {"sections": len(sections), "json": json_path, "docx": docx_path, "elapsed_seconds": round(elapsed, 2),
+            "dropped_passages": len(budget_result.dropped)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="将一篇个人陈述批量适配到多个目标项目")
+    parser.add_argument("--ps", required=True, help="原始个人陈述文件 (docx/pdf/txt)")
+    parser.add_argument("--manifest", required=True, help="目标清单 (csv/json)")
+    parser.add_argument("--out", default="batch_output", help="输出目录")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME, help="使用的Gemini模型")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的目标数")
+    parser.add_argument("--rpm", type=float, default=10.0, help="每分钟最多发出的请求数")
+    parser.add_argument("--retries", type=int, default=3, help="限流或临时错误的最大重试次数")
+    parser.add_argument("--force", action="store_true", help="忽略进度文件，重新生成所有目标")
+    parser.add_argument("--no-docx", action="store_true", help="不生成Word文档，只输出段落JSON")
+    parser.add_argument("--prompt-budget", type=int, default=DEFAULT_PROMPT_TOKEN_BUDGET,
+                        help="分析提示词的token预算，课程信息超出时按相关度裁剪")
+    parser.add_argument("--shared-backend", default=os.environ.get("PSR_SHARED_BACKEND", "none"),
+                        help="与界面进程共用限速计数的共享存储 (sqlite:///路径 或 redis://...)，默认不共享")
+    parser.add_argument("--metrics-jsonl", help="将每次模型调用和本地阶段的耗时追加写入该JSONL文件")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # 需要Word输出但缺少python-docx时在调用模型之前退出，而不是静默地只输出JSON
+    if not args.no_docx and not HAS_DOCX:
+        print("未安装 python-docx，无法生成Word文档。请安装 python-docx，或加 --no-docx 只输出段落JSON", file=sys.stderr)
+        return 2
+
+    from context_cache import create_context_cache
+    from shared_backend import create_shared_store
+    from model_backend import MOCK_API_KEY
+    from model_registry import ModelRegistry
+    registry = ModelRegistry(args.model)
+
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if not api_key and not registry.backend.requires_api_key:
+        api_key = MOCK_API_KEY
+    if not api_key:
+        print("请设置环境变量 GOOGLE_API_KEY", file=sys.stderr)
+        return 2
+    registry.configure(api_key)
+    context_cache = create_context_cache(registry)
+
+    os.makedirs(args.out, exist_ok=True)
+    ps_text = extract_text_from_path(args.ps)
+    if not ps_text.strip() or ps_text.startswith("[读取文件出错"):
+        print(f"无法读取个人陈述: {ps_text}", file=sys.stderr)
+        return 2
+
+    targets = load_manifest(args.manifest)
+    progress = ProgressFile(os.path.join(args.out, PROGRESS_FILE_NAME))
+    metrics = MetricsRegistry(jsonl_path=args.metrics_jsonl)
+    # 与界面使用同一个API Key时共用限速计数，合计不超过配额
+    governor = CallGovernor(requests_per_minute=args.rpm, burst=max(1, args.concurrency),
+                            max_concurrency=max(1, args.concurrency), max_retries=args.retries,
+                            shared_store=create_shared_store(args.shared_backend))
+
+    pending = []
+    for index, target in enumerate(targets):
+        target_id = target_id_for(target, index)
+        if not args.force and progress.is_done(target_id):
+            print(f"[跳过] {target_id} 已完成")
+            continue
+        pending.append((target_id, target))
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        futures = {}
+        for target_id, target in pending:
+            progress.update(target_id, status="running", school=target.get("school", ""), major=target.get("major", ""))
+            futures[executor.submit(run_target, target, target_id, ps_text, args, governor, context_cache, api_key, metrics)] = target_id
+
+        for future in as_completed(futures):
+            target_id = futures[future]
+            try:
+                result = future.result()
+                progress.update(target_id, status="done", error=None, **result)
+                print(f"[完成] {target_id}: {result['sections']} 个段落, {result['elapsed_seconds']}s")
+            except Exception as e:
+                failures += 1
+                progress.update(target_id, status="failed", error=str(e))
+                print(f"[失败] {target_id}: {e}", file=sys.stderr)
+
+    prefix_stats = context_cache.stats()
+    if prefix_stats["created"]:
+        print(f"前缀缓存: 注册 {prefix_stats['created']} 个，复用 {prefix_stats['hits']} 次，"
+              f"节省约 {prefix_stats['saved_tokens']} 输入tokens")
+    print(f"共 {len(pending)} 个目标，失败 {failures} 个。进度文件: {progress.path}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,461 @@
+# ==========================================
+# 个人陈述修改 - 核心函数
+# 不依赖Streamlit的文件处理、文本清理、文档导出和Prompt构建函数，
+# 供界面 (psr.py) 与批处理命令行 (psr_batch.py) 共用
+# ==========================================
+import re
+from io import BytesIO
+
+from doc_ingest import ingest_file
+from text_cleaning import BOLD_PIPELINE, DOCX_LINE_PIPELINE, MODEL_OUTPUT_PIPELINE, strip_greetings
+from context_cache import PromptParts
+from text_diff import render_diff_html
+from vocab_lint import banned_vocabulary_prompt
+
+_BOLD_SPLIT_RE = re.compile(r'(\*\*.*?\*\*)')
+
+# 翻译和英文精修提示词共用的禁用词列表（与本地检查 vocab_lint 使用同一份词表）
+BANNED_VOCABULARY_PROMPT = banned_vocabulary_prompt()
+
+# ==========================================
+# 依赖库检测与初始化
+# 检查是否安装了处理Word文档和PDF文件的库，并相应设置标志
+# ==========================================
+HAS_DOCX = False
+
+try:
+    # 尝试导入处理Word文档的库
+    from docx import Document
+    from docx.shared import Pt, Inches
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.enum.section import WD_SECTION
+    HAS_DOCX = True
+except ImportError:
+    pass
+
+
+# ==========================================
+# 工具函数
+# 包含各种辅助功能，如文件处理、文本清理和格式转换
+# ==========================================
+
+# 从上传的文件中提取文本内容
+def extract_text_from_file(uploaded_file):
+    """从上传的文件中提取文本，支持DOCX、PDF和TXT格式，相同内容直接返回缓存结果"""
+    if not uploaded_file: return ""
+    try:
+        return ingest_file(uploaded_file).text
+    except Exception as e:
+        return f"[读取文件出错: {e}]"
+
+# 从本地路径提取文本内容
+def extract_text_from_path(path):
+    """读取本地文件并按扩展名提取文本，供命令行批处理使用"""
+    with open(path, "rb") as f:
+        buffer = BytesIO(f.read())
+    buffer.name = path
+    return extract_text_from_file(buffer)
+
+# 清除文本中的星号
+def clean_asterisks(text):
+    """移除文本中的所有星号字符"""
+    if not text: return ""
+    return text.replace("*", "")
+
+# 移除Markdown加粗标记
+def remove_markdown_bold(text):
+    """移除文本中的Markdown加粗标记（**）"""
+    return BOLD_PIPELINE.clean(text)
+
+# 过滤AI生成内容中的问候语
+def filter_ai_greeting(text):
+    """移除AI生成内容开头的常见问候语和介绍语（预编译规则）"""
+    return strip_greetings(text)
+
+# 清理完整的模型输出
+def clean_model_output(text):
+    """一次遍历去除星号并过滤开头的问候语"""
+    return MODEL_OUTPUT_PIPELINE.clean(text)
+
+# 创建带有格式的Word文档
+def create_docx_smart(text_content, major_name=""):
+    """创建格式化的Word文档，包括页眉、字体设置和加粗高亮"""
+    if not HAS_DOCX: return None
+    doc = Document()
+    
+    # 设置页面边距
+    sections = doc.sections
+    for section in sections:
+        section.top_margin = Inches(1)
+        section.bottom_margin = Inches(1)
+        section.left_margin = Inches(1)
+        section.right_margin = Inches(1)
+    
+    # 添加页眉
+    header_text = f"Personal Statement - {major_name}" if major_name else "Personal Statement"
+    header = doc.sections[0].header
+    header_para = header.paragraphs[0]
+    header_para.text = header_text
+    header_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    
+    # 设置页眉文本格式
+    header_run = header_para.runs[0]
+    header_run.font.name = 'Arial'
+    header_run.font.size = Pt(11)
+
+    # 设置正文默认样式
+    style = doc.styles['Normal']
+    font = style.font
+    font.name = 'Arial'
+    font.size = Pt(11)
+    
+    # 处理正文内容，保留加粗格式
+    # 标记不跨行，整体清理一次后与原始行一一对应
+    lines = text_content.split('\n')
+    clean_lines = DOCX_LINE_PIPELINE.strip(text_content).split('\n')
+    for line, clean_line in zip(lines, clean_lines):
+        if not line.strip(): continue
+        p = doc.add_paragraph()
+        parts = _BOLD_SPLIT_RE.split(clean_line)
+        for part in parts:
+            if part.startswith('**') and part.endswith('**'):
+                clean_text = part[2:-2]
+                run = p.add_run(clean_text)
+                run.bold = True
+            else:
+                p.add_run(part)
+    
+    # 将文档保存到内存缓冲区
+    buffer = BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+# 生成HTML预览，高亮显示加粗部分
+def generate_preview_html(text_with_markdown):
+    """将Markdown格式的文本转换为HTML预览，高亮显示加粗部分"""
+    # 替换markdown加粗语法为HTML span标签
+    html_text = re.sub(r'\*\*(.*?)\*\*', r'<span style="background-color: #FFEB3B; font-weight: bold;">\1</span>', text_with_markdown)
+    
+    # 添加HTML样式，确保与文本框样式一致
+    styled_html = f"""
+    <div class="preview-container">
+        <div class="preview-text">
+            {html_text}
+        </div>
+    </div>
+    """
+    return styled_html
+
+# 比较文本并高亮差异部分
+def highlight_differences(original_text, new_text):
+    """比较原始文本和新文本，以词/中文字符为单位高亮插入部分、划除删除部分"""
+    # 如果原文本为空，则将整个新文本高亮显示
+    if not original_text:
+        return f"<span class='modified-text'>{new_text}</span>"
+
+    # 模型用**标记的修改由差异引擎重新识别，这里去掉标记避免被当作新增内容
+    return render_diff_html(original_text, remove_markdown_bold(new_text))
+
+# 检测文本是否包含中文
+def contains_chinese(text):
+    """检测文本中是否包含中文字符"""
+    for char in text:
+        if '\u4e00' <= char <= '\u9fff':
+            return True
+    return False
+
+# 检测文本是否包含批注标记
+def contains_annotation(text):
+    """检测文本是否包含【】或[]形式的批注标记"""
+    return ('【' in text and '】' in text) or ('[' in text and ']' in text)
+
+# 从AI修改思路中提取段落主题
+def extract_paragraph_topic(logic_text):
+    """从AI修改思路中提取段落主题"""
+    if not logic_text:
+        return "未识别"
+
+    # 尝试从常见模式中提取
+    patterns = [
+        r"本段功能识别：\[(.+?)\]",
+        r"功能：(.+?)(?:\n|$)",
+        r"主题：(.+?)(?:\n|$)"
+    ]
+
+    for pattern in patterns:
+        match = re.search(pattern, logic_text)
+        if match:
+            return match.group(1).strip()
+
+    # 根据关键词推断
+    keywords = {
+        "动机": ["动机", "兴趣", "inspiration", "motivation"],
+        "学术背景": ["学术", "学习", "课程", "academic"],
+        "研究经历": ["研究", "项目", "实验", "research"],
+        "工作经历": ["工作", "实习", "职业", "work"],
+        "职业规划": ["规划", "目标", "未来", "career"],
+        "择校理由": ["学校", "课程", "专业", "why school"]
+    }
+
+    for topic, key_list in keywords.items():
+        if any(key in logic_text.lower() for key in key_list):
+            return topic
+
+    return "段落内容"
+
+# 安全设置，所有模型调用统一关闭内容过滤
+def get_safety_settings():
+    """返回关闭所有内容过滤的安全设置"""
+    from google.generativeai.types import HarmCategory, HarmBlockThreshold
+    return {
+        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+    }
+
+# ==========================================
+# Prompt构建函数
+# 为不同任务创建专门的提示词，如分析、修改和翻译；
+# 全文分析返回 PromptParts：规则和输出格式这一大块静态文本在前（达到最小token数时注册为上下文缓存），其余指令按原顺序在后。
+# 段落级的修改、翻译和禁用词修正提示词远小于上下文缓存的最小token数，返回普通字符串，不走上下文缓存
+# ==========================================
+
+# 构建初始分析提示词
+def build_analysis_prompt(school, major, old_text, new_course_text, has_images, strategy_text):
+    """构建用于初始分析和生成中英混合文本的提示词
+
+    前缀只有不随输入变化的修改规则和输出格式；任务目标、用户特别指令（优先级最高）和输入材料
+    按原有顺序放在后缀，用户特别指令仍紧跟任务目标、位于旧PS之前
+    """
+    # 如果上传了图片，添加相关指示
+    image_instruction = "我同时也上传了课程设置的截图，请务必结合截图内容。" if has_images else ""
+    
+    # 如果提供了策略文本，添加到提示中
+    custom_strategy_instruction = ""
+    if strategy_text and strategy_text.strip():
+        custom_strategy_instruction = f"""
+        【用户特别指令 (优先级最高)】
+        {strategy_text}
+        """
+    
+    prefix = """
+    你是一位专业的留学文书顾问。
+    
+    【核心修改逻辑 (必须严格执行)】
+    1. **结构与顺序 (尊重原文)**：
+       - 请**顺应旧文书原本的段落结构和逻辑顺序**进行输出，不要强行打乱或重组。
+       - **关键要求**：在处理每一段时，你必须在 `[[LOGIC]]` 中明确识别出**这一段的功能**。
+    
+    2. **针对"课程设置/择校理由"段落 (智能识别并深度重写)**：
+       - 当你处理到**涉及学校、课程、Why School**的段落时，必须**完全重写**。
+       - **筛选逻辑**：排除通用课程，只选与学生背景结合紧密的核心课。
+       - **深度与具体化**：必须深入引用该课程模块中的**关键概念 (Key Concepts)** 或 **具体方法学**。
+
+    3. **针对其他段落 (全篇适配与优化)**：
+       - **范围覆盖**：开头动机、学习/实践经历、职业规划。
+       - **适配新专业**：检查内容是否符合新专业逻辑。
+
+    【⚠️⚠️⚠️ 绝对强制执行规则 (ABSOLUTE MANDATORY RULES) ⚠️⚠️⚠️】
+    在生成 `[[DRAFT]]` 时，必须严格执行以下"中英混合"逻辑，这是最高优先级指令：
+    1. **Unchanged Parts (未修改部分)**: MUST remain in **Original English**. Do NOT translate them into Chinese. 未修改部分必须保留原始英文。
+    2. **Modified/New Parts (修改/新增部分)**: MUST be written in **CHINESE (中文)** directly without any brackets or parentheses. 所有修改或新增的部分必须直接用中文写出，不要用任何符号包裹。
+       - Example: Original English text... 这里插入一句关于课程 A 的具体分析，强调它如何提升我的数据挖掘能力... more original English text.
+    3. **Rewrite Sections (重写段落)**: If a whole paragraph (like Why School) is rewritten, output it **entirely in Chinese** without any brackets. 如果整段重写（如Why School段落），必须将整段内容直接用中文写出。
+       - Example: 整段重写的内容...
+    
+    【⚠️ 严格禁止】
+    1. 不要在输出开头添加任何问候语或介绍语，如"作为一名专业的留学文书顾问..."
+    2. 直接从第一段内容开始输出，不要有任何前言或开场白
+    3. 所有修改过的内容必须用中文表达，不要直接输出英文修改
+    4. 不要用英文输出任何修改内容，所有修改必须是中文
+    5. 不要使用任何符号（如方括号[]、圆括号()等）来包裹中文内容，直接输出中文即可
+
+    【输出格式示例】
+    ===SECTION===
+    [[LOGIC]]
+    本段功能识别：[例如：学术背景]
+    这里用中文解释修改思路...
+    [[DRAFT]]
+    Original English sentence here. 这里插入一句补充说明，强调量化能力. Another original English sentence.
+    ===SECTION===
+    ...
+"""
+    suffix = f"""
+    【任务目标】将用户的【旧个人陈述】适配到新的申请目标：**{school}** 的 **{major}** 专业。
+    {custom_strategy_instruction}
+    【输入材料】
+    1. 旧 PS 内容：
+    {old_text}
+    2. 新项目课程信息：
+    {new_course_text}
+    {image_instruction}
+
+    请开始输出：
+    """
+    return PromptParts(prefix, suffix)
+
+# 构建续写提示词 - 流式输出中断后让模型从断点继续
+def build_continuation_prompt(partial_output):
+    """构建续写提示词，要求模型从已输出内容的末尾继续，不重复已有内容"""
+    return f"""
+    【续写说明】你之前的输出因网络中断被截断，已输出的内容如下（到此为止）：
+    {partial_output}
+    【要求】请从上述内容的最后一个字符之后直接继续输出剩余部分，保持完全相同的格式，不要重复已输出的任何内容，也不要添加任何说明。
+    """
+
+# 构建修改提示词 - 修改后确保直接替换原文本，修改部分用**高亮
+def build_refine_prompt(text_with_instructions, has_chinese):
+    """构建用于根据批注修改文本的提示词，根据文本是否包含中文决定输出语言，修改部分高亮显示"""
+    # 根据文本是否包含中文决定输出语言
+    output_language = "CHINESE" if has_chinese else "ENGLISH"
+
+    return f"""
+    You are an expert editor. The user has provided a draft text below, but they have inserted **modification instructions** inside brackets `【...】` or `[...]`.
+    **Your Task:**
+    1. Read the text carefully.
+    2. Identify the instructions inside `【】` or `[]` (e.g., "【把这段语气改得更自信一点】", "[make this more professional]").
+    3. **Execute** these instructions to rewrite the text.
+    4. **Remove** the instruction markers and the instruction text itself from the final output.
+    5. Keep the rest of the text that was not targeted by instructions unchanged.
+    6. Ensure the final output is smooth and coherent.
+
+    **IMPORTANT OUTPUT LANGUAGE RULE:**
+    - The text contains Chinese: {has_chinese}
+    - Your output MUST be in {output_language}.
+    - If the input contains Chinese text, keep using Chinese in your output.
+    - If the input is entirely in English, respond in English.
+
+    **HIGHLIGHTING RULE:**
+    - Wrap ALL modified parts with double asterisks (**) to highlight them (e.g., **this text was modified**).
+    - Do NOT use any other Markdown formatting symbols.
+    - Keep the original text that was not modified unchanged and without highlighting.
+
+    **Input Text:**
+    {text_with_instructions}
+    **Output:**
+    Output ONLY the refined text with modified parts highlighted using ** (no explanations).
+    """
+
+# 修改翻译prompt，明确指示将中文翻译为英文，确保输出纯英文且无Markdown符号
+def build_translate_prompt(hybrid_text, style="US"):
+    """构建用于将中英混合文本翻译为纯英文的提示词，支持美式和英式拼写，遵循专业写作规范"""
+    # 根据指定风格设置拼写规则
+    spelling_rule = "American Spelling (Color, Honor, Analyze)" if style == "US" else "British Spelling (Colour, Honour, Analyse)"
+
+    return f"""
+    You are an expert Admissions Essay Translator.
+    Task: Translate the hybrid Chinese-English paragraph into professional English.
+    Spelling Convention: {spelling_rule}.
+    Input (Hybrid Draft):
+    {hybrid_text}
+    CRITICAL RULES (MUST FOLLOW)
+    1. **TRANSLATION EXECUTION**:
+       - **MUST translate ALL Chinese text** into professional English following the rules below.
+       - Any text inside brackets like `(...)` or `【...】` must be translated to English.
+       - Merge translations smoothly with the existing English text.
+       - **DO NOT use any Markdown formatting symbols** (no asterisks, bold, etc.)
+       - Output clean text without any formatting marks.
+       - Output ONLY the final English paragraph.
+    2. **BANNED VOCABULARY (DO NOT USE)**:
+{BANNED_VOCABULARY_PROMPT}
+    3. **PROHIBITED STRUCTURES (ABSOLUTELY FORBIDDEN)**:
+       - **Adverbs**: Do not use adverbs (including adverbs as logical connectors).
+       - **-ing forms as nouns**: Avoid using -ing forms as nouns (gerunds as subjects/objects).
+       - **Adverb + verb/adjective structures**: Avoid combinations like "significantly improve" or "deeply understand".
+       - **Main clause + , + -ing participial phrases**: Avoid structures like "I completed the project, demonstrating my skills".
+    4. **SENTENCE STRUCTURE REQUIREMENTS**:
+       - **Use subordinate clauses** to enhance logical connections. For example: "...which in turn leads to..." instead of "...this [verb]..."
+       - **Use semicolons (;)** to connect complete but conceptually related sentences, not periods.
+       - Ensure logical coherence and smooth flow.
+    5. **PUNCTUATION STANDARDS**:
+       - **Quotation marks**: Do NOT place commas or periods inside quotation marks. Place punctuation OUTSIDE quotation marks.
+       - Example: Use "example", not "example,".
+    6. **PROFESSIONAL WRITING STANDARDS**:
+       - Use precise, professional terminology.
+       - Avoid colloquial expressions.
+       - Maintain formal academic tone appropriate for personal statements.
+    7. **ORIGINAL ENGLISH PRESERVATION**:
+       - Keep original English parts unchanged.
+       - Apply all rules above only to newly translated parts (from Chinese to English).
+    """
+
+# 修改英文精修提示词，确保输出纯英文，遵循专业写作规范，修改部分用**高亮
+def build_english_refine_prompt(text_with_instructions):
+    """构建用于英文精修阶段的提示词，确保输出纯英文，遵循专业写作规范，修改部分高亮显示"""
+    return f"""
+    You are an expert academic editor specializing in personal statements for graduate school applications.
+
+    **Your Task:**
+    1. Read the English text carefully.
+    2. Identify the instructions inside `【】` or `[]` (e.g., "[make this more professional]", "【improve this sentence】").
+    3. **Execute** these instructions to improve the text.
+    4. **Remove** the instruction markers and the instruction text itself from the final output.
+    5. Keep the rest of the text that was not targeted by instructions unchanged.
+    6. Ensure the final output is smooth, coherent, and maintains a professional academic tone.
+
+    **CRITICAL RULES (MUST FOLLOW):**
+    1. **OUTPUT FORMAT**:
+       - Output MUST be in ENGLISH only.
+       - **HIGHLIGHTING**: Wrap ALL modified parts with double asterisks (**) to highlight them (e.g., **this text was modified**).
+       - Do NOT use any other Markdown formatting symbols (no single asterisks, underscores, etc.).
+       - Keep the original text that was not modified unchanged and without highlighting.
+
+    2. **BANNED VOCABULARY (DO NOT USE)**:
+{BANNED_VOCABULARY_PROMPT}
+
+    3. **PROHIBITED STRUCTURES (ABSOLUTELY FORBIDDEN)**:
+       - **Adverbs**: Do not use adverbs (including adverbs as logical connectors).
+       - **-ing forms as nouns**: Avoid using -ing forms as nouns (gerunds as subjects/objects).
+       - **Adverb + verb/adjective structures**: Avoid combinations like "significantly improve" or "deeply understand".
+       - **Main clause + , + -ing participial phrases**: Avoid structures like "I completed the project, demonstrating my skills".
+
+    4. **SENTENCE STRUCTURE REQUIREMENTS**:
+       - **Use subordinate clauses** to enhance logical connections. For example: "...which in turn leads to..." instead of "...this [verb]..."
+       - **Use semicolons (;)** to connect complete but conceptually related sentences, not periods.
+       - Ensure logical coherence and smooth flow.
+
+    5. **PUNCTUATION STANDARDS**:
+       - **Quotation marks**: Do NOT place commas or periods inside quotation marks. Place punctuation OUTSIDE quotation marks.
+       - Example: Use "example", not "example,".
+
+    6. **PROFESSIONAL WRITING STANDARDS**:
+       - Use precise, professional terminology.
+       - Avoid colloquial expressions.
+       - Maintain formal academic tone appropriate for personal statements.
+       - Maintain the original meaning and intent of the text.
+
+    **Input Text:**
+    {text_with_instructions}
+
+    **Output:**
+    Output ONLY the refined English text with modified parts highlighted using ** (no explanations).
+    """
+
+# 构建禁用词修正提示词 - 只修正本地检查发现的问题，不重新翻译整段
+def build_lint_fix_prompt(text, issues):
+    """构建针对具体违规位置的修正提示词，未涉及的句子保持原样"""
+    issue_lines = "\n".join(f"       - \"{text[issue.start:issue.end]}\": {issue.rule}" for issue in issues)
+    return f"""
+    You are an expert academic editor specializing in personal statements for graduate school applications.
+
+    **RULES:**
+    1. **BANNED VOCABULARY (DO NOT USE)**:
+{BANNED_VOCABULARY_PROMPT}
+    2. **Main clause + , + -ing participial phrases** are forbidden: use a subordinate clause or a semicolon instead.
+    3. Do NOT use any Markdown formatting symbols.
+
+    **Your Task:**
+    The English paragraph below violates the writing rules above at the following places:
+{issue_lines}
+
+    Rewrite ONLY the sentences that contain these violations so that they follow the rules.
+    Keep every other sentence exactly as it is, and keep the original meaning.
+
+    **Input Text:**
+    {text}
+
+    **Output:**
+    Output ONLY the corrected English paragraph (no explanations).
+    """
@@ -0,0 +1,104 @@
+# ==========================================
+# 异步日志系统
+# 渲染线程只把日志记录放入队列，由后台线程写入滚动日志文件；
+# 每条记录带上会话关联ID，便于区分多个用户的并发日志
+# ==========================================
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import queue
+import re
+
+LOGGER_NAME = "psr_debug"
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(session_id)s] %(message)s"
+
+# 当前线程/上下文的会话关联ID
+_session_id = contextvars.ContextVar("psr_session_id", default="-")
+
+# 进程内唯一的后台写入线程
+_listener = None
+
+
+# 绑定当前会话的关联ID
+def bind_session_id(session_id):
+    """为当前上下文设置会话关联ID，之后的日志记录都会带上该ID"""
+    _session_id.set(session_id or "-")
+
+
+class SessionContextFilter(logging.Filter):
+    """在调用线程中为日志记录附加会话关联ID"""
+
+    def filter(self, record):
+        record.session_id = _session_id.get()
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """不在调用线程中格式化消息，格式化推迟到后台写入线程"""
+
+    def prepare(self, record):
+        return record
+
+
+class preview:
+    """日志参数的惰性截断包装，只有在记录真正被输出时才截取文本"""
+
+    __slots__ = ("text", "limit")
+
+    def __init__(self, text, limit=100):
+        self.text = text
+        self.limit = limit
+
+    def __str__(self):
+        if not self.text:
+            return "空"
+        return str(self.text[:self.limit])
+
+
+# 工作进程的日志文件名
+def worker_log_path(worker=None, log_path="psr_debug.log"):
+    """多进程部署时每个工作进程写自己的文件 (psr_debug.<名称>.log)，避免多个进程同时滚动同一个文件"""
+    if not worker:
+        return log_path
+    base, dot, ext = log_path.rpartition(".")
+    safe_worker = re.sub(r"[^\w.-]", "_", worker)
+    return f"{base}.{safe_worker}.{ext}" if dot else f"{log_path}.{safe_worker}"
+
+
+# 设置日志系统
+def setup_logging(debug_mode=True, log_path="psr_debug.log", max_bytes=5 * 1024 * 1024, backup_count=3):
+    """配置基于队列的异步日志，重复调用时直接返回已配置的logger"""
+    global _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(logging.DEBUG if debug_mode else logging.INFO)
+
+    # 避免重复添加handler（Streamlit每次rerun都会重新执行脚本）
+    if _listener is not None:
+        return logger
+
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    # 滚动文件handler，由后台线程写入
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+    )
+    file_handler.setFormatter(formatter)
+    handlers = [file_handler]
+
+    # 控制台handler（仅当debug_mode开启时）
+    if debug_mode:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SessionContextFilter())
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return logger
@@ -0,0 +1,182 @@
+# ==========================================
+# 模型响应缓存
+# 以 (模型名, 提示词哈希, 图片哈希, 风格) 为键缓存Gemini的返回文本
+# 内存层为有界LRU，可选SQLite持久层，支持TTL与按容量淘汰；
+# 多进程部署时持久层换成共享存储 (见 shared_backend)，所有工作进程共用缓存结果
+# ==========================================
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# 响应在共享存储中的键前缀
+SHARED_KEY_PREFIX = "response:"
+
+
+class ResponseCache:
+    """两级响应缓存：进程内LRU + 可选的持久层（本地SQLite文件或共享存储）"""
+
+    def __init__(self, max_entries=256, db_path=None, ttl_seconds=7 * 24 * 3600, max_db_bytes=100 * 1024 * 1024,
+                 shared=None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.shared = shared
+        self.ttl_seconds = ttl_seconds
+        self.max_db_bytes = max_db_bytes
+        self._memory = OrderedDict()
+        # _lock 只保护内存层和统计；持久层的读写在锁外进行，本地SQLite连接由 _disk_lock 串行化
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+        if db_path and shared is None:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed)")
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name, prompt, images=(), style=""):
+        """根据模型名、提示词、图片内容和风格计算内容寻址的缓存键"""
+        digest = hashlib.sha256()
+        digest.update(model_name.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(hashlib.sha256(prompt.encode("utf-8")).digest())
+        for image_bytes in images:
+            digest.update(b"\x01")
+            digest.update(hashlib.sha256(image_bytes).digest())
+        digest.update(b"\x00")
+        digest.update((style or "").encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """读取缓存，先查内存层再查持久层，未命中返回None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return self._memory[key]
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is not None:
+                self._memory_set(key, value)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        """写入缓存，空响应不缓存"""
+        if not value:
+            return
+        with self._lock:
+            self._memory_set(key, value)
+        self._disk_set(key, value)
+
+    def clear(self, shared=False):
+        """清空本进程的内存层和本地SQLite持久层；共享存储由所有工作进程共用，只有 shared=True 时才清空"""
+        with self._lock:
+            self._memory.clear()
+        if self.shared is not None:
+            if shared:
+                self.shared.clear(SHARED_KEY_PREFIX)
+        elif self._conn is not None:
+            with self._disk_lock:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.commit()
+
+    def stats(self):
+        """返回命中统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_entries": len(self._memory),
+            }
+        stats["disk_entries"] = self._disk_count()
+        return stats
+
+    def _memory_set(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key):
+        if self.shared is not None:
+            value = self.shared.get(SHARED_KEY_PREFIX + key)
+            return None if value is None else value.decode("utf-8")
+        if self._conn is None:
+            return None
+        with self._disk_lock:
+            row = self._conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            now = time.time()
+            # 过期条目直接删除
+            if self.ttl_seconds and now - created > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def _disk_set(self, key, value):
+        if self.shared is not None:
+            self.shared.set(SHARED_KEY_PREFIX + key, value.encode("utf-8"), ttl=self.ttl_seconds or None)
+            return
+        if self._conn is None:
+            return
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._disk_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict_disk(now)
+            self._conn.commit()
+
+    def _evict_disk(self, now):
+        # 先清除过期条目，再按最近访问时间淘汰直到总大小回到上限以内
+        if self.ttl_seconds:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        if not self.max_db_bytes:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_db_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall()
+        for key, size in rows:
+            if total <= self.max_db_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    def _disk_count(self):
+        if self.shared is not None:
+            return self.shared.count(SHARED_KEY_PREFIX)
+        if self._conn is None:
+            return 0
+        with self._disk_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
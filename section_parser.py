@@ -0,0 +1,95 @@
+# ==========================================
+# 段落解析器
+# 将模型输出按 ===SECTION=== / [[LOGIC]] / [[DRAFT]] 标记解析为结构化段落
+# 支持流式增量解析：每收到一个段落的结束分隔符即输出该段落
+# ==========================================
+
+SECTION_DELIMITER = "===SECTION==="
+LOGIC_MARKER = "[[LOGIC]]"
+DRAFT_MARKER = "[[DRAFT]]"
+
+
+# 解析单个段落文本
+def parse_section(sec):
+    """将一个段落文本解析为 {"logic", "draft"}，不包含核心标记时返回None"""
+    if not sec.strip():
+        return None
+    # 过滤不包含核心标记的段落
+    if LOGIC_MARKER not in sec and DRAFT_MARKER not in sec:
+        return None
+
+    logic_part = ""
+    draft_part = ""
+    if LOGIC_MARKER in sec:
+        parts = sec.split(DRAFT_MARKER)
+        logic_part = parts[0].replace(LOGIC_MARKER, "").replace("Part 1:", "").strip()
+        if len(parts) > 1:
+            draft_part = parts[1].replace("Part 2:", "").strip()
+    else:
+        draft_part = sec.strip()
+
+    return {"logic": logic_part, "draft": draft_part}
+
+
+# 一次性解析完整响应
+def parse_sections(full_text):
+    """解析完整的模型响应，返回段落列表"""
+    parser = SectionStreamParser()
+    sections = parser.feed(full_text)
+    sections.extend(parser.close())
+    return sections
+
+
+class SectionStreamParser:
+    """增量段落解析器，按块消费流式输出并在段落结束时立即产出"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._scan_from = 0
+        self.sections = []
+
+    def feed(self, chunk):
+        """消费一个文本块，返回本次新完成的段落列表"""
+        if not chunk:
+            return []
+        self._buffer += chunk
+        completed = []
+        while True:
+            pos = self._buffer.find(SECTION_DELIMITER, self._scan_from)
+            if pos == -1:
+                # 分隔符可能被切在块边界上，下次从可能的起点继续查找
+                self._scan_from = max(0, len(self._buffer) - len(SECTION_DELIMITER) + 1)
+                break
+            section = parse_section(self._buffer[:pos])
+            self._buffer = self._buffer[pos + len(SECTION_DELIMITER):]
+            self._scan_from = 0
+            if section is not None:
+                completed.append(section)
+        self.sections.extend(completed)
+        return completed
+
+    def close(self):
+        """流结束时解析剩余缓冲，返回最后一个段落（如有）"""
+        section = parse_section(self._buffer)
+        self._buffer = ""
+        self._scan_from = 0
+        if section is None:
+            return []
+        self.sections.append(section)
+        return [section]
+
+    @property
+    def pending_text(self):
+        """尚未结束的段落文本"""
+        return self._buffer
+
+
+# 从文本块迭代器中逐个产出段落
+def iter_sections(chunks):
+    """消费文本块迭代器，每完成一个段落即产出"""
+    parser = SectionStreamParser()
+    for chunk in chunks:
+        for section in parser.feed(chunk):
+            yield section
+    for section in parser.close():
+        yield section
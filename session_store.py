@@ -0,0 +1,543 @@
+# ==========================================
+# 服务端会话存储
+# 每个段落的各版本文本（草稿、批注修改、翻译、确认内容等）集中保存在一个
+# __slots__ 记录中，并保留有限的修改历史；相同文本在会话内只保留一份。
+# 会话状态中原有的 sections_data / refine_results / confirmed_contents 等键
+# 改为指向记录的视图，写入SQLite后可在服务重启后恢复，空闲会话从内存卸载
+# ==========================================
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections.abc import MutableMapping, Sequence
+
+# 每个段落保留的历史版本数
+HISTORY_LIMIT = 20
+
+# 记录历史的文本字段（翻译结果和预览HTML由这些字段派生，不单独记录）
+HISTORY_FIELDS = frozenset(("draft", "refined", "edited_translation", "confirmed"))
+
+# 空闲多久后从内存卸载（秒）、内存中最多常驻的会话数、SQLite中保留多久（秒）
+DEFAULT_IDLE_SECONDS = 30 * 60
+DEFAULT_MAX_RESIDENT = 50
+DEFAULT_RETENTION_SECONDS = 30 * 24 * 3600
+
+# 两次空闲检查之间的最小间隔（秒）
+EVICTION_CHECK_INTERVAL = 60
+
+# 脚本运行中的会话不会被卸载；运行被中断而没有调用 end_run 时，超过该时间（秒）后不再视为运行中
+RUN_LEASE_SECONDS = 10 * 60
+
+# 会话状态键 → {键前缀: 记录字段}；前缀为None表示键就是段落索引
+SESSION_VIEWS = {
+    "refine_results": {"para_": "refined"},
+    "annotation_results": {"para_": "refined"},
+    "original_texts": {"para_": "original", "trans_": "translation_original"},
+    "translation_results": {"trans_": "translation"},
+    "edited_translations": {"trans_": "edited_translation"},
+    "preview_results": {"preview_trans_": "preview_html"},
+    "confirmed_contents": {None: "confirmed"},
+}
+
+# 随会话一起持久化的普通会话状态键
+SESSION_META_KEYS = (
+    "ps_content", "curr_content", "strategy_content",
+    "generation_complete", "show_sections", "confirmed_paragraphs", "analysis_job_id",
+)
+
+
+class TextPool:
+    """按内容去重的文本池：相同内容的文本只保留一个字符串对象"""
+
+    __slots__ = ("_texts",)
+
+    def __init__(self):
+        self._texts = {}
+
+    def __len__(self):
+        return len(self._texts)
+
+    def intern(self, text):
+        if not text or not isinstance(text, str):
+            return text
+        return self._texts.setdefault(text, text)
+
+    def chars(self):
+        return sum(len(text) for text in self._texts)
+
+    def compact(self, live_texts):
+        """只保留仍被引用的文本"""
+        self._texts = {text: text for text in live_texts if text}
+
+
+class ParagraphRecord:
+    """一个段落的所有版本；支持 record['logic'] / record['draft'] 以兼容原来的段落字典"""
+
+    __slots__ = ("_store", "logic", "draft", "refined", "original", "translation", "translation_original",
+                 "edited_translation", "preview_html", "confirmed", "history")
+
+    FIELDS = ("logic", "draft", "refined", "original", "translation", "translation_original",
+              "edited_translation", "preview_html", "confirmed")
+
+    def __init__(self, store, logic="", draft=""):
+        self._store = store
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.logic = store.pool.intern(logic)
+        self.draft = store.pool.intern(draft)
+        # [(时间戳, 字段, 旧文本), ...]，最新的在末尾
+        self.history = []
+
+    def __getitem__(self, key):
+        if key not in ("logic", "draft"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in ("logic", "draft"):
+            raise KeyError(key)
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return key in ("logic", "draft")
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.FIELDS else None
+        return default if value is None else value
+
+    def set(self, field, value):
+        """写入一个字段，文本去重，被覆盖的旧文本记入历史"""
+        pool = self._store.pool
+        if isinstance(value, dict) and "text" in value:
+            value = dict(value, text=pool.intern(value["text"]))
+        else:
+            value = pool.intern(value)
+        old = getattr(self, field)
+        if old == value:
+            return
+        if field in HISTORY_FIELDS and old:
+            self.history.append((time.time(), field, old))
+            del self.history[:-HISTORY_LIMIT]
+        setattr(self, field, value)
+        self._store.dirty = True
+
+    def versions(self, field):
+        """返回该字段的历史版本（旧 → 新），不含当前值"""
+        return [text for _, name, text in self.history if name == field]
+
+    def texts(self):
+        """记录引用的所有文本，用于文本池压缩"""
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if isinstance(value, dict):
+                yield value.get("text")
+            elif isinstance(value, str):
+                yield value
+        for _, _, text in self.history:
+            yield text
+
+
+class RecordView:
+    """sections_data 中的一个段落；每次读写都在存储锁内按下标重新定位记录，
+    会话在两次访问之间被卸载时先重新载入，写入不会落到已释放的记录上"""
+
+    __slots__ = ("_store", "_idx")
+
+    def __init__(self, store, idx):
+        self._store = store
+        self._idx = idx
+
+    def __getitem__(self, key):
+        with self._store._lock:
+            return self._store.loaded_records()[self._idx][key]
+
+    def __setitem__(self, key, value):
+        with self._store._lock:
+            self._store.loaded_records()[self._idx][key] = value
+
+    def __contains__(self, key):
+        return key in ("logic", "draft")
+
+    def get(self, key, default=None):
+        with self._store._lock:
+            return self._store.loaded_records()[self._idx].get(key, default)
+
+
+class SectionsView(Sequence):
+    """sections_data 的只读序列视图，访问时按需从SQLite重新载入"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store.loaded_records())
+
+    def __getitem__(self, idx):
+        with self._store._lock:
+            positions = range(len(self._store.loaded_records()))
+            if isinstance(idx, slice):
+                return [RecordView(self._store, pos) for pos in positions[idx]]
+            return RecordView(self._store, positions[idx])
+
+
+class FieldView(MutableMapping):
+    """把 {"para_0": 文本} 或 {0: 文本} 形式的会话状态字典映射到记录字段"""
+
+    def __init__(self, store, prefixes):
+        self._store = store
+        self._prefixes = prefixes
+
+    def _locate(self, key):
+        for prefix, field in self._prefixes.items():
+            if prefix is None:
+                if isinstance(key, int):
+                    return key, field
+            elif isinstance(key, str) and key.startswith(prefix) and key[len(prefix):].isdigit():
+                return int(key[len(prefix):]), field
+        raise KeyError(key)
+
+    def __getitem__(self, key):
+        idx, field = self._locate(key)
+        with self._store._lock:
+            records = self._store.loaded_records()
+            value = getattr(records[idx], field) if 0 <= idx < len(records) else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        idx, field = self._locate(key)
+        with self._store._lock:
+            records = self._store.loaded_records()
+            if not 0 <= idx < len(records):
+                raise KeyError(key)
+            records[idx].set(field, value)
+
+    def __delitem__(self, key):
+        idx, field = self._locate(key)
+        with self._store._lock:
+            records = self._store.loaded_records()
+            if not 0 <= idx < len(records) or getattr(records[idx], field) is None:
+                raise KeyError(key)
+            setattr(records[idx], field, None)
+            self._store.dirty = True
+
+    def __iter__(self):
+        with self._store._lock:
+            keys = [idx if prefix is None else f"{prefix}{idx}"
+                    for idx, record in enumerate(self._store.loaded_records())
+                    for prefix, field in self._prefixes.items() if getattr(record, field) is not None]
+        return iter(keys)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class SessionStore:
+    """单个会话的段落记录，可序列化到SQLite并在空闲时卸载"""
+
+    def __init__(self, session_id, db=None, registry=None):
+        self.session_id = session_id
+        self.db = db
+        self.registry = registry
+        self.pool = TextPool()
+        self.records = []
+        self.full_response = ""
+        self.meta = {}
+        self.dirty = False
+        self.loaded = True
+        self.last_access = time.time()
+        self.run_started = None
+        self._lock = threading.RLock()
+
+    # ------------------------------------------
+    # 记录读写
+    # ------------------------------------------
+
+    def loaded_records(self):
+        """返回段落记录列表，已卸载时先从SQLite载入；调用方需要持有存储锁才能安全地使用返回的列表"""
+        with self._lock:
+            if not self.loaded:
+                self.touch()
+            return self.records
+
+    def load_sections(self, sections):
+        """用解析出的段落 [{logic, draft}, ...] 替换全部记录"""
+        with self._lock:
+            self.loaded_records()
+            self.records = [ParagraphRecord(self, s.get("logic", ""), s.get("draft", "")) for s in sections]
+            self.dirty = True
+
+    def extend_sections(self, sections):
+        """在末尾追加新解析出的段落，已有段落及其修改保持不变"""
+        with self._lock:
+            self.loaded_records()
+            self.records.extend(ParagraphRecord(self, s.get("logic", ""), s.get("draft", "")) for s in sections)
+            self.dirty = True
+
+    def set_full_response(self, text):
+        with self._lock:
+            self.loaded_records()
+            self.full_response = self.pool.intern(text or "")
+            self.dirty = True
+
+    def reset(self):
+        """开始新的生成时清空所有段落"""
+        with self._lock:
+            self.loaded_records()
+            self.records = []
+            self.full_response = ""
+            self.pool.compact(())
+            self.dirty = True
+
+    def sync_meta(self, meta):
+        """记录需要持久化的普通会话状态，有变化时标记为待保存"""
+        normalized = {key: sorted(value) if isinstance(value, set) else value for key, value in meta.items()}
+        if normalized != self.meta:
+            self.meta = normalized
+            self.dirty = True
+
+    def touch(self):
+        """标记会话活跃，已卸载时重新载入"""
+        with self._lock:
+            self.last_access = time.time()
+            if not self.loaded:
+                self._restore(self.db.load(self.session_id) if self.db else None)
+                self.loaded = True
+                # 卸载时已从会话表移除，仍被引用并重新载入时放回会话表
+                if self.registry is not None:
+                    self.registry._attach(self)
+
+    def begin_run(self):
+        """脚本开始运行：标记会话活跃，运行期间不会被其他会话触发的卸载检查释放"""
+        with self._lock:
+            self.run_started = time.time()
+            self.touch()
+
+    def end_run(self):
+        """脚本运行结束，之后空闲超时即可卸载"""
+        with self._lock:
+            self.run_started = None
+            self.last_access = time.time()
+
+    @property
+    def running(self):
+        started = self.run_started
+        return started is not None and time.time() - started < RUN_LEASE_SECONDS
+
+    def stats(self):
+        with self._lock:
+            return {"paragraphs": len(self.records), "texts": len(self.pool), "chars": self.pool.chars(),
+                    "loaded": self.loaded}
+
+    # ------------------------------------------
+    # 持久化
+    # ------------------------------------------
+
+    def save(self):
+        """有修改时写入SQLite，同时丢弃不再引用的文本"""
+        with self._lock:
+            if not self.dirty or not self.loaded:
+                return False
+            self.pool.compact(self._live_texts())
+            if self.db:
+                self.db.save(self.session_id, self.to_dict())
+            self.dirty = False
+            return True
+
+    def unload(self):
+        """保存后释放内存中的段落记录，下次访问时重新载入；脚本运行中的会话不卸载"""
+        with self._lock:
+            if not self.loaded or self.db is None or self.running:
+                return False
+            self.save()
+            # 换成新列表而不是原地清空，仍持有旧列表的调用方不会看到被清空的数据
+            self.records = []
+            self.full_response = ""
+            self.pool = TextPool()
+            self.loaded = False
+            return True
+
+    def to_dict(self):
+        """序列化为JSON结构：文本只出现一次，记录中保存文本表的下标"""
+        table = {}
+
+        def ref(text):
+            if not text:
+                return text
+            if text not in table:
+                table[text] = len(table)
+            return table[text]
+
+        records = []
+        for record in self.records:
+            entry = {}
+            for field in ParagraphRecord.FIELDS:
+                value = getattr(record, field)
+                if isinstance(value, dict):
+                    entry[field] = dict(value, text=ref(value.get("text")))
+                elif value is not None:
+                    entry[field] = ref(value)
+            entry["history"] = [[round(ts, 3), name, ref(text)] for ts, name, text in record.history]
+            records.append(entry)
+        full_response = ref(self.full_response)
+        return {"texts": list(table), "full_response": full_response, "records": records, "meta": self.meta}
+
+    def _restore(self, data):
+        self.pool = TextPool()
+        self.records = []
+        self.full_response = ""
+        if not data:
+            return
+        texts = [self.pool.intern(text) for text in data["texts"]]
+
+        def deref(value):
+            return texts[value] if isinstance(value, int) else value
+
+        for entry in data["records"]:
+            record = ParagraphRecord(self)
+            for field in ParagraphRecord.FIELDS:
+                value = entry.get(field)
+                if isinstance(value, dict):
+                    value = dict(value, text=deref(value.get("text")))
+                else:
+                    value = deref(value)
+                setattr(record, field, value)
+            record.history = [(ts, name, deref(text)) for ts, name, text in entry.get("history", ())]
+            self.records.append(record)
+        self.full_response = deref(data.get("full_response")) or ""
+        self.meta = data.get("meta", {})
+
+    def _live_texts(self):
+        yield self.full_response
+        for record in self.records:
+            yield from record.texts()
+
+
+class SessionDB:
+    """会话的SQLite持久层，每个会话一行，内容为压缩后的JSON"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated)")
+        self._conn.commit()
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def exists(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row is not None
+
+    def save(self, session_id, data):
+        blob = zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, updated) VALUES (?, ?, ?)",
+                (session_id, blob, time.time()),
+            )
+            self._conn.commit()
+
+    def purge(self, older_than_seconds):
+        """删除长时间未更新的会话，返回删除的行数"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - older_than_seconds,))
+            self._conn.commit()
+            return cursor.rowcount
+
+
+class SessionRegistry:
+    """进程内的会话存储表：按会话ID复用存储，卸载空闲会话以限制内存"""
+
+    def __init__(self, db_path=None, idle_seconds=DEFAULT_IDLE_SECONDS, max_resident=DEFAULT_MAX_RESIDENT,
+                 retention_seconds=DEFAULT_RETENTION_SECONDS):
+        self.db = SessionDB(db_path) if db_path else None
+        self.idle_seconds = idle_seconds
+        self.max_resident = max_resident
+        self.retention_seconds = retention_seconds
+        self._stores = {}
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self.evictions = 0
+        if self.db:
+            self.db.purge(retention_seconds)
+
+    def open(self, session_id):
+        """返回会话的存储；进程内没有时从SQLite恢复"""
+        with self._lock:
+            store = self._stores.get(session_id)
+            if store is None:
+                store = SessionStore(session_id, self.db, self)
+                if self.db:
+                    store._restore(self.db.load(session_id))
+                self._stores[session_id] = store
+        store.touch()
+        return store
+
+    def exists(self, session_id):
+        """会话是否在进程内或SQLite中存在"""
+        with self._lock:
+            if session_id in self._stores:
+                return True
+        return self.db is not None and self.db.exists(session_id)
+
+    def _attach(self, store):
+        with self._lock:
+            self._stores.setdefault(store.session_id, store)
+
+    def evict_idle(self, force=False):
+        """卸载空闲超时的会话；常驻数超过上限时按最近访问时间卸载最旧的会话（跳过脚本运行中的会话）；
+        已卸载的会话从会话表中移除，需要时从SQLite重新打开"""
+        now = time.time()
+        if not force and now - self._last_check < EVICTION_CHECK_INTERVAL:
+            return 0
+        self._last_check = now
+        with self._lock:
+            resident = sorted((s for s in self._stores.values() if s.loaded), key=lambda s: s.last_access)
+        evicted = 0
+        excess = len(resident) - self.max_resident
+        for store in resident:
+            if now - store.last_access >= self.idle_seconds or excess > 0:
+                if store.unload():
+                    evicted += 1
+                    excess -= 1
+        with self._lock:
+            for session_id in [sid for sid, store in self._stores.items() if not store.loaded]:
+                del self._stores[session_id]
+        self.evictions += evicted
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            stores = list(self._stores.values())
+        resident = [s for s in stores if s.loaded]
+        return {
+            "sessions": len(stores),
+            "resident": len(resident),
+            "resident_chars": sum(s.pool.chars() for s in resident),
+            "evictions": self.evictions,
+        }
+
+
+# 将会话状态中的段落相关键绑定到存储
+def bind_session_state(state, store):
+    """sections_data 和各结果字典改为存储的视图；存储中有已保存的会话状态时恢复"""
+    state["sections_data"] = SectionsView(store)
+    for key, prefixes in SESSION_VIEWS.items():
+        state[key] = FieldView(store, prefixes)
+    for key in SESSION_META_KEYS:
+        if key in store.meta:
+            value = store.meta[key]
+            state[key] = set(value) if key == "confirmed_paragraphs" else value
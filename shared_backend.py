@@ -0,0 +1,392 @@
+# ==========================================
+# 多进程/多节点共享存储
+# 响应缓存、文档解析缓存和调用限速计数放在可替换的共享存储中，
+# 负载均衡后面的多个Streamlit进程共用同一份缓存和同一个API配额：
+# 默认使用本地SQLite文件 (WAL模式，同一台机器上的多个进程可以共用)，
+# 多台机器时配置 redis:// 地址；LocalRedis 是进程内的Redis替身，
+# 实现同一组客户端命令，不需要Redis服务就能走通Redis代码路径。
+# 共享存储出错时按未命中处理，不影响生成
+#
+# 环境变量:
+#   PSR_SHARED_BACKEND  sqlite:///路径 (默认 sqlite:///psr_shared.sqlite3) / redis://主机:端口/库 /
+#                       local-redis / none (不共享，各进程使用自己的缓存)
+#   PSR_WORKER_ID       工作进程名，同一台机器上运行多个进程时必须各不相同，默认为主机名；
+#                       设置后日志写入 psr_debug.<名称>.log
+# ==========================================
+import fnmatch
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+HAS_REDIS = False
+
+try:
+    # 使用Redis时才需要安装
+    import redis
+    HAS_REDIS = True
+except ImportError:
+    pass
+
+SHARED_BACKEND_ENV = "PSR_SHARED_BACKEND"
+WORKER_ID_ENV = "PSR_WORKER_ID"
+
+DEFAULT_SHARED_BACKEND = "sqlite:///psr_shared.sqlite3"
+
+# Redis中所有键的前缀
+DEFAULT_NAMESPACE = "psr:"
+
+# SQLite共享存储的容量上限，超出时按最近访问时间淘汰
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+# 其他进程持有写锁时的最长等待时间（秒）
+SQLITE_BUSY_TIMEOUT = 5.0
+
+# 每写入多少次检查一次过期条目和容量
+SQLITE_EVICT_EVERY = 50
+
+# 读取时最多每隔多少秒更新一次访问时间，减少跨进程写入
+SQLITE_ACCESS_UPDATE_INTERVAL = 60.0
+
+
+class SqliteSharedStore:
+    """本地SQLite共享存储：键值 + 过期时间，同一台机器上的多个进程共用一个文件"""
+
+    kind = "sqlite"
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.errors = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        # 自动提交模式，需要原子读改写的操作显式开启事务
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires REAL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_kv_accessed ON kv (accessed)")
+
+    @contextmanager
+    def _transaction(self):
+        """原子读改写：块内正常结束（包括提前return）时提交，抛出异常时回滚，不会提交一半的修改"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def get(self, key):
+        """读取值 (bytes)，不存在或已过期返回None"""
+        with self._lock:
+            try:
+                row = self._conn.execute("SELECT value, expires, accessed FROM kv WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                value, expires, accessed = row
+                now = time.time()
+                if expires is not None and expires <= now:
+                    self._conn.execute("DELETE FROM kv WHERE key = ? AND expires <= ?", (key, now))
+                    return None
+                if now - accessed > SQLITE_ACCESS_UPDATE_INTERVAL:
+                    self._conn.execute("UPDATE kv SET accessed = ? WHERE key = ?", (now, key))
+                return bytes(value)
+            except sqlite3.Error:
+                self.errors += 1
+                return None
+
+    def set(self, key, value, ttl=None):
+        """写入值，ttl为秒数，None表示不过期"""
+        value = _to_bytes(value)
+        with self._lock:
+            try:
+                now = time.time()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO kv (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), now + ttl if ttl else None, now),
+                )
+                self._after_write(now)
+            except sqlite3.Error:
+                self.errors += 1
+
+    def add(self, key, value, ttl=None):
+        """键不存在（或已过期）时写入并返回True，否则返回False"""
+        value = _to_bytes(value)
+        with self._lock:
+            try:
+                now = time.time()
+                with self._transaction():
+                    row = self._conn.execute("SELECT expires FROM kv WHERE key = ?", (key,)).fetchone()
+                    if row is not None and (row[0] is None or row[0] > now):
+                        return False
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO kv (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                        (key, value, len(value), now + ttl if ttl else None, now),
+                    )
+                    return True
+            except sqlite3.Error:
+                self.errors += 1
+                return False
+
+    def incr(self, key, ttl=None, amount=1):
+        """计数加amount并返回新值；计数不存在时从0开始并设置过期时间。出错返回None"""
+        with self._lock:
+            try:
+                now = time.time()
+                with self._transaction():
+                    row = self._conn.execute("SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone()
+                    if row is None or (row[1] is not None and row[1] <= now):
+                        count, expires = amount, (now + ttl if ttl else None)
+                    else:
+                        count, expires = int(row[0]) + amount, row[1]
+                    value = str(count).encode("ascii")
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO kv (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                        (key, value, len(value), expires, now),
+                    )
+                return count
+            except sqlite3.Error:
+                self.errors += 1
+                return None
+
+    def delete(self, key):
+        with self._lock:
+            try:
+                self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            except sqlite3.Error:
+                self.errors += 1
+
+    def clear(self, prefix):
+        """删除指定前缀的所有键"""
+        with self._lock:
+            try:
+                self._conn.execute("DELETE FROM kv WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+            except sqlite3.Error:
+                self.errors += 1
+
+    def count(self, prefix):
+        """指定前缀下未过期的条目数"""
+        with self._lock:
+            try:
+                return self._conn.execute(
+                    "SELECT COUNT(*) FROM kv WHERE substr(key, 1, ?) = ? AND (expires IS NULL OR expires > ?)",
+                    (len(prefix), prefix, time.time()),
+                ).fetchone()[0]
+            except sqlite3.Error:
+                self.errors += 1
+                return None
+
+    def stats(self):
+        return {"backend": self.kind, "location": self.path, "errors": self.errors}
+
+    def _after_write(self, now):
+        # 定期清除过期条目，再按最近访问时间淘汰直到总大小回到上限以内
+        self._writes += 1
+        if self._writes % SQLITE_EVICT_EVERY:
+            return
+        self._conn.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        if not self.max_bytes:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM kv").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM kv ORDER BY accessed ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            total -= size
+
+
+class RedisSharedStore:
+    """Redis共享存储，只使用 GET/SET(NX, EX)/INCRBY/DEL/SCAN，
+    兼容redis-py客户端和 LocalRedis 替身；容量由Redis的 maxmemory 策略控制"""
+
+    kind = "redis"
+
+    def __init__(self, client, namespace=DEFAULT_NAMESPACE, location="redis"):
+        self.client = client
+        self.namespace = namespace
+        self.location = location
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        try:
+            return self.client.get(self.namespace + key)
+        except Exception:
+            self._error()
+            return None
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.client.set(self.namespace + key, _to_bytes(value), ex=_ttl_seconds(ttl))
+        except Exception:
+            self._error()
+
+    def add(self, key, value, ttl=None):
+        try:
+            return bool(self.client.set(self.namespace + key, _to_bytes(value), ex=_ttl_seconds(ttl), nx=True))
+        except Exception:
+            self._error()
+            return False
+
+    def incr(self, key, ttl=None, amount=1):
+        try:
+            # 先用 SET NX EX 创建带过期时间的计数，再原子加一：
+            # 不会出现INCR成功而EXPIRE没有执行、计数永不过期的情况
+            if ttl:
+                self.client.set(self.namespace + key, b"0", ex=_ttl_seconds(ttl), nx=True)
+            return self.client.incr(self.namespace + key, amount)
+        except Exception:
+            self._error()
+            return None
+
+    def delete(self, key):
+        try:
+            self.client.delete(self.namespace + key)
+        except Exception:
+            self._error()
+
+    def clear(self, prefix):
+        try:
+            keys = list(self.client.scan_iter(match=self.namespace + prefix + "*"))
+            if keys:
+                self.client.delete(*keys)
+        except Exception:
+            self._error()
+
+    def count(self, prefix):
+        """Redis上逐个扫描键的代价较高，不统计条目数"""
+        return None
+
+    def stats(self):
+        return {"backend": self.kind, "location": self.location, "errors": self.errors}
+
+    def _error(self):
+        with self._lock:
+            self.errors += 1
+
+
+class LocalRedis:
+    """进程内的Redis替身，实现 RedisSharedStore 用到的客户端命令，语义与redis-py一致（值以bytes返回）"""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def ping(self):
+        return True
+
+    def get(self, name):
+        with self._lock:
+            return self._live(name)
+
+    def set(self, name, value, ex=None, nx=False):
+        name = _key_text(name)
+        with self._lock:
+            if nx and self._live(name) is not None:
+                return None
+            self._data[name] = _to_bytes(value)
+            if ex:
+                self._expires[name] = self._clock() + ex
+            else:
+                self._expires.pop(name, None)
+            return True
+
+    def incr(self, name, amount=1):
+        name = _key_text(name)
+        with self._lock:
+            value = int(self._live(name) or 0) + amount
+            self._data[name] = str(value).encode("ascii")
+            return value
+
+    def expire(self, name, time_seconds):
+        name = _key_text(name)
+        with self._lock:
+            if self._live(name) is None:
+                return False
+            self._expires[name] = self._clock() + time_seconds
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for name in map(_key_text, names):
+                if self._live(name) is not None:
+                    removed += 1
+                self._data.pop(name, None)
+                self._expires.pop(name, None)
+            return removed
+
+    def scan_iter(self, match=None):
+        with self._lock:
+            names = [name for name in list(self._data) if self._live(name) is not None]
+        return iter([name.encode("utf-8") for name in names if match is None or fnmatch.fnmatchcase(name, match)])
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+
+    def _live(self, name):
+        name = _key_text(name)
+        expires = self._expires.get(name)
+        if expires is not None and expires <= self._clock():
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+            return None
+        return self._data.get(name)
+
+
+def _key_text(name):
+    # 与Redis一致：str和bytes形式的键是同一个键
+    return name.decode("utf-8") if isinstance(name, bytes) else name
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+def _ttl_seconds(ttl):
+    # Redis的EX参数是整数秒
+    return max(1, math.ceil(ttl)) if ttl else None
+
+
+# 按配置创建共享存储
+def create_shared_store(url):
+    """url: sqlite:///路径、redis://...、local-redis 或 none；none 返回None（不共享）"""
+    url = (url or "").strip()
+    if not url or url.lower() == "none":
+        return None
+    if url.startswith("sqlite:///"):
+        return SqliteSharedStore(url[len("sqlite:///"):])
+    if url.lower() == "local-redis":
+        return RedisSharedStore(LocalRedis(), location="local-redis")
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        if not HAS_REDIS:
+            raise RuntimeError("使用Redis共享存储需要安装 redis 包 (pip install redis)")
+        client = redis.Redis.from_url(url)
+        client.ping()
+        return RedisSharedStore(client, location=url.split("@")[-1])
+    raise ValueError(f"无法识别的共享存储地址: {url}")
+
+
+# 当前工作进程名
+def worker_id(environ=None):
+    """PSR_WORKER_ID 未设置时使用主机名（容器中每个副本的主机名不同）"""
+    environ = os.environ if environ is None else environ
+    return environ.get(WORKER_ID_ENV) or socket.gethostname()
@@ -0,0 +1,128 @@
+# ==========================================
+# 自适应流式渲染
+# 流式输出时只重绘正在生成的段落，已完成的段落（遇到 ===SECTION===）
+# 固定在各自的占位符中不再重发；刷新间隔根据实测的渲染耗时自动放宽，
+# 使渲染耗时不超过墙钟时间的固定比例，总渲染量与输出长度成线性关系
+# ==========================================
+import time
+
+from section_parser import SECTION_DELIMITER
+
+# 默认刷新策略，与主循环的 BUFFER_SIZE / UPDATE_INTERVAL 一致
+DEFAULT_BUFFER_SIZE = 200
+DEFAULT_MIN_INTERVAL = 0.05
+DEFAULT_MAX_INTERVAL = 1.0
+
+# 渲染耗时占墙钟时间的目标比例
+RENDER_BUDGET_RATIO = 0.2
+
+# 渲染耗时的指数平滑系数
+COST_SMOOTHING = 0.3
+
+STREAMING_CURSOR_HTML = '<span class="streaming-cursor"></span>'
+
+
+class AdaptiveStreamRenderer:
+    """按段落分块渲染流式输出，并根据渲染耗时调整刷新间隔
+
+    new_placeholder() 每次返回一个新的占位符（需支持 markdown(text, unsafe_allow_html=...)），
+    例如 st.container().empty。
+    """
+
+    def __init__(self, new_placeholder, buffer_size=DEFAULT_BUFFER_SIZE, min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL, budget_ratio=RENDER_BUDGET_RATIO, split_sections=True,
+                 cursor_html=STREAMING_CURSOR_HTML, clock=time.perf_counter):
+        self.new_placeholder = new_placeholder
+        self.buffer_size = buffer_size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget_ratio = budget_ratio
+        self.split_sections = split_sections
+        self.cursor_html = cursor_html
+        self.clock = clock
+
+        self.interval = min_interval
+        self.avg_cost = 0.0
+        self._live = ""
+        self._live_placeholder = None
+        self._scan_from = 0
+        self._pending = 0
+        self._last_flush = clock()
+        self._closed = False
+
+        self.flushes = 0
+        self.frozen_sections = 0
+        self.rendered_chars = 0
+        self.render_seconds = 0.0
+
+    def feed(self, text):
+        """追加一段已清理的文本，必要时冻结已完成的段落或刷新当前段落"""
+        if not text:
+            return
+        self._live += text
+        self._pending += len(text)
+        if self.split_sections:
+            self._freeze_completed()
+
+        now = self.clock()
+        # 字符阈值随间隔同比例放宽，避免绕过退避
+        threshold = self.buffer_size * (self.interval / self.min_interval) if self.min_interval else self.buffer_size
+        if self._pending >= threshold or (now - self._last_flush) >= self.interval:
+            self._render(self._live + self.cursor_html)
+
+    def flush(self):
+        """立即渲染尚未显示的内容（带光标），不等待刷新间隔"""
+        if self._live and (self._pending or self._live_placeholder is None) and not self._closed:
+            self._render(self._live + self.cursor_html)
+
+    def close(self):
+        """输出结束，去掉光标完成最后一次渲染"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._live or self._live_placeholder is not None:
+            self._render(self._live)
+
+    def stats(self):
+        """返回渲染统计"""
+        return {
+            "flushes": self.flushes,
+            "frozen_sections": self.frozen_sections,
+            "rendered_chars": self.rendered_chars,
+            "render_seconds": self.render_seconds,
+            "avg_cost": self.avg_cost,
+            "interval": self.interval,
+        }
+
+    def _freeze_completed(self):
+        # 每个分隔符之前的内容是一个完整段落，最后渲染一次后固定
+        while True:
+            pos = self._live.find(SECTION_DELIMITER, self._scan_from)
+            if pos == -1:
+                # 分隔符可能被切在块边界上，下次从可能的起点继续查找
+                self._scan_from = max(0, len(self._live) - len(SECTION_DELIMITER) + 1)
+                return
+            if pos:
+                self._render(self._live[:pos])
+                self.frozen_sections += 1
+            # 分隔符留在下一段开头，保持与原始输出一致
+            self._live = self._live[pos:]
+            self._live_placeholder = None
+            self._scan_from = len(SECTION_DELIMITER)
+
+    def _render(self, text):
+        if self._live_placeholder is None:
+            self._live_placeholder = self.new_placeholder()
+        started = self.clock()
+        self._live_placeholder.markdown(text, unsafe_allow_html=True)
+        finished = self.clock()
+
+        cost = finished - started
+        self.flushes += 1
+        self.rendered_chars += len(text)
+        self.render_seconds += cost
+        self.avg_cost = cost if self.flushes == 1 else (1 - COST_SMOOTHING) * self.avg_cost + COST_SMOOTHING * cost
+        # 渲染越慢，刷新越稀疏：间隔 = 平均耗时 / 预算比例
+        self.interval = min(self.max_interval, max(self.min_interval, self.avg_cost / self.budget_ratio))
+        self._pending = 0
+        self._last_flush = finished
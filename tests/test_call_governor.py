@@ -0,0 +1,62 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import call_governor
+from call_governor import CallGovernor, is_rate_limit_error, is_retryable_error
+from model_backend import ResourceExhausted, ServiceUnavailable
+
+
+class CodedError(Exception):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+NON_RETRYABLE = [
+    ValueError("Prompt exceeds 1500 tokens"),
+    ValueError("max 4290 chars"),
+    ValueError("API key not valid (code 400), id 5003"),
+    CodedError("503 in the message but the status says otherwise", 400),
+]
+
+RETRYABLE = [
+    ResourceExhausted("quota"),
+    ServiceUnavailable("try later"),
+    CodedError("Too many requests", 429),
+    RuntimeError("503 The service is currently unavailable"),
+    RuntimeError("Deadline Exceeded"),
+]
+
+
+@pytest.mark.parametrize("error", NON_RETRYABLE, ids=str)
+def test_non_retryable_errors_are_not_retried(error, monkeypatch):
+    monkeypatch.setattr(call_governor.time, "sleep", lambda seconds: None)
+    governor = CallGovernor(requests_per_minute=6000, burst=100, max_retries=3)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise error
+
+    assert not is_retryable_error(error)
+    with pytest.raises(type(error)):
+        governor.call(fail)
+    assert len(calls) == 1
+    assert governor.stats()["retries"] == 0
+
+
+@pytest.mark.parametrize("error", RETRYABLE, ids=str)
+def test_retryable_errors(error):
+    assert is_retryable_error(error)
+
+
+def test_only_rate_limits_penalize_the_bucket():
+    assert is_rate_limit_error(ResourceExhausted("quota"))
+    assert is_rate_limit_error(RuntimeError("429 Resource has been exhausted"))
+    assert not is_rate_limit_error(ServiceUnavailable("503"))
+    assert not is_rate_limit_error(RuntimeError("503 after 4290 ms"))
+    assert not is_rate_limit_error(CodedError("request id 429", 500))
@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_cache import PromptParts, ServerContextCache
+
+
+class FakeBackend:
+    supports_context_cache = True
+
+    def __init__(self):
+        self.created = []
+        self.gates = {}
+        self.started = {}
+
+    def create_cached_content(self, model_name, task, prefix, ttl_seconds):
+        self.started.setdefault(prefix, threading.Event()).set()
+        gate = self.gates.get(prefix)
+        if gate is not None:
+            assert gate.wait(5)
+        self.created.append(prefix)
+        return f"cache/{len(self.created)}"
+
+    def create_model_from_cache(self, handle, task, config, prefix=""):
+        return f"model:{handle}"
+
+    def refresh_cached_content(self, handle, ttl_seconds):
+        pass
+
+
+class FakeRegistry:
+    model_name = "gemini-2.5-flash"
+    configure_calls = 1
+    task_configs = {}
+
+    def __init__(self):
+        self.backend = FakeBackend()
+
+    def get(self, task):
+        return "plain-model"
+
+
+def make_cache():
+    registry = FakeRegistry()
+    return registry, ServerContextCache(registry, min_tokens=0)
+
+
+def test_same_prefix_registers_once():
+    registry, cache = make_cache()
+    gate = registry.backend.gates["prefix A"] = threading.Event()
+    prompt = PromptParts("prefix A", " suffix")
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(cache.resolve, "analysis", prompt) for _ in range(4)]
+        assert registry.backend.started["prefix A"].wait(5)
+        gate.set()
+        results = [future.result(5) for future in futures]
+    assert registry.backend.created == ["prefix A"]
+    assert all(result == ("model:cache/1", [" suffix"]) for result in results)
+    assert cache.stats()["created"] == 1
+    assert cache.stats()["hits"] == 3
+
+
+def test_slow_registration_does_not_block_other_prefixes():
+    registry, cache = make_cache()
+    gate = registry.backend.gates["prefix A"] = threading.Event()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        slow = pool.submit(cache.resolve, "analysis", PromptParts("prefix A", ""))
+        assert registry.backend.started["prefix A"].wait(5)
+        # A 的注册仍在进行，B 的注册和统计读取不需要等待
+        fast = pool.submit(cache.resolve, "analysis", PromptParts("prefix B", ""))
+        assert fast.result(5)[0].startswith("model:")
+        assert cache.stats()["created"] == 1
+        gate.set()
+        assert slow.result(5)[0].startswith("model:")
+    assert sorted(registry.backend.created) == ["prefix A", "prefix B"]
+
+
+def test_failed_registration_falls_back_to_full_prompt():
+    registry, cache = make_cache()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("quota")
+
+    registry.backend.create_cached_content = fail
+    prompt = PromptParts("prefix A", " suffix")
+    assert cache.resolve("analysis", prompt) == ("plain-model", ["prefix A suffix"])
+    assert cache.resolve("analysis", prompt) == ("plain-model", ["prefix A suffix"])
+    assert cache.stats()["failures"] == 1
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import doc_ingest
+from doc_ingest import clear_ingest_cache, ingest_bytes
+
+
+class FakePage:
+    def __init__(self, number):
+        self.number = number
+
+    def extract_text(self):
+        return f"page {self.number}"
+
+
+class FakeReader:
+    """文件内容是页数的假PDF"""
+
+    def __init__(self, source):
+        if isinstance(source, BytesIO):
+            data = source.getvalue()
+        else:
+            with open(source, "rb") as f:
+                data = f.read()
+        self.pages = [FakePage(number) for number in range(int(data))]
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_ingest_cache()
+    yield
+    clear_ingest_cache()
+
+
+def test_same_file_hits_cache():
+    first = ingest_bytes("课程信息\nModule 1".encode("utf-8"), "course.txt")
+    second = ingest_bytes("课程信息\nModule 1".encode("utf-8"), "renamed.txt")
+    assert not first.cached
+    assert second.cached
+    assert second.text == first.text
+    assert second.content_hash == first.content_hash
+    assert not ingest_bytes(b"Module 2", "course.txt").cached
+
+
+def test_parallel_pdf_pages_keep_order(monkeypatch):
+    page_count = doc_ingest.PDF_PARALLEL_MIN_PAGES * 3 + 5
+    original = doc_ingest._extract_pdf_pages
+
+    def slow_early_chunks(path, start, end):
+        # 靠前的分片最后完成
+        time.sleep(0.002 * (page_count - start) / doc_ingest.PDF_PAGES_PER_TASK)
+        return original(path, start, end)
+
+    pool = ThreadPoolExecutor(max_workers=4)
+    monkeypatch.setattr(doc_ingest, "HAS_PDF", True)
+    monkeypatch.setattr(doc_ingest, "pypdf", types.SimpleNamespace(PdfReader=FakeReader), raising=False)
+    monkeypatch.setattr(doc_ingest, "_extract_pdf_pages", slow_early_chunks)
+    monkeypatch.setattr(doc_ingest, "_get_pool", lambda: pool)
+    monkeypatch.setattr(doc_ingest, "_worker_readers", type(doc_ingest._worker_readers)())
+    try:
+        result = ingest_bytes(str(page_count).encode("ascii"), "handbook.pdf")
+    finally:
+        pool.shutdown()
+    assert result.pages == page_count
+    assert result.text.split("\n")[:-1] == [f"page {number}" for number in range(page_count)]
+    assert ingest_bytes(str(page_count).encode("ascii"), "handbook.pdf").cached
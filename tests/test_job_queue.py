@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_queue import JOB_CANCELLED, JOB_DONE, JOB_QUEUED, JOB_RUNNING, JobQueue
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_cancel_queued_job_never_runs():
+    queue = JobQueue(max_workers=1, max_jobs_per_owner=4)
+    release = threading.Event()
+    ran = []
+    blocker = queue.submit("a", "blocker", lambda job: release.wait(5))
+    queued = queue.submit("a", "queued", lambda job: ran.append(job.job_id))
+    assert queued.status == JOB_QUEUED
+    assert queue.cancel(queued.job_id)
+    assert queued.status == JOB_CANCELLED
+    release.set()
+    assert wait_for(lambda: blocker.status == JOB_DONE)
+    queue._executor.shutdown(wait=True)
+    assert ran == []
+    assert queued.status == JOB_CANCELLED
+    assert queue.stats()["cancelled"] == 1
+
+
+def test_cancel_running_job_blocked_in_model_call():
+    queue = JobQueue(max_workers=1)
+    in_call = threading.Event()
+    release = threading.Event()
+    returned = threading.Event()
+
+    def long_call(job):
+        job.append("partial")
+        in_call.set()
+        # 模拟长时间没有输出的模型调用
+        release.wait(5)
+        try:
+            job.append(" more")
+        finally:
+            returned.set()
+
+    job = queue.submit("a", "analysis", long_call)
+    assert in_call.wait(5)
+    assert job.status == JOB_RUNNING
+    assert queue.cancel(job.job_id)
+    # 不等待阻塞的调用返回，任务立即结束
+    assert job.status == JOB_CANCELLED and not job.active
+    assert not queue.cancel(job.job_id)
+    release.set()
+    assert returned.wait(5)
+    queue._executor.shutdown(wait=True)
+    assert job.status == JOB_CANCELLED
+    assert job.text == "partial"
+    assert queue.stats()["cancelled"] == 1
+
+
+def test_cancelled_job_does_not_start_a_new_request():
+    queue = JobQueue(max_workers=1)
+    requests = []
+    release = threading.Event()
+
+    def retrying_call(job):
+        release.wait(5)
+        job.check_cancelled()
+        requests.append("request")
+
+    job = queue.submit("a", "analysis", retrying_call)
+    assert wait_for(lambda: job.status == JOB_RUNNING)
+    queue.cancel(job.job_id)
+    release.set()
+    queue._executor.shutdown(wait=True)
+    assert requests == []
+    assert job.status == JOB_CANCELLED
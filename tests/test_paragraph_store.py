@@ -0,0 +1,77 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from paragraph_store import ParagraphStore, rebuild_store_from_state
+
+
+def expected_text(paragraphs):
+    return "\n\n".join(paragraphs[idx] for idx in sorted(paragraphs))
+
+
+def check(store, paragraphs):
+    assert store.text == expected_text(paragraphs)
+    for idx in paragraphs:
+        start, end = store.segment(idx)
+        assert store.text[start:end] == paragraphs[idx]
+
+
+def test_out_of_order_confirms_keep_paragraph_order():
+    store = ParagraphStore()
+    paragraphs = {}
+    store.text
+    for idx in (3, 0, 5, 1, 4, 2):
+        paragraphs[idx] = f"Paragraph {idx}."
+        assert store.set(idx, paragraphs[idx])
+        check(store, paragraphs)
+    assert store.indices == [0, 1, 2, 3, 4, 5]
+
+
+def test_edits_and_removals_splice_in_place():
+    store = ParagraphStore()
+    paragraphs = {idx: f"Paragraph {idx}." for idx in (4, 1, 2)}
+    for idx, text in paragraphs.items():
+        store.set(idx, text)
+    check(store, paragraphs)
+    paragraphs[2] = "第二段修改后更长的内容。"
+    assert store.set(2, paragraphs[2])
+    check(store, paragraphs)
+    assert not store.set(2, paragraphs[2])
+    # 空白内容视为移除
+    assert store.set(1, "   ")
+    del paragraphs[1]
+    check(store, paragraphs)
+    assert store.remove(4)
+    del paragraphs[4]
+    check(store, paragraphs)
+
+
+def test_random_operations_match_full_rebuild():
+    rng = random.Random(13)
+    store = ParagraphStore()
+    paragraphs = {}
+    for step in range(300):
+        idx = rng.randrange(12)
+        if rng.random() < 0.2:
+            store.remove(idx)
+            paragraphs.pop(idx, None)
+        else:
+            paragraphs[idx] = f"P{idx} v{step}" + " word" * rng.randrange(5)
+            store.set(idx, paragraphs[idx])
+        if step % 7 == 0:
+            check(store, paragraphs)
+    check(store, paragraphs)
+
+
+def test_rebuild_from_state_uses_latest_paragraph_text():
+    state = {
+        "paragraph_store": ParagraphStore(),
+        "sections_data": [{"draft": "D0"}, {"draft": "D1"}, {"draft": "D2"}],
+        "confirmed_paragraphs": {2, 0, 7},
+        "confirmed_contents": {2: "C2"},
+        "refine_results": {"para_0": "R0"},
+        "draft_p_0": "   ",
+    }
+    assert rebuild_store_from_state(state) == "R0\n\nC2"
@@ -0,0 +1,42 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import estimate_tokens
+from prompt_budget import MIN_CURRICULUM_TOKENS, fit_analysis_inputs
+from psr_core import build_analysis_prompt
+
+SCHOOL = "University of Edinburgh"
+MAJOR = "MSc Data Science"
+STRATEGY = "突出量化研究经历，弱化实习。"
+COURSE = "\n\n".join(f"Module {i}: Statistical learning, Bayesian inference and data mining." for i in range(400))
+
+
+def test_cjk_is_counted_per_character():
+    assert estimate_tokens("我热爱数学和统计学") == 9
+    assert estimate_tokens("ひらがな") == 4
+    assert estimate_tokens("statistics") == 3
+
+
+def test_budget_counts_the_strategy_wrapper():
+    ps = "My interest began in high school. " * 20
+    result = fit_analysis_inputs(SCHOOL, MAJOR, ps, COURSE, False, STRATEGY, budget=4000)
+    prompt = build_analysis_prompt(SCHOOL, MAJOR, ps, result.course_text, False, STRATEGY)
+    assert result.template_tokens > fit_analysis_inputs(SCHOOL, MAJOR, ps, COURSE, False, "", budget=4000).template_tokens
+    assert abs(result.total_tokens - estimate_tokens(prompt)) <= 5
+    assert result.total_tokens <= 4000 + 5
+
+
+def test_over_budget_breakdown():
+    ps = "我在本科阶段系统学习了概率论与数理统计。" * 300
+    result = fit_analysis_inputs(SCHOOL, MAJOR, ps, COURSE, False, STRATEGY, budget=4000)
+    assert result.over_budget
+    assert result.fixed_tokens == result.template_tokens + result.target_tokens + result.ps_tokens + result.strategy_tokens
+    assert result.fixed_tokens > result.budget
+    assert result.course_tokens_after <= MIN_CURRICULUM_TOKENS
+    message = result.over_budget_message()
+    assert f"旧 PS 约 {result.ps_tokens}" in message
+    assert f"写作策略约 {result.strategy_tokens}" in message
+    assert f"模板及学校专业约 {result.template_tokens + result.target_tokens}" in message
+    assert f"合计约 {result.fixed_tokens} tokens，本身已超出预算 4000" in message
@@ -0,0 +1,64 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_cache import ResponseCache
+from text_cleaning import MODEL_OUTPUT_PIPELINE
+
+
+def stream_clean(text, size=5):
+    cleaner = MODEL_OUTPUT_PIPELINE.stream()
+    return "".join(cleaner.feed(text[i:i + size]) for i in range(0, len(text), size)) + cleaner.flush()
+
+
+def test_cached_analysis_round_trip_is_cleaned_once(tmp_path):
+    # 与全文分析一致：缓存流式清理后的结果，命中时原样使用
+    raw = "让我为您分析\n下面我将开始\n\n正文"
+    cleaned = stream_clean(raw)
+    assert cleaned == "下面我将开始\n\n正文"
+    key = ResponseCache.make_key("gemini-2.5-flash", "prompt")
+    db_path = str(tmp_path / "responses.sqlite3")
+    ResponseCache(db_path=db_path).set(key, cleaned)
+    assert ResponseCache(db_path=db_path).get(key) == cleaned
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"
+    cache.set("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    assert cache.stats()["memory_entries"] == 2
+
+
+def test_sqlite_tier_hit_after_restart(tmp_path):
+    db_path = str(tmp_path / "responses.sqlite3")
+    ResponseCache(db_path=db_path).set("k", "value")
+    restarted = ResponseCache(db_path=db_path)
+    assert restarted.get("k") == "value"
+    assert restarted.get("k") == "value"
+    stats = restarted.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 0)
+
+
+def test_sqlite_tier_drops_expired_entries(tmp_path):
+    db_path = str(tmp_path / "responses.sqlite3")
+    ResponseCache(db_path=db_path).set("k", "value")
+    assert ResponseCache(db_path=db_path, ttl_seconds=-1).get("k") is None
+
+
+def test_key_is_stable_and_covers_every_input():
+    key = ResponseCache.make_key("gemini-2.5-flash", "prompt", [b"img"], "US")
+    assert key == ResponseCache.make_key("gemini-2.5-flash", "prompt", [b"img"], "US")
+    assert len(key) == 64
+    variants = [
+        ResponseCache.make_key("gemini-2.5-pro", "prompt", [b"img"], "US"),
+        ResponseCache.make_key("gemini-2.5-flash", "prompt!", [b"img"], "US"),
+        ResponseCache.make_key("gemini-2.5-flash", "prompt", [b"img2"], "US"),
+        ResponseCache.make_key("gemini-2.5-flash", "prompt", [], "US"),
+        ResponseCache.make_key("gemini-2.5-flash", "prompt", [b"img"], "UK"),
+    ]
+    assert len(set(variants + [key])) == len(variants) + 1
@@ -0,0 +1,106 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from section_parser import (
+    DRAFT_MARKER, LOGIC_MARKER, SECTION_DELIMITER, SectionStreamParser, iter_sections, parse_section,
+    parse_sections,
+)
+
+RESPONSE = (
+    "===SECTION===\n[[LOGIC]]\n本段功能识别：[动机]\n修改思路：保留原有经历。\n"
+    "[[DRAFT]]\nMy interest began in high school. 这里补充一句关于课程的说明。\n"
+    "===SECTION===\n[[LOGIC]]\n本段功能识别：[学术背景]\n[[DRAFT]]\nI studied statistics [with honours].\n"
+    "===SECTION===\n[[LOGIC]]\n本段功能识别：[择校理由]\n整段重写。\n[[DRAFT]]\n整段重写的段落内容，不含任何英文。\n"
+)
+
+EXPECTED = [
+    {"logic": "本段功能识别：[动机]\n修改思路：保留原有经历。",
+     "draft": "My interest began in high school. 这里补充一句关于课程的说明。"},
+    {"logic": "本段功能识别：[学术背景]", "draft": "I studied statistics [with honours]."},
+    {"logic": "本段功能识别：[择校理由]\n整段重写。", "draft": "整段重写的段落内容，不含任何英文。"},
+]
+
+
+def reference_parse(text):
+    """与流式解析无关的参考实现：整体按分隔符切分后逐段解析"""
+    return [section for section in map(parse_section, text.split(SECTION_DELIMITER)) if section is not None]
+
+
+def feed_all(chunks):
+    parser = SectionStreamParser()
+    sections = []
+    for chunk in chunks:
+        sections.extend(parser.feed(chunk))
+    sections.extend(parser.close())
+    assert parser.sections == sections
+    return sections
+
+
+def marker_positions(text):
+    """所有标记在文本中覆盖的位置（切分点落在标记内部）"""
+    positions = set()
+    for marker in (SECTION_DELIMITER, LOGIC_MARKER, DRAFT_MARKER):
+        start = text.find(marker)
+        while start != -1:
+            positions.update(range(start + 1, start + len(marker)))
+            start = text.find(marker, start + 1)
+    return sorted(positions)
+
+
+def test_parse_sections_matches_expected_and_reference():
+    assert parse_sections(RESPONSE) == EXPECTED
+    assert reference_parse(RESPONSE) == EXPECTED
+
+
+@pytest.mark.parametrize("split", range(1, len(RESPONSE)))
+def test_every_two_chunk_split(split):
+    assert feed_all([RESPONSE[:split], RESPONSE[split:]]) == parse_sections(RESPONSE)
+
+
+def test_splits_inside_every_marker():
+    positions = marker_positions(RESPONSE)
+    assert positions
+    for first in positions:
+        for second in positions:
+            if second <= first:
+                continue
+            chunks = [RESPONSE[:first], RESPONSE[first:second], RESPONSE[second:]]
+            assert feed_all(chunks) == EXPECTED, (first, second)
+
+
+def test_single_character_chunks():
+    assert feed_all(list(RESPONSE)) == EXPECTED
+
+
+@pytest.mark.parametrize("size", [2, 3, 5, 7, 13, len(SECTION_DELIMITER) - 1, len(SECTION_DELIMITER)])
+def test_fixed_size_chunks(size):
+    chunks = [RESPONSE[i:i + size] for i in range(0, len(RESPONSE), size)]
+    assert feed_all(chunks) == EXPECTED
+
+
+def test_section_emitted_when_closing_delimiter_arrives():
+    parser = SectionStreamParser()
+    second_delimiter = RESPONSE.find(SECTION_DELIMITER, 1)
+    # 第一段的结束分隔符被切成两半：前半块不产出段落
+    half = second_delimiter + len(SECTION_DELIMITER) // 2
+    assert parser.feed(RESPONSE[:half]) == []
+    assert parser.feed(RESPONSE[half:second_delimiter + len(SECTION_DELIMITER)]) == EXPECTED[:1]
+    assert parser.pending_text == ""
+    rest = parser.feed(RESPONSE[second_delimiter + len(SECTION_DELIMITER):])
+    assert rest == EXPECTED[1:2]
+    assert parser.close() == EXPECTED[2:]
+
+
+def test_text_without_markers_is_skipped():
+    text = "Sure, here is the analysis.\n" + RESPONSE + SECTION_DELIMITER + "\n谢谢！\n"
+    assert feed_all([text[:40], text[40:]]) == EXPECTED
+    assert parse_sections(text) == reference_parse(text) == EXPECTED
+
+
+def test_iter_sections_over_chunks():
+    chunks = [RESPONSE[i:i + 11] for i in range(0, len(RESPONSE), 11)]
+    assert list(iter_sections(chunks)) == EXPECTED
@@ -0,0 +1,85 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import session_store
+from session_store import SessionRegistry, bind_session_state
+
+
+@pytest.fixture
+def registry(tmp_path):
+    # 空闲时间为0、常驻上限为0：每次检查都会尝试卸载所有会话
+    return SessionRegistry(db_path=str(tmp_path / "sessions.sqlite3"), idle_seconds=0, max_resident=0)
+
+
+def open_session(registry, session_id):
+    store = registry.open(session_id)
+    state = {}
+    bind_session_state(state, store)
+    store.load_sections([{"logic": "L1", "draft": "D1"}, {"logic": "L2", "draft": "D2"}])
+    return store, state
+
+
+def test_running_session_is_not_evicted(registry):
+    running, _ = open_session(registry, "running")
+    idle, _ = open_session(registry, "idle")
+    running.begin_run()
+    assert registry.evict_idle(force=True) == 1
+    assert running.loaded and not idle.loaded
+    running.end_run()
+    assert registry.evict_idle(force=True) == 1
+    assert not running.loaded
+
+
+def test_interrupted_run_lease_expires(registry, monkeypatch):
+    store, _ = open_session(registry, "a")
+    store.begin_run()
+    monkeypatch.setattr(session_store, "RUN_LEASE_SECONDS", 0)
+    assert registry.evict_idle(force=True) == 1
+
+
+def test_unload_replaces_records_list(registry):
+    store, _ = open_session(registry, "a")
+    records = store.loaded_records()
+    assert store.unload()
+    assert len(records) == 2
+
+
+def test_views_write_through_after_unload(registry):
+    store, state = open_session(registry, "a")
+    section = state["sections_data"][1]
+    assert store.unload()
+    section["draft"] = "D2 edited"
+    state["refine_results"]["para_0"] = "R1"
+    assert store.loaded
+    assert store.unload()
+    assert state["sections_data"][1]["draft"] == "D2 edited"
+    assert state["refine_results"]["para_0"] == "R1"
+    assert [s["logic"] for s in state["sections_data"]] == ["L1", "L2"]
+
+
+def test_extend_sections_keeps_existing_records(registry):
+    store, state = open_session(registry, "a")
+    state["sections_data"][0]["draft"] = "D1 edited"
+    store.extend_sections([{"logic": "L3", "draft": "D3"}])
+    assert [s["draft"] for s in state["sections_data"]] == ["D1 edited", "D2", "D3"]
+
+
+def test_evicted_sessions_leave_the_registry(registry):
+    for session_id in ("a", "b", "c"):
+        open_session(registry, session_id)
+    assert registry.evict_idle(force=True) == 3
+    assert registry.stats()["sessions"] == 0
+    assert registry.exists("a") and not registry.exists("unknown")
+    reopened = registry.open("a")
+    assert [record["draft"] for record in reopened.loaded_records()] == ["D1", "D2"]
+
+
+def test_reloaded_view_rejoins_the_registry(registry):
+    store, state = open_session(registry, "a")
+    assert registry.evict_idle(force=True) == 1
+    assert state["sections_data"][0]["draft"] == "D1"
+    assert registry.open("a") is store
@@ -0,0 +1,117 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import call_governor
+from call_governor import SharedRateLimiter
+from response_cache import ResponseCache
+from shared_backend import LocalRedis, RedisSharedStore, SqliteSharedStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["sqlite", "local-redis"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SqliteSharedStore(str(tmp_path / "shared.sqlite3"))
+    return RedisSharedStore(LocalRedis())
+
+
+def test_incr_sets_ttl_with_first_count(tmp_path):
+    clock = FakeClock()
+    store = RedisSharedStore(LocalRedis(clock=clock))
+    assert store.incr("counter", ttl=60) == 1
+    assert store.incr("counter", ttl=60) == 2
+    clock.now += 61
+    assert store.get("counter") is None
+    assert store.incr("counter", ttl=60) == 1
+
+
+def test_incr_amount(store):
+    assert store.incr("counter", ttl=60) == 1
+    assert store.incr("counter", ttl=60, amount=-1) == 0
+    assert int(store.get("counter")) == 0
+
+
+def test_clear_keeps_shared_entries_unless_requested(store):
+    writer = ResponseCache(shared=store)
+    reader = ResponseCache(shared=store)
+    writer.set("k", "value")
+    writer.clear()
+    assert writer.get("k") == "value"
+    assert reader.get("k") == "value"
+    writer.clear(shared=True)
+    assert ResponseCache(shared=store).get("k") is None
+
+
+def test_local_clear_empties_sqlite_tier(tmp_path):
+    cache = ResponseCache(db_path=str(tmp_path / "responses.sqlite3"))
+    cache.set("k", "value")
+    cache.clear()
+    assert cache.get("k") is None
+    assert cache.stats()["disk_entries"] == 0
+
+
+def test_rejected_attempts_do_not_use_quota(store, monkeypatch):
+    now = [60 * 1000 + 10.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(call_governor, "time", types.SimpleNamespace(time=lambda: now[0], sleep=sleep,
+                                                                     monotonic=lambda: now[0]))
+    limiter = SharedRateLimiter(store, "key", rate_per_minute=2, capacity=100)
+    window_key = f"{limiter.key}:{int(now[0] // 60)}"
+    limiter.acquire()
+    limiter.acquire()
+    assert int(store.get(window_key)) == 2
+    # 第三次在当前窗口被拒绝，等到下一个窗口才占用名额
+    limiter.acquire()
+    assert len(sleeps) == 1
+    assert int(store.get(window_key)) == 2
+    assert int(store.get(f"{limiter.key}:{int(now[0] // 60)}")) == 1
+
+
+def test_lost_race_returns_the_slot(store, monkeypatch):
+    now = [60 * 1000 + 10.0]
+    monkeypatch.setattr(call_governor, "time", types.SimpleNamespace(
+        time=lambda: now[0], sleep=lambda seconds: now.__setitem__(0, now[0] + seconds), monotonic=lambda: now[0]))
+    limiter = SharedRateLimiter(store, "key", rate_per_minute=1, capacity=100)
+    window_key = f"{limiter.key}:{int(now[0] // 60)}"
+    # 另一个进程在本进程读取计数之后抢先占用了最后的名额
+    original_incr = store.incr
+    calls = []
+
+    def racing_incr(key, ttl=None, amount=1):
+        if not calls:
+            original_incr(key, ttl=ttl)
+        calls.append(amount)
+        return original_incr(key, ttl=ttl, amount=amount)
+
+    monkeypatch.setattr(store, "incr", racing_incr)
+    limiter.acquire()
+    assert calls[:2] == [1, -1]
+    assert int(store.get(window_key)) == 1
+
+
+def test_failed_incr_rolls_back(tmp_path):
+    store = SqliteSharedStore(str(tmp_path / "shared.sqlite3"))
+    store.set("counter", "not a number")
+    with pytest.raises(ValueError):
+        store.incr("counter")
+    assert not store._conn.in_transaction
+    assert store.get("counter") == b"not a number"
+    assert store.incr("other", ttl=60) == 1
+    assert store.add("lock", "1") and not store.add("lock", "2")
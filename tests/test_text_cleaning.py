@@ -0,0 +1,48 @@
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from text_cleaning import GREETING_PATTERNS, MODEL_OUTPUT_PIPELINE, strip_greetings
+
+BODY = "===SECTION===\n[[LOGIC]]\n本段功能识别：[动机]\n[[DRAFT]]\nMy interest began in high school.\n"
+
+SAMPLES = [
+    BODY,
+    "好的，作为您的留学文书顾问，我来分析。\n\n" + BODY,
+    "让我为您分析\n下面我将开始\n\n" + BODY,
+    "下面我将开始\n让我为您分析\n\n" + BODY,
+    "作为顾问\n作为顾问\n" + BODY,
+    "我将为您分析这篇文书\n我会尽力帮助您\n" + BODY,
+    "我将为您分析这篇文书\n" + BODY,
+    "作为一名学生，我热爱数学。\n" + BODY,
+    "下面我将",
+    "",
+]
+
+
+def reference_filter(text):
+    """原 filter_ai_greeting：每条规则按顺序各执行一次"""
+    for pattern in GREETING_PATTERNS:
+        text = re.sub("^" + pattern, "", text, flags=re.DOTALL)
+    return text
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_strip_greetings_matches_original_filter(text):
+    assert strip_greetings(text) == reference_filter(text)
+
+
+def test_chained_greetings_keep_later_lines():
+    assert strip_greetings("让我为您分析\n下面我将开始\n\n正文") == "下面我将开始\n\n正文"
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+@pytest.mark.parametrize("size", [1, 3, 7, 64])
+def test_streaming_matches_full_clean(text, size):
+    cleaner = MODEL_OUTPUT_PIPELINE.stream()
+    output = "".join(cleaner.feed(text[i:i + size]) for i in range(0, len(text), size)) + cleaner.flush()
+    assert output == MODEL_OUTPUT_PIPELINE.clean(text)
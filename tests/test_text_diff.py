@@ -0,0 +1,83 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import pytest
+
+import text_diff
+from corpus import perturb_text, synthetic_corpus
+from text_diff import diff_tokens, tokenize
+
+LONG_TEXTS = {item.name: item.text[:10000] for item in synthetic_corpus() if item.name.startswith("long")}
+
+
+def apply_opcodes(a, b, opcodes):
+    """按操作列表从a重建b，同时检查操作连续覆盖两个序列"""
+    rebuilt = []
+    i = j = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == (i, j)
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+        rebuilt.extend(b[j1:j2])
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+    return rebuilt
+
+
+def changed_tokens(opcodes):
+    return sum(i2 - i1 + j2 - j1 for tag, i1, i2, j1, j2 in opcodes if tag != "equal")
+
+
+def test_identical_text_is_single_equal():
+    a = tokenize("I studied statistics. 我学习了统计学。")
+    assert diff_tokens(a, a) == [("equal", 0, len(a), 0, len(a))]
+
+
+def test_short_edit_is_minimal():
+    a = tokenize("My interest began in high school.")
+    b = tokenize("My interest in data began in middle school.")
+    opcodes = diff_tokens(a, b)
+    assert apply_opcodes(a, b, opcodes) == b
+    assert changed_tokens(opcodes) == 6
+
+
+@pytest.mark.parametrize("name", sorted(LONG_TEXTS))
+def test_perturbed_long_text_keeps_token_level_detail(name):
+    a_text = LONG_TEXTS[name]
+    b_text = perturb_text(a_text, random.Random(name))
+    a, b = tokenize(a_text), tokenize(b_text)
+    opcodes = diff_tokens(a, b)
+    assert apply_opcodes(a, b, opcodes) == b
+    # 约5%的改动不应退化为整句或整段替换
+    assert changed_tokens(opcodes) < 0.3 * (len(a) + len(b))
+
+
+@pytest.mark.parametrize("name", sorted(LONG_TEXTS))
+def test_rewrite_falls_back_to_replace_within_work_budget(name, monkeypatch):
+    calls = []
+    original = text_diff._myers
+
+    def counting_myers(*args):
+        ops = original(*args)
+        calls.append(args[-1].remaining)
+        return ops
+
+    monkeypatch.setattr(text_diff, "_myers", counting_myers)
+    others = [text for other, text in LONG_TEXTS.items() if other != name]
+    a, b = tokenize(LONG_TEXTS[name]), tokenize(others[0])
+    opcodes = diff_tokens(a, b)
+    assert apply_opcodes(a, b, opcodes) == b
+    assert calls and min(calls) >= 0
+    assert any(tag == "replace" for tag, *_ in opcodes)
+
+
+def test_exhausted_budget_still_produces_valid_diff(monkeypatch):
+    monkeypatch.setattr(text_diff, "MAX_MYERS_WORK", 0)
+    a_text = LONG_TEXTS["long_mixed"]
+    b_text = perturb_text(a_text, random.Random(0))
+    a, b = tokenize(a_text), tokenize(b_text)
+    assert apply_opcodes(a, b, diff_tokens(a, b)) == b
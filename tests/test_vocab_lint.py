@@ -0,0 +1,76 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from vocab_lint import BANNED_VOCABULARY, banned_vocabulary_prompt, highlight_lint_html, lint_text
+
+
+def flagged(text, kind=None):
+    return [text[issue.start:issue.end] for issue in lint_text(text).issues if kind is None or issue.kind == kind]
+
+
+@pytest.mark.parametrize("text, word", [
+    ("I hope to master statistics.", "master"),
+    ("My goal is to study data science.", "My goal is to"),
+    ("I look forward to the course.", "look forward to"),
+    ("The module addressed my gaps.", "addressed"),
+    ("I was drawn to causal inference.", "drawn"),
+    ("It is a testament to my effort.", "testament"),
+    ("Building on this foundation, I applied.", "Building on this foundation"),
+    ("I intend to pursue a PhD.", "intend to"),
+])
+def test_banned_words_are_errors(text, word):
+    result = lint_text(text)
+    assert word in flagged(text, "banned")
+    assert result.failed
+
+
+@pytest.mark.parametrize("text", [
+    "My mastermind classmates shared notes.",
+    "The drawer held a withdrawal form.",
+    "Commander Smith trained the commanders of the unit.",
+    "She was an addressee of the letter.",
+    "A redrawn map replaced the old one.",
+])
+def test_banned_word_substrings_are_not_flagged(text):
+    assert flagged(text, "banned") == []
+
+
+def test_demonstrate_is_allowed_once():
+    text = "I demonstrate rigour. The project demonstrated rigour."
+    result = lint_text(text)
+    assert [text[i.start:i.end] for i in result.warnings if i.kind == "banned"] == ["demonstrated"]
+    assert not result.failed
+
+
+def test_comma_ing_structure():
+    assert flagged("I completed the project, demonstrating my skills.", "comma_ing") == ["demonstrating"]
+    assert flagged("I finished the thesis, thereby showing my range.", "comma_ing") == ["showing"]
+    assert flagged("I took courses in statistics, including regression.", "comma_ing") == []
+    assert flagged("I enjoy reading, writing, and coding.", "comma_ing") == []
+
+
+def test_adverbs_are_warnings():
+    result = lint_text("I deeply care about family and daily practice; however, I rely on data.")
+    assert [text for text in flagged(result.text, "adverb")] == ["deeply", "however"]
+    assert not result.failed
+
+
+def test_clean_text_has_no_issues():
+    result = lint_text("I studied statistics at university; the coursework shaped my interest in data.")
+    assert result.issues == []
+    assert result.summary() == "未发现禁用词和禁用句式"
+
+
+def test_prompt_lists_every_banned_entry():
+    prompt = banned_vocabulary_prompt()
+    assert prompt.splitlines() == [f"       - {label}" for label, _, _ in BANNED_VOCABULARY]
+
+
+def test_highlight_escapes_text():
+    html_text = highlight_lint_html(lint_text("<b>I intend to</b> apply"))
+    assert html_text.startswith("&lt;b&gt;I <mark class=\"lint-error\"")
+    assert "intend to</mark>&lt;/b&gt; apply" in html_text
@@ -0,0 +1,146 @@
+# ==========================================
+# 模型输出清理流水线
+# 清理规则在构造时确定，问候语规则预先编译：去除星号、段落标记和开头的问候语；
+# 流式版本按块处理，对可能被切断的标记和尚未确定的开头问候语保留缓冲
+# ==========================================
+import re
+
+# 开头问候语和介绍语，按顺序各尝试一次（与原 filter_ai_greeting 一致：
+# 前面的规则去掉一行后，后面的规则还可以再去掉一行，但同一条规则不会连续去除多行）
+GREETING_PATTERNS = (
+    r'好的，作为.*?顾问.*?\n+',
+    r'作为.*?顾问.*?\n+',
+    r'我将.*?分析.*?\n+',
+    r'下面我将.*?\n+',
+    r'我会.*?帮助您.*?\n+',
+    r'让我.*?为您.*?\n+',
+)
+
+# 各条问候语规则的开头（与 GREETING_PATTERNS 一一对应），用于流式处理时判断是否需要继续缓冲
+GREETING_PREFIXES = ("好的，作为", "作为", "我将", "下面我将", "我会", "让我")
+
+SECTION_MARKERS = ("[[LOGIC]]", "[[DRAFT]]")
+
+# 流式处理时开头最多缓冲的字符数，超过后不再等待问候语结束
+GREETING_DECISION_LIMIT = 2000
+
+_GREETING_RES = tuple(re.compile("^" + pattern, re.DOTALL) for pattern in GREETING_PATTERNS)
+
+
+class CleaningPipeline:
+    """一次遍历完成所有字符级清理的流水线"""
+
+    def __init__(self, strip_asterisks=True, strip_markers=False, strip_greeting=True, strip_bold_only=False):
+        self.strip_greeting = strip_greeting
+        self.markers = SECTION_MARKERS if strip_markers else ()
+        # 需要删除的字面量在构造时确定；字面量删除用str.replace（C实现）比正则替换更快
+        tokens = list(self.markers)
+        if strip_asterisks:
+            tokens.append("*")
+        elif strip_bold_only:
+            tokens.append("**")
+        self._tokens = tuple(tokens)
+
+    def strip(self, text):
+        """去除星号/标记等字符级内容"""
+        if not text:
+            return ""
+        for token in self._tokens:
+            if token in text:
+                text = text.replace(token, "")
+        return text
+
+    def clean(self, text):
+        """对完整文本执行整个流水线"""
+        text = self.strip(text)
+        if self.strip_greeting:
+            text = strip_greetings(text)
+        return text
+
+    def stream(self):
+        """创建一个按块处理的流式清理器"""
+        return StreamingCleaner(self)
+
+
+class StreamingCleaner:
+    """流式清理器：feed() 返回可以立即输出的已清理文本，flush() 输出剩余缓冲"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self._carry = ""
+        self._head = ""
+        self._head_done = not pipeline.strip_greeting
+
+    def feed(self, chunk):
+        if not chunk:
+            return ""
+        text = self._carry + chunk
+        self._carry = ""
+        # 保留可能是被切断的标记或星号的结尾部分
+        keep = _partial_marker_length(text, self.pipeline.markers)
+        if keep:
+            text, self._carry = text[:-keep], text[-keep:]
+        text = self.pipeline.strip(text)
+        if self._head_done:
+            return text
+
+        self._head += text
+        if not self._head_resolved():
+            return ""
+        head, self._head = strip_greetings(self._head), ""
+        self._head_done = True
+        return head
+
+    def flush(self):
+        text = self.pipeline.strip(self._carry)
+        self._carry = ""
+        if not self._head_done:
+            text = strip_greetings(self._head + text)
+            self._head = ""
+            self._head_done = True
+        return text
+
+    def _head_resolved(self):
+        head = self._head
+        if len(head) >= GREETING_DECISION_LIMIT or "===SECTION===" in head:
+            return True
+        # 与 strip_greetings 相同的顺序逐条检查：已完整出现的问候语（其后已有非换行字符）跳过，
+        # 某条规则仍可能在后续文本到达后匹配时继续缓冲
+        for regex, prefix in zip(_GREETING_RES, GREETING_PREFIXES):
+            match = regex.match(head)
+            if match is None:
+                if head.startswith(prefix) or prefix.startswith(head):
+                    return False
+                continue
+            if match.end() == len(head):
+                # 问候语后的换行可能还没有结束
+                return False
+            head = head[match.end():]
+        return True
+
+
+# 去除开头的问候语
+def strip_greetings(text):
+    """按顺序对每条规则各尝试一次，去除开头的问候语和介绍语"""
+    for regex in _GREETING_RES:
+        match = regex.match(text)
+        if match:
+            text = text[match.end():]
+    return text
+
+
+def _partial_marker_length(text, markers):
+    # 计算结尾处可能是某个标记前缀的最长长度
+    longest = 0
+    for marker in markers:
+        for size in range(min(len(marker) - 1, len(text)), longest, -1):
+            if text.endswith(marker[:size]):
+                longest = size
+                break
+    return longest
+
+
+# 预置流水线
+MODEL_OUTPUT_PIPELINE = CleaningPipeline(strip_asterisks=True, strip_greeting=True)
+DOCX_LINE_PIPELINE = CleaningPipeline(strip_asterisks=False, strip_markers=True, strip_greeting=False)
+BOLD_PIPELINE = CleaningPipeline(strip_asterisks=False, strip_greeting=False, strip_bold_only=True)
@@ -0,0 +1,306 @@
+# ==========================================
+# 文本差异比较引擎
+# 按英文单词 / 单个中文字符 / 空白 / 标点切分词元，
+# 长文本先按句子比较，只在改动的句子内部比较词元；词元级先用patience算法以唯一公共词元为锚点切分，
+# 再对间隙运行Myers O((N+M)D)算法，输出行内插入/删除片段并渲染为HTML
+#
+# 延迟预算：10,000字符的段落（约5%改动或整段重写）应在 DIFF_LATENCY_BUDGET_MS 内完成，
+# 由 benchmarks/run_benchmarks.py 的 diff_budget 用例检查；Myers超出工作量上限时该间隙整体视为替换
+# ==========================================
+import html
+import re
+from bisect import bisect_left
+
+DIFF_LATENCY_BUDGET_MS = 50
+
+# Myers算法允许的最大编辑距离，超过后将该间隙整体视为替换，避免大段重写时退化为O(N*M)
+MAX_EDIT_COST = 1000
+
+# 一次比较中Myers算法的总工作量上限（对角线扩展与词元比较的步数），
+# 用尽后剩余的间隙整体视为替换，保证整段重写也在延迟预算内
+MAX_MYERS_WORK = 60000
+
+# 句子结尾词元；词元数达到 SEGMENT_MIN_TOKENS 时先按句子比较
+_SEGMENT_END_TOKENS = frozenset(("。", "！", "？", "；", ".", "!", "?", ";"))
+SEGMENT_MIN_TOKENS = 400
+
+# patience锚点切分的最大递归深度
+MAX_PATIENCE_DEPTH = 32
+
+_TOKEN_PATTERN = re.compile(
+    r"[A-Za-z0-9]+(?:['’\-][A-Za-z0-9]+)*"  # 英文单词（含缩写和连字符）
+    r"|[\u4e00-\u9fff]"                     # 单个中文字符
+    r"|\s+"                                 # 连续空白
+    r"|.",                                  # 其他单个字符（标点等）
+    re.DOTALL,
+)
+
+
+# 将文本切分为词元
+def tokenize(text):
+    """将文本切分为英文单词、中文字符、空白和标点词元，拼接后与原文完全一致"""
+    return _TOKEN_PATTERN.findall(text)
+
+
+# 计算两个词元序列的差异
+def diff_tokens(a, b):
+    """返回difflib风格的操作列表 [(tag, i1, i2, j1, j2)]，tag为equal/insert/delete/replace"""
+    # 将词元映射为整数，加快比较
+    ids = {}
+    a_ids = [ids.setdefault(tok, len(ids)) for tok in a]
+    b_ids = [ids.setdefault(tok, len(ids)) for tok in b]
+
+    edits = []
+    budget = _WorkBudget(MAX_MYERS_WORK)
+    if len(a_ids) + len(b_ids) < SEGMENT_MIN_TOKENS:
+        _diff_range(a_ids, 0, len(a_ids), b_ids, 0, len(b_ids), edits, 0, budget)
+    else:
+        _diff_segments(a, a_ids, b, b_ids, edits, budget)
+    return _merge_opcodes(edits)
+
+
+class _WorkBudget:
+    """一次比较中Myers算法剩余的工作量"""
+
+    __slots__ = ("remaining",)
+
+    def __init__(self, remaining):
+        self.remaining = remaining
+
+
+def _segment_bounds(tokens):
+    # 按句末标点和换行切分为 [(起, 止)] 词元区间
+    bounds = []
+    start = 0
+    for pos, tok in enumerate(tokens):
+        if tok in _SEGMENT_END_TOKENS or (tok.isspace() and "\n" in tok):
+            bounds.append((start, pos + 1))
+            start = pos + 1
+    if start < len(tokens):
+        bounds.append((start, len(tokens)))
+    return bounds
+
+
+def _diff_segments(a, a_ids, b, b_ids, out, budget):
+    # 先比较句子序列：相同的句子整体相等；改动的句子数目相同时逐句比较词元，
+    # 否则对整个改动区间比较词元。逐句比较不保证全局最小，但修改类改动的结果一致
+    a_bounds = _segment_bounds(a)
+    b_bounds = _segment_bounds(b)
+    seg_ids = {}
+    a_segs = [seg_ids.setdefault(tuple(a_ids[lo:hi]), len(seg_ids)) for lo, hi in a_bounds]
+    b_segs = [seg_ids.setdefault(tuple(b_ids[lo:hi]), len(seg_ids)) for lo, hi in b_bounds]
+    seg_edits = []
+    _diff_range(a_segs, 0, len(a_segs), b_segs, 0, len(b_segs), seg_edits, 0, budget)
+
+    for tag, i1, i2, j1, j2 in _merge_opcodes(seg_edits):
+        a_lo = a_bounds[i1][0] if i1 < len(a_bounds) else len(a_ids)
+        a_hi = a_bounds[i2 - 1][1] if i2 > i1 else a_lo
+        b_lo = b_bounds[j1][0] if j1 < len(b_bounds) else len(b_ids)
+        b_hi = b_bounds[j2 - 1][1] if j2 > j1 else b_lo
+        if tag == "equal":
+            out.append(("equal", a_lo, a_hi, b_lo, b_hi))
+        elif tag == "replace" and i2 - i1 == j2 - j1:
+            for offset in range(i2 - i1):
+                (sa_lo, sa_hi), (sb_lo, sb_hi) = a_bounds[i1 + offset], b_bounds[j1 + offset]
+                _diff_range(a_ids, sa_lo, sa_hi, b_ids, sb_lo, sb_hi, out, 0, budget)
+        else:
+            _diff_range(a_ids, a_lo, a_hi, b_ids, b_lo, b_hi, out, 0, budget)
+
+
+def _diff_range(a, a_lo, a_hi, b, b_lo, b_hi, out, depth, budget):
+    # 去除公共前缀
+    while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+        out.append(("equal", a_lo, a_lo + 1, b_lo, b_lo + 1))
+        a_lo += 1
+        b_lo += 1
+    # 去除公共后缀（稍后再追加）
+    suffix = 0
+    while a_lo < a_hi - suffix and b_lo < b_hi - suffix and a[a_hi - suffix - 1] == b[b_hi - suffix - 1]:
+        suffix += 1
+    a_end, b_end = a_hi - suffix, b_hi - suffix
+
+    if a_lo == a_end or b_lo == b_end:
+        if a_lo < a_end:
+            out.append(("delete", a_lo, a_end, b_lo, b_lo))
+        if b_lo < b_end:
+            out.append(("insert", a_lo, a_lo, b_lo, b_end))
+    else:
+        anchors = _patience_anchors(a, a_lo, a_end, b, b_lo, b_end) if depth < MAX_PATIENCE_DEPTH else []
+        if anchors:
+            prev_a, prev_b = a_lo, b_lo
+            for ia, ib in anchors:
+                _diff_range(a, prev_a, ia, b, prev_b, ib, out, depth + 1, budget)
+                out.append(("equal", ia, ia + 1, ib, ib + 1))
+                prev_a, prev_b = ia + 1, ib + 1
+            _diff_range(a, prev_a, a_end, b, prev_b, b_end, out, depth + 1, budget)
+        else:
+            ops = _myers(a, a_lo, a_end, b, b_lo, b_end, MAX_EDIT_COST, budget)
+            if ops is None:
+                out.append(("replace", a_lo, a_end, b_lo, b_end))
+            else:
+                out.extend(ops)
+
+    for offset in range(suffix, 0, -1):
+        out.append(("equal", a_hi - offset, a_hi - offset + 1, b_hi - offset, b_hi - offset + 1))
+
+
+def _patience_anchors(a, a_lo, a_hi, b, b_lo, b_hi):
+    # 找出在两个区间中都只出现一次的词元
+    counts = {}
+    for i in range(a_lo, a_hi):
+        entry = counts.get(a[i])
+        counts[a[i]] = [i, -1, 1, 0] if entry is None else [entry[0], -1, entry[2] + 1, 0]
+    for j in range(b_lo, b_hi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[1] = j
+            entry[3] += 1
+    pairs = sorted((entry[0], entry[1]) for entry in counts.values() if entry[2] == 1 and entry[3] == 1)
+    if not pairs:
+        return []
+
+    # 对b侧位置求最长递增子序列，得到按顺序匹配的锚点
+    tails = []
+    tail_idx = []
+    prev = [-1] * len(pairs)
+    for idx, (_, jb) in enumerate(pairs):
+        pos = bisect_left(tails, jb)
+        if pos == len(tails):
+            tails.append(jb)
+            tail_idx.append(idx)
+        else:
+            tails[pos] = jb
+            tail_idx[pos] = idx
+        prev[idx] = tail_idx[pos - 1] if pos > 0 else -1
+
+    anchors = []
+    idx = tail_idx[-1]
+    while idx != -1:
+        anchors.append(pairs[idx])
+        idx = prev[idx]
+    anchors.reverse()
+    return anchors
+
+
+def _myers(a, a_lo, a_hi, b, b_lo, b_hi, max_d, budget):
+    # 标准Myers贪心算法，保存每一轮的V数组用于回溯；编辑距离超过max_d或工作量用尽时返回None
+    n, m = a_hi - a_lo, b_hi - b_lo
+    limit = min(max_d, n + m)
+    offset = limit + 1
+    v = [0] * (2 * limit + 3)
+    trace = []
+    work = 0
+    for d in range(limit + 1):
+        # 每一轮处理 d+1 条对角线，另加本轮的对角线扩展
+        work += d + 1
+        if work > budget.remaining:
+            budget.remaining = 0
+            return None
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            snake_start = x
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            work += x - snake_start
+            v[offset + k] = x
+            if x >= n and y >= m:
+                trace.append(v[offset - d:offset + d + 1])
+                budget.remaining -= work
+                return _myers_backtrack(trace, n, m, a_lo, b_lo)
+        trace.append(v[offset - d:offset + d + 1])
+    budget.remaining -= work
+    return None
+
+
+def _myers_backtrack(trace, n, m, a_lo, b_lo):
+    ops = []
+    x, y = n, m
+    for d in range(len(trace) - 1, 0, -1):
+        prev_v = trace[d - 1]
+        k = x - y
+        if k == -d or (k != d and prev_v[k - 1 + d - 1] < prev_v[k + 1 + d - 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = prev_v[prev_k + d - 1]
+        prev_y = prev_x - prev_k
+        # 编辑操作之后的对角线部分为相同词元
+        if prev_k == k + 1:
+            mid_x, mid_y = prev_x, prev_y + 1
+        else:
+            mid_x, mid_y = prev_x + 1, prev_y
+        while x > mid_x and y > mid_y:
+            x -= 1
+            y -= 1
+            ops.append(("equal", a_lo + x, a_lo + x + 1, b_lo + y, b_lo + y + 1))
+        if prev_k == k + 1:
+            ops.append(("insert", a_lo + prev_x, a_lo + prev_x, b_lo + prev_y, b_lo + prev_y + 1))
+        else:
+            ops.append(("delete", a_lo + prev_x, a_lo + prev_x + 1, b_lo + prev_y, b_lo + prev_y))
+        x, y = prev_x, prev_y
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        ops.append(("equal", a_lo + x, a_lo + x + 1, b_lo + y, b_lo + y + 1))
+    ops.reverse()
+    return ops
+
+
+def _merge_opcodes(edits):
+    # 合并相邻同类操作；相邻的删除和插入合并为替换
+    merged = []
+    for tag, i1, i2, j1, j2 in edits:
+        if merged:
+            last_tag, li1, li2, lj1, lj2 = merged[-1]
+            if last_tag == tag or (last_tag != "equal" and tag != "equal"):
+                new_tag = tag if last_tag == tag else "replace"
+                merged[-1] = (new_tag, li1, i2, lj1, j2)
+                continue
+        merged.append((tag, i1, i2, j1, j2))
+    return merged
+
+
+# 生成带高亮的HTML差异
+def render_diff_html(original_text, new_text, inserted_class="modified-text", deleted_class="deleted-text"):
+    """比较两段文本，新增内容用高亮span包裹，删除内容用del标签包裹"""
+    a = tokenize(original_text or "")
+    b = tokenize(new_text or "")
+    opcodes = _absorb_whitespace(diff_tokens(a, b), a, b)
+
+    parts = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            parts.append(html.escape("".join(b[j1:j2])))
+            continue
+        if tag in ("delete", "replace") and i1 < i2:
+            parts.append(f"<del class='{deleted_class}'>{html.escape(''.join(a[i1:i2]))}</del>")
+        if tag in ("insert", "replace") and j1 < j2:
+            parts.append(f"<span class='{inserted_class}'>{html.escape(''.join(b[j1:j2]))}</span>")
+    return "".join(parts)
+
+
+def _absorb_whitespace(opcodes, a, b):
+    # 两处修改之间只隔着空白时合并为一处，避免逐词碎片化的高亮
+    result = []
+    idx = 0
+    while idx < len(opcodes):
+        op = opcodes[idx]
+        if (op[0] == "equal" and result and result[-1][0] != "equal" and idx + 1 < len(opcodes)
+                and opcodes[idx + 1][0] != "equal" and not "".join(b[op[3]:op[4]]).strip()):
+            nxt = opcodes[idx + 1]
+            prev = result.pop()
+            result.append(("replace", prev[1], nxt[2], prev[3], nxt[4]))
+            idx += 2
+            continue
+        if op[0] != "equal" and result and result[-1][0] != "equal":
+            prev = result.pop()
+            result.append(("replace", prev[1], op[2], prev[3], op[4]))
+        else:
+            result.append(op)
+        idx += 1
+    return result
@@ -0,0 +1,172 @@
+# ==========================================
+# 英文用词与句式检查
+# 翻译和英文精修提示词中的禁用词表集中定义在这里，提示词和本地检查共用；
+# 禁用词编译为一个正则，一次扫描找出全部命中；副词和 ", -ing" 分词结构按启发式规则检测。
+# 只有存在错误级问题的段落才需要重新调用模型
+# ==========================================
+import html
+import re
+
+# 问题级别：错误需要修正，提醒只做高亮
+SEVERITY_ERROR = "error"
+SEVERITY_WARNING = "warning"
+
+# 禁用词表：(提示词中的写法, 匹配的词形, 允许出现的次数)
+# 词形是正则片段，匹配时不区分大小写并要求完整单词
+BANNED_VOCABULARY = (
+    ("master / mastery", r"master(?:s|ed|ing|y|ful)?", 0),
+    ("my goal is to", r"my\s+goal\s+is\s+to", 0),
+    ("permit", r"permit(?:s|ted|ting)?", 0),
+    ("deep comprehension", r"deep\s+comprehension", 0),
+    ("look forward to", r"look(?:s|ed|ing)?\s+forward\s+to", 0),
+    ("address", r"address(?:es|ed|ing)?", 0),
+    ("command", r"command(?:s|ed|ing)?", 0),
+    ("drawn to / draw", r"dr(?:aw|aws|awn|ew|awing)", 0),
+    ("privilege", r"privileg(?:e|es|ed)", 0),
+    ("testament", r"testaments?", 0),
+    ("commitment", r"commitments?", 0),
+    ("tenure", r"tenure", 0),
+    ("thereby / thereby doing", r"thereby", 0),
+    ("cultivate", r"cultivat(?:e|es|ed|ing|ion)", 0),
+    ("Building on this / Building on this foundation", r"building\s+on\s+this(?:\s+foundation)?", 0),
+    ("intend to", r"intend(?:s|ed)?\s+to", 0),
+    ("demonstrate (use sparingly, avoid frequent appearance)", r"demonstrat(?:e|es|ed|ing)", 1),
+)
+
+# 提示词中禁用词表的缩进
+PROMPT_LIST_INDENT = "       "
+
+# 作为逻辑连接的副词（不以-ly结尾）
+CONNECTIVE_ADVERBS = frozenset((
+    "however", "moreover", "furthermore", "therefore", "thus", "hence", "meanwhile", "nevertheless",
+    "nonetheless", "indeed", "besides", "otherwise", "very", "also",
+))
+
+# 以-ly结尾但不是副词的常见词
+NON_ADVERB_LY = frozenset((
+    "ally", "anomaly", "apply", "assembly", "belly", "bully", "butterfly", "comply", "costly", "curly",
+    "daily", "elderly", "early", "emily", "family", "fly", "friendly", "holy", "homely", "hourly", "imply",
+    "italy", "jelly", "july", "kelly", "likely", "lily", "lively", "lonely", "lovely", "monopoly", "monthly",
+    "multiply", "only", "orderly", "quarterly", "rally", "rely", "reply", "scholarly", "silly", "sly",
+    "supply", "timely", "ugly", "underly", "unlikely", "weekly", "yearly",
+))
+
+# 逗号后常见的非分词-ing词（介词、名词）
+NON_PARTICIPLE_ING = frozenset((
+    "according", "anything", "building", "ceiling", "concerning", "during", "engineering", "evening",
+    "everything", "excluding", "following", "including", "king", "morning", "nothing", "pending",
+    "regarding", "ring", "sibling", "something", "spring", "string", "thing", "wing",
+))
+
+_BANNED_RE = re.compile(
+    "|".join(rf"(?P<b{idx}>\b{pattern}\b)" for idx, (_, pattern, _) in enumerate(BANNED_VOCABULARY)),
+    re.IGNORECASE,
+)
+# 候选副词：-ly结尾的词和连接副词，再排除非副词
+_ADVERB_RE = re.compile(r"\b(?:[A-Za-z]{3,}ly|" + "|".join(sorted(CONNECTIVE_ADVERBS)) + r")\b", re.IGNORECASE)
+# 逗号 + (可选的 thus/thereby) + -ing词，后面不是并列结构
+_COMMA_ING_RE = re.compile(r",\s+(?:(?:thus|thereby)\s+)?([A-Za-z]+ing)\b(?!\s*(?:,|\.|;|$|and\b|or\b))")
+
+
+class LintIssue:
+    """一处问题：在文本中的位置、类别、级别和说明"""
+
+    __slots__ = ("start", "end", "kind", "severity", "rule", "message")
+
+    def __init__(self, start, end, kind, severity, rule, message):
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.severity = severity
+        self.rule = rule
+        self.message = message
+
+    def as_dict(self):
+        return {"start": self.start, "end": self.end, "kind": self.kind, "severity": self.severity,
+                "rule": self.rule, "message": self.message}
+
+
+class LintResult:
+    """一段文本的检查结果"""
+
+    def __init__(self, text, issues):
+        self.text = text
+        self.issues = issues
+
+    @property
+    def errors(self):
+        return [issue for issue in self.issues if issue.severity == SEVERITY_ERROR]
+
+    @property
+    def warnings(self):
+        return [issue for issue in self.issues if issue.severity == SEVERITY_WARNING]
+
+    @property
+    def failed(self):
+        """存在错误级问题，需要重新调用模型修正"""
+        return any(issue.severity == SEVERITY_ERROR for issue in self.issues)
+
+    def summary(self):
+        if not self.issues:
+            return "未发现禁用词和禁用句式"
+        return f"{len(self.errors)} 处需修正，{len(self.warnings)} 处提醒"
+
+
+# 生成提示词中的禁用词列表
+def banned_vocabulary_prompt(indent=PROMPT_LIST_INDENT):
+    """与原提示词格式一致：每行 "- 写法" """
+    return "\n".join(f"{indent}- {label}" for label, _, _ in BANNED_VOCABULARY)
+
+
+# 检查一段英文
+def lint_text(text):
+    """返回 LintResult；问题按出现位置排序，重叠时保留先出现的禁用词命中"""
+    issues = []
+    if not text:
+        return LintResult(text, issues)
+
+    counts = {}
+    for match in _BANNED_RE.finditer(text):
+        idx = int(match.lastgroup[1:])
+        label, _, allowed = BANNED_VOCABULARY[idx]
+        counts[idx] = counts.get(idx, 0) + 1
+        if counts[idx] > allowed:
+            severity = SEVERITY_ERROR if allowed == 0 else SEVERITY_WARNING
+            message = f"禁用词: {label}" if allowed == 0 else f"出现过多 (最多 {allowed} 次): {label}"
+            issues.append(LintIssue(match.start(), match.end(), "banned", severity, label, message))
+
+    for match in _COMMA_ING_RE.finditer(text):
+        word = match.group(1).lower()
+        if word in NON_PARTICIPLE_ING:
+            continue
+        issues.append(LintIssue(match.start(1), match.end(1), "comma_ing", SEVERITY_ERROR, ", -ing",
+                                f"主句 + , + -ing 分词结构: {match.group(1)}"))
+
+    for match in _ADVERB_RE.finditer(text):
+        if match.group(0).lower() not in NON_ADVERB_LY:
+            issues.append(LintIssue(match.start(), match.end(), "adverb", SEVERITY_WARNING, "adverb",
+                                    f"副词: {match.group(0)}"))
+
+    issues.sort(key=lambda issue: (issue.start, issue.severity != SEVERITY_ERROR))
+    deduped = []
+    for issue in issues:
+        if deduped and issue.start < deduped[-1].end:
+            continue
+        deduped.append(issue)
+    return LintResult(text, deduped)
+
+
+# 生成高亮HTML
+def highlight_lint_html(result):
+    """错误用红色、提醒用黄色标出，悬停显示说明；其余文本转义后原样输出"""
+    text = result.text or ""
+    parts = []
+    position = 0
+    for issue in result.issues:
+        parts.append(html.escape(text[position:issue.start]))
+        css_class = "lint-error" if issue.severity == SEVERITY_ERROR else "lint-warning"
+        parts.append(f'<mark class="{css_class}" title="{html.escape(issue.message)}">'
+                     f"{html.escape(text[issue.start:issue.end])}</mark>")
+        position = issue.end
+    parts.append(html.escape(text[position:]))
+    return "".join(parts).replace("\n", "<br>")